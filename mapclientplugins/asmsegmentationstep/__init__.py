@@ -5,5 +5,11 @@ __version__ = '0.2.0'
 __author__ = 'Ju Zhang'
 __stepname__ = 'ASM Segmentation'
 
-# import class that derives itself from the step mountpoint.
-from mapclientplugins.asmsegmentationstep import step
+# import class that derives itself from the step mountpoint. Without the
+# MAP Client and PySide6, e.g. on a render node, the headless modules
+# (batch, sweep, benchmark, asmseg) are still importable.
+try:
+    from mapclientplugins.asmsegmentationstep import step
+except ImportError as e:
+    if (e.name or '').split('.')[0] not in ('mapclient', 'PySide6'):
+        raise
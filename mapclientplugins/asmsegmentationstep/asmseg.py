@@ -2,36 +2,159 @@
 Active shape model automatic segmentation
 implemented in GIAS and using Fieldwork models.
 """
+import concurrent.futures
+import copy
+import multiprocessing
+import os
+import threading
 import numpy as np
 import time
 
+import configobj
+
 from gias3.image_analysis import fw_segmentation_tools as fst
 from gias3.image_analysis import asm_segmentation as ASM
+from gias3.learning import PCA_fitting
+
+from mapclientplugins.asmsegmentationstep import asmsolver
+from mapclientplugins.asmsegmentationstep import featurestore
+from mapclientplugins.asmsegmentationstep import landmarkdensity
+from mapclientplugins.asmsegmentationstep import multistart
+from mapclientplugins.asmsegmentationstep import ppccache
+from mapclientplugins.asmsegmentationstep import profiling
+from mapclientplugins.asmsegmentationstep import pyramid
+from mapclientplugins.asmsegmentationstep import roi
+from mapclientplugins.asmsegmentationstep import runner
+from mapclientplugins.asmsegmentationstep import sampling
+from mapclientplugins.asmsegmentationstep import scanviews
+
+
+DEFAULT_PARAMS_FILE = os.path.join(os.path.dirname(__file__), 'default_params.ini')
+
+# names of the values returned by ASMSegmentation.segment
+ASM_OUTPUT_VARS = ['segXOpt', 'segData', 'segDataWeight', 'segDataLandmarkMask',
+                   'segRMS', 'segSD', 'segPFrac', 'segProfileMatchM', 'segProfileM',
+                   'segHistory']
+
+OBJECT_WORKERS = ('process', 'thread')
+DEFAULT_OBJECT_WORKERS = 'process'
+
+_objectWorker = {}
 
 
 class ParameterError(Exception):
     pass
 
 
-def segment(scan, model, shapepcs, config):
-    # parse configs
-    verbose = config['general']['verbose']
+class SegmentationCancelled(Exception):
+    pass
+
+
+class CancelToken(object):
+    """
+    Thread-safe flag used to ask a running segment() to stop. It is checked
+    after every ASM iteration and between pyramid levels. event may be a
+    multiprocessing.Event, to cancel a segmentation in another process.
+    """
+
+    def __init__(self, event=None):
+        self._event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def reset(self):
+        self._event.clear()
+
+    def isCancelled(self):
+        return self._event.is_set()
+
+
+def loadParams(paramFileLoc='', ppcFileLoc=''):
+    """
+    Load segmentation parameters from a params .ini file, falling back
+    to default_params.ini if paramFileLoc is empty.
+    """
+    if paramFileLoc == '':
+        paramFileLoc = DEFAULT_PARAMS_FILE
+    params = configobj.ConfigObj(paramFileLoc, unrepr=True)
+    params['data_files']['ppc_filename'] = ppcFileLoc
+    return params
+
+
+def _initialiseASM(asmParams, ppc, model, shapepcs, shapeModes, mahalanobisWeight, doScale,
+                   timer=None, checkCancel=None, level=0, featureStore=None):
+    """
+    As fst.initialiseGFASM in PCXiGrid/PCDPEP mode, but using the given
+    profile PCs instead of loading them from asmParams.PPCFilename, and
+    returning an instrumented asmsolver.ASMSolver.
+    """
+    GFCoordEval, GFGetParams = fst.makeGFEvaluator(
+        'PCXiGrid', model, PC=shapepcs, PCModes=shapeModes, GD=asmParams.GD,
+    )
+    GFNormalEval = fst.makeGFNormalEvaluator(
+        'PCXiGrid', model, PC=shapepcs, PCModes=shapeModes, GD=asmParams.GD,
+    )
+    GFFitter = fst.makeMeshFit(
+        'PCDPEP',
+        SSM=shapepcs,
+        SSMModes=shapeModes,
+        GF=model,
+        GD=asmParams.GD,
+        mahalanobis_weight=mahalanobisWeight,
+        epIndex=None,
+        GFCoordEval=GFCoordEval,
+        initRotation=None,
+        do_scale=doScale,
+        landmark_targets=None,
+        landmark_evaluator=None,
+        landmark_weights=None,
+    )
+    epI = model.getElementPointIPerTrueElement(
+        asmParams.GD, list(model.ensemble_field_function.mesh.elements.keys())
+    )
+
+    asm = asmsolver.ASMSolver(
+        params=asmParams,
+        getMeshCoords=GFCoordEval,
+        getMeshNormals=GFNormalEval,
+        fitMesh=GFFitter,
+        timer=timer,
+        checkCancel=checkCancel,
+        level=level,
+        featureStore=featureStore,
+    )
+    asm.setProfilePC(ppc)
+    asm.setElementXIndices(epI)
+
+    return asm, GFCoordEval, GFGetParams, GFFitter
+
+
+def _runGFASM(asm, scan, model, shapepcs, shapeModes, paramsEval, filterLandmarks, verbose, callback=None):
+    """
+    As fst.runGFASM in PCDPEP mode, but passing callback on to
+    ASMSegmentation.segment to be called after every iteration.
+    """
+    asm.setImage(scan)
+    asm.filterLandmarks = filterLandmarks
+
+    # PC mode weights and rigid transform of the current shape
+    with asm.timer.stage('x0', level=asm.level):
+        x0 = PCA_fitting.fitSSMTo3DPoints(
+            model.get_all_point_positions(), shapepcs, shapeModes, m_weight=0.5,
+        )[0]
     if verbose:
-        print(config)
+        print('x0:', x0)
 
-    flipX = config['image']['flip_x']
-    flipY = config['image']['flip_y']
-    flipZ = config['image']['flip_z']
-    NEGSPACING = config['image']['neg_spacing']
-    ZSHIFT = config['image']['z_shift']
+    asmOutput = dict(zip(ASM_OUTPUT_VARS, asm.segment(x0, verbose=verbose, debug=0, callback=callback)))
+    with asm.timer.stage('paramsEval', level=asm.level):
+        asmOutput['segPOpt'] = paramsEval(asmOutput['segXOpt'].copy())
+
+    return asmOutput
 
-    PPCFilename = config['data_files']['ppc_filename']
-    if PPCFilename is None:
-        raise ParameterError('PPCFilename not set')
 
-    asmConfigs = config['ASM']
-    asmShapeModes = asmConfigs['shape_modes']
-    asmParams = ASM.ASMSegmentationParams(**{
+def _makeASMParams(asmConfigs, PPCFilename, zShift, negSpacing, verbose):
+    return ASM.ASMSegmentationParams(**{
         'PPCFilename': PPCFilename,
         'GD': asmConfigs['mesh_d'],
         'ND': asmConfigs['n_d'],
@@ -44,54 +167,534 @@ def segment(scan, model, shapepcs, config):
         'passWindow': asmConfigs['pass_window'],
         'minPassFrac': asmConfigs['min_pass_frac'],
         'maxIt': asmConfigs['max_it'],
+        'sampleOrder': asmConfigs.get('sample_order', sampling.DEFAULT_ORDER),
+        'sampleChunkMB': asmConfigs.get('sample_chunk_mb', sampling.DEFAULT_CHUNK_MB),
+        'adaptiveLandmarks': asmConfigs.get('adaptive_landmarks', False),
+        'adaptiveStartFrac': asmConfigs.get('adaptive_start_frac', landmarkdensity.DEFAULT_START_FRAC),
+        'adaptiveRefineFailFrac': asmConfigs.get('adaptive_refine_fail_frac', landmarkdensity.DEFAULT_REFINE_FAIL_FRAC),
+        'adaptiveRefineFailFactor': asmConfigs.get('adaptive_refine_fail_factor',
+                                                   landmarkdensity.DEFAULT_REFINE_FAIL_FACTOR),
+        'adaptiveRefineMFactor': asmConfigs.get('adaptive_refine_m_factor', landmarkdensity.DEFAULT_REFINE_M_FACTOR),
+        'stopWindow': asmConfigs.get('stop_window', 3),
+        'stopParamTol': asmConfigs.get('stop_param_tol', 0.0),
+        'stopRMSTol': asmConfigs.get('stop_rms_tol', 0.0),
+        'stopPFracTol': asmConfigs.get('stop_pfrac_tol', 0.0),
         'filterLandmarks': asmConfigs['filter_landmarks'],
-        'imageZShift': ZSHIFT,
-        'imageNegSpacing': NEGSPACING,
+        'imageZShift': zShift,
+        'imageNegSpacing': negSpacing,
         'verbose': verbose,
     })
-    asmFitMWeight = asmConfigs['fit_mweight']
-    filterLandmarks = asmConfigs['filter_landmarks']
-    fitSize = asmConfigs['fit_size']
-
-    # ===========================================================================#
-    t0 = time.time()
-    tprev = t0
-
-    # initialise image
-    if flipX:
-        scan.I = scan.I[::-1, :, :]
-    if flipY:
-        scan.I = scan.I[:, ::-1, :]
-    if flipZ:
-        scan.I = scan.I[:, :, ::-1]
-
-    # run ASM function
-    asmOutput, asm, GF, croppedScan, \
-    meshEval, paramsEval, meshFit = fst.doASM(
-        asmParams, scan, model, 'PCXiGrid',
-        'PCDPEP', asmParams.GD, shapepcs,
-        np.arange(asmShapeModes), None,
-        asmFitMWeight, verbose=verbose,
-        filter_landmarks=filterLandmarks,
-        do_scale=fitSize,
-        landmark_targets=None,
-        landmark_evaluator=None,
-        landmark_weights=None,
-    )
 
-    dataASM = asmOutput['segData']
-    meshParamsASM = asmOutput['segXOpt']
-    model.set_field_parameters(paramsEval(meshParamsASM))
+
+def _cancelledOutput(best, paramsEval):
+    """
+    asmOutput of a cancelled ASM pass from its best iteration, or with no
+    result (segXOpt None) if it was cancelled before the first iteration
+    finished.
+    """
+    asmOutput = {
+        'segXOpt': None,
+        'segData': np.zeros((0, 3)),
+        'segRMS': np.nan,
+        'segPFrac': 0.0,
+        'segHistory': {'meshParams': [], 'meshRMS': [], 'meshSD': [], 'passFrac': [], 'mahaDist': [], 'mRMS': [],
+                       'nLandmarks': [], 'paramDelta': [], 'time': []},
+        'segPOpt': None,
+        'cancelled': True,
+    }
+    if best is not None:
+        asmOutput.update(best)
+        asmOutput['segPOpt'] = paramsEval(best['segXOpt'].copy())
+    return asmOutput
+
+
+def _runASMPass(scan, model, shapepcs, asmConfigs, PPCFilename, zShift, negSpacing, verbose,
+                level=0, callback=None, cancelToken=None, timer=None, featureStore=None):
+    """
+    Run one ASM pass on scan starting from the current shape of model.
+    model is updated to the segmented shape. If given, callback is called
+    with a dict of the pass's progress after every ASM iteration. If
+    cancelToken is cancelled the pass stops at the next stage boundary
+    and returns its best iteration so far, with asmOutput['cancelled'] set.
+    Stages are recorded in timer, a profiling.StageTimer. Spline filtered
+    images are kept in featureStore, a featurestore.FeatureStore, if given.
+    """
+    if timer is None:
+        timer = profiling.StageTimer()
+
+    def checkCancel():
+        if cancelToken is not None and cancelToken.isCancelled():
+            raise SegmentationCancelled()
+
+    with timer.stage('params', level=level):
+        asmParams = _makeASMParams(asmConfigs, PPCFilename, zShift, negSpacing, verbose)
+        shapeModes = np.arange(asmConfigs['shape_modes'])
+
+    # load texture model, cached across calls
+    with timer.stage('ppcLoad', level=level) as record:
+        ppc, ppcHit = ppccache.cache.get(PPCFilename)
+        record['hit'] = ppcHit
+
+    tInit = time.time()
+    with timer.stage('initialise', level=level):
+        asm, meshEval, paramsEval, meshFit = _initialiseASM(
+            asmParams, ppc, model, shapepcs, shapeModes,
+            asmConfigs['fit_mweight'], asmConfigs['fit_size'],
+            timer=timer, checkCancel=checkCancel, level=level, featureStore=featureStore,
+        )
+
+    # track the best iteration so far so a cancelled pass can return it
+    iteration = 0
+    best = None
+
+    def asmCallback(meshParams, data, meshRMS, passFrac):
+        nonlocal iteration, best
+        iteration += 1
+        if best is None or passFrac > best['segPFrac']:
+            best = {'segXOpt': meshParams.copy(), 'segData': data, 'segRMS': meshRMS, 'segPFrac': passFrac}
+        if callback is not None:
+            callback({
+                'level': level,
+                'iteration': iteration,
+                'segRMS': meshRMS,
+                'segPFrac': passFrac,
+                'segXOpt': meshParams,
+                'segData': data,
+                'fieldParameters': paramsEval(meshParams),
+            })
+
+    tRun = time.time()
+    try:
+        asmOutput = _runGFASM(
+            asm, scan, model, shapepcs, shapeModes, paramsEval,
+            asmConfigs['filter_landmarks'], verbose, callback=asmCallback,
+        )
+        asmOutput['cancelled'] = False
+    except SegmentationCancelled:
+        asmOutput = _cancelledOutput(best, paramsEval)
+        if verbose:
+            print('ASM cancelled after %d iterations' % iteration)
+    tEnd = time.time()
+    asmOutput['landmarkCounts'] = asm.landmarkCounts()
+    asmOutput['stopReason'] = 'cancelled' if asmOutput['cancelled'] else asm.stopReason
+    asmOutput['runtimeInit'] = tRun - tInit
+    asmOutput['runtimeRun'] = tEnd - tRun
+    asmOutput['runtimeTotal'] = tEnd - tInit
+    asmOutput['ppcCache'] = dict(ppccache.cache.stats(), hit=ppcHit)
+
+    if asmOutput['segXOpt'] is not None:
+        with timer.stage('paramsEval', level=level):
+            model.set_field_parameters(paramsEval(asmOutput['segXOpt']))
+
+    return asmOutput
+
+
+def _prepareScan(scan, config, points, searchConfigs, timer):
+    """
+    The scan image work shared by every pass: a flipped view of scan,
+    cropped to the bounding box of points padded by the longest search
+    distance of any [ASM] config in searchConfigs if [roi] is enabled.
+
+    returns segScan and the crop (None if not cropped), see roi.cropToModel
+    """
+    # initialise image. Flips are applied to voxel indices by a view of the
+    # scan, scan.I is not modified.
+    with timer.stage('flip'):
+        segScan = scanviews.flipView(scan, config['image']['flip_x'], config['image']['flip_y'],
+                                     config['image']['flip_z'])
+
+    # crop to the initial model padded by the longest search distance of
+    # any pass. Results are in physical coordinates so are unaffected.
+    crop = None
+    roiConfigs = config.get('roi', {})
+    if roiConfigs.get('enabled', False):
+        with timer.stage('crop'):
+            padding = max(roi.searchDistance(c) for c in searchConfigs)
+            segScan, crop = roi.cropToModel(
+                segScan, points, padding + roiConfigs.get('margin', 0.0),
+                roiConfigs.get('copy_max_mb', 0.0), zShift=config['image']['z_shift'],
+                negSpacing=config['image']['neg_spacing'],
+            )
+        if config['general']['verbose'] and crop is not None:
+            print('ASM cropped image to %s (%4.1f%% of image)' % (
+                ' '.join('%d:%d' % b for b in zip(crop['start'], crop['stop'])), crop['fraction'] * 100.0))
+
+    return segScan, crop
+
+
+def _runLevels(segScan, levelScans, model, shapepcs, config, pyramidLevels, callback, cancelToken, timer):
+    """
+    Run the coarse pyramid levels then the full resolution pass of config
+    on segScan. levelScans is a dict of the downsampled scans of segScan by
+    factor, downsampled scans not in it are made and added. Derived
+    images are kept in the [feature_store], if set.
+    """
+    verbose = config['general']['verbose']
+    NEGSPACING = config['image']['neg_spacing']
+    ZSHIFT = config['image']['z_shift']
+    store = featurestore.storeFor(config)
+    tprev = time.time()
+
+    # coarse-to-fine levels, each starting from the previous level's shape
+    pyramidOutput = []
+    asmOutput = None
+    for level, (factor, levelConfigs, levelPPCFilename) in enumerate(pyramidLevels):
+        if cancelToken is not None and cancelToken.isCancelled():
+            break
+        if factor == 1:
+            levelScan = segScan
+        elif factor in levelScans:
+            levelScan = levelScans[factor]
+        else:
+            with timer.stage('downsample', level=level) as record:
+                levelScan = levelScans[factor] = pyramid.DownsampledScan(segScan, factor, store=store)
+                record['stored'] = levelScan.stored
+        with timer.stage('pass', level=level):
+            levelOutput = _runASMPass(
+                levelScan, model, shapepcs, levelConfigs, levelPPCFilename,
+                ZSHIFT, NEGSPACING, verbose, level=level, callback=callback, cancelToken=cancelToken,
+                timer=timer, featureStore=store,
+            )
+        # a pass cancelled before its first iteration has no result, keep the previous one
+        if levelOutput['segXOpt'] is not None or asmOutput is None:
+            asmOutput = levelOutput
+        pyramidOutput.append({
+            'downsample': factor,
+            'segXOpt': levelOutput['segXOpt'],
+            'segRMS': levelOutput['segRMS'],
+            'segPFrac': levelOutput['segPFrac'],
+            'iterations': len(levelOutput['segHistory']['passFrac']),
+            'stopReason': levelOutput['stopReason'],
+            'runtimeTotal': levelOutput['runtimeTotal'],
+        })
+        if verbose:
+            print('ASM level x%d done (%5.2fs)' % (factor, time.time() - tprev))
+            tprev = time.time()
+
+    # full resolution
+    if cancelToken is None or not cancelToken.isCancelled():
+        with timer.stage('pass', level=len(pyramidLevels)):
+            fullOutput = _runASMPass(
+                segScan, model, shapepcs, config['ASM'], config['data_files']['ppc_filename'],
+                ZSHIFT, NEGSPACING, verbose, level=len(pyramidLevels), callback=callback, cancelToken=cancelToken,
+                timer=timer, featureStore=store,
+            )
+        if fullOutput['segXOpt'] is not None or asmOutput is None:
+            asmOutput = fullOutput
+    elif asmOutput is None:
+        # cancelled before any pass started
+        asmOutput = _cancelledOutput(None, None)
+    asmOutput['cancelled'] = cancelToken is not None and cancelToken.isCancelled()
+    asmOutput['pyramid'] = pyramidOutput
+    asmOutput['featureStore'] = store.stats() if store is not None else None
 
     if verbose:
         print('ASM done (%5.2fs)' % (time.time() - tprev))
 
-    # unflip image if fliped
-    if flipX:
-        scan.I = scan.I[::-1, :, :]
-    if flipY:
-        scan.I = scan.I[:, ::-1, :]
-    if flipZ:
-        scan.I = scan.I[:, :, ::-1]
+    return model, asmOutput['segData'], asmOutput['segXOpt'], asmOutput
+
+
+def _checkPPCFilename(config):
+    if config['data_files']['ppc_filename'] is None:
+        raise ParameterError('PPCFilename not set')
+
+
+def _segment(scan, model, shapepcs, config, callback, cancelToken, timer):
+    # parse configs
+    if config['general']['verbose']:
+        print(config)
+    _checkPPCFilename(config)
+    ppccache.cache.setMaxMB(config['data_files'].get('ppc_cache_mb', ppccache.DEFAULT_MAX_MB))
+
+    with timer.stage('params'):
+        pyramidLevels = pyramid.pyramidLevels(config)
 
+    segScan, crop = _prepareScan(scan, config, model.get_all_point_positions(),
+                                 [config['ASM']] + [l[1] for l in pyramidLevels], timer)
+    model, dataASM, meshParamsASM, asmOutput = _runLevels(
+        segScan, {}, model, shapepcs, config, pyramidLevels, callback, cancelToken, timer,
+    )
+    asmOutput['crop'] = crop
     return model, dataASM, meshParamsASM, asmOutput
+
+
+def _multiStart(scan, model, shapepcs, config, cancelToken):
+    # move model to the result of the best short pass
+    msConfig = config['multistart']
+    selectBy = msConfig.get('select_by', 'segPFrac')
+    results = multistart.runStarts(scan, model, shapepcs, config, segment, cancelToken=cancelToken)
+    best = multistart.bestStart(results, selectBy)
+    if best is not None:
+        model.set_field_parameters(best['fieldParameters'].copy())
+    if config['general']['verbose']:
+        print('ASM multi-start: %d/%d starts done, best %s' % (
+            len([r for r in results if r['status'] == 'done']), len(results),
+            'none' if best is None else 'start %d, segPFrac %5.3f, segRMS %6.4f' % (
+                best['index'], best['segPFrac'], best['segRMS'])))
+    return {
+        'selectBy': selectBy,
+        'best': None if best is None else best['index'],
+        'starts': [dict((k, v) for k, v in r.items() if k != 'fieldParameters') for r in results],
+    }
+
+
+def segment(scan, model, shapepcs, config, callback=None, cancelToken=None):
+    """
+    Segment scan by fitting model and its shape model shapepcs using the
+    ASM configured in config. model is updated to the segmented shape.
+
+    callback, if given, is called after every ASM iteration with a dict of
+    level, iteration, segRMS, segPFrac, segXOpt, segData and
+    fieldParameters (the model field parameters at that iteration). Coarse
+    pyramid levels are numbered from 0, the full resolution pass is level
+    len(pyramidLevels).
+
+    scan.I may be memory-mapped, e.g. a scan from volumes.loadVolumeScan.
+    Only the voxels around the sampled profiles are then read from disk.
+    Coarse pyramid levels read the whole image once, a slab at a time, to
+    downsample it.
+
+    If [roi] enabled is set, the image is first cropped to the bounding
+    box of the initial model padded by the search distance and [roi]
+    margin. The crop, as start and stop indices into the unflipped array
+    scan.I (flips only change how coordinates map to those indices), is
+    returned in asmOutput['crop'], None if the image was not cropped.
+
+    Each pass's asmOutput['stopReason'] says why it stopped: 'passFrac'
+    (min_pass_frac reached), 'unchanged', 'maxIt', 'cancelled' or one of
+    the early stopping criteria 'paramDelta', 'rmsTolerance' and
+    'passFracStagnation'. asmOutput['segHistory'] has the mesh RMS, pass
+    fraction, largest landmark displacement and wall time of every iteration.
+
+    If [multistart] enabled is set, short passes are first run from the
+    initial model and perturbed copies of it in worker processes, see
+    multistart.runStarts, and the segmentation starts from the best of
+    them. The starts' results are returned in asmOutput['multistart'],
+    None if multi-start is not enabled.
+
+    If [feature_store] directory is set, downsampled and spline filtered
+    images are read from, or saved to, a featurestore.FeatureStore there.
+    Its statistics are returned in asmOutput['featureStore'].
+
+    cancelToken, if given, is a CancelToken checked between the stages of
+    every ASM iteration and between levels. Once it is cancelled segment()
+    returns the best result so far with asmOutput['cancelled'] set. scan is
+    never modified, cancelled or not.
+
+    The wall time of every stage, and its peak memory if [profiling]
+    track_memory is set, are returned in asmOutput['timings']. If
+    [profiling] profiler is set the run is profiled and the profile file
+    name is returned in asmOutput['profileFilename'].
+    """
+    profilingConfigs = config.get('profiling', {})
+    timer = profiling.StageTimer(trackMemory=profilingConfigs.get('track_memory', False))
+    timer.start()
+    try:
+        with profiling.profileRun(profilingConfigs.get('profiler', ''),
+                                  profilingConfigs.get('profile_dir', '')) as profileOutput:
+            with timer.stage('total'):
+                multistartOutput = None
+                if config.get('multistart', {}).get('enabled', False):
+                    with timer.stage('multistart'):
+                        multistartOutput = _multiStart(scan, model, shapepcs, config, cancelToken)
+                model, dataASM, meshParamsASM, asmOutput = _segment(
+                    scan, model, shapepcs, config, callback, cancelToken, timer,
+                )
+    finally:
+        timer.stop()
+
+    asmOutput['multistart'] = multistartOutput
+    asmOutput['timings'] = timer.output()
+    asmOutput['profileFilename'] = profileOutput['filename']
+
+    return model, dataASM, meshParamsASM, asmOutput
+
+
+def iterations(asmOutput):
+    """
+    Number of ASM iterations of a segment() run, over its coarse pyramid
+    levels and the full resolution pass.
+    """
+    return sum(p['iterations'] for p in asmOutput.get('pyramid', [])) + len(asmOutput['segHistory']['passFrac'])
+
+
+def objectConfig(config, obj):
+    """
+    A copy of config for segmenting obj, with obj's ppc_filename and [ASM]
+    overrides, if it has any, applied.
+    """
+    newConfig = configobj.ConfigObj(copy.deepcopy(config.dict() if hasattr(config, 'dict') else dict(config)))
+    if obj.get('ppc_filename'):
+        newConfig['data_files']['ppc_filename'] = obj['ppc_filename']
+    for key, value in obj.get('ASM', {}).items():
+        if key not in newConfig['ASM']:
+            raise ParameterError('object {}: unknown [ASM] key {}'.format(obj.get('name', ''), key))
+        newConfig['ASM'][key] = value
+    return newConfig
+
+
+def objectsFromConfig(config, models, shapepcs):
+    """
+    List of object dicts for segmentObjects of models and their shape
+    models shapepcs. The k-th subsection of [objects], if there is one,
+    names the k-th object and sets its ppc_filename and [ASM] overrides.
+    """
+    if len(models) != len(shapepcs):
+        raise ParameterError('{} models but {} shape models'.format(len(models), len(shapepcs)))
+    sections = list(config['objects'].sections) if 'objects' in config else []
+    if len(sections) > len(models):
+        raise ParameterError('{} [objects] sections but {} models'.format(len(sections), len(models)))
+
+    objects = []
+    for k, (model, pcs) in enumerate(zip(models, shapepcs)):
+        obj = {'name': 'object_{}'.format(k), 'model': model, 'shapepcs': pcs}
+        if k < len(sections):
+            objectConfigs = dict(config['objects'][sections[k]])
+            obj['name'] = sections[k]
+            obj['ppc_filename'] = objectConfigs.pop('ppc_filename', None)
+            obj['ASM'] = objectConfigs
+        objects.append(obj)
+    return objects
+
+
+def _segmentObject(k, name, model, shapepcs, config, levels, segScan, levelScans, callback, cancelToken,
+                   trackMemory):
+    # one object of segmentObjects, on a thread or in a worker process
+    objectTimer = profiling.StageTimer(trackMemory=trackMemory)
+    objectTimer.start()
+
+    def objectCallback(progress):
+        callback(dict(progress, object=k, name=name))
+
+    try:
+        with objectTimer.stage('total'):
+            output = _runLevels(
+                segScan, levelScans, model, shapepcs, config, levels,
+                objectCallback if callback is not None else None, cancelToken, objectTimer,
+            )
+    finally:
+        objectTimer.stop()
+    if config['general']['verbose']:
+        print('ASM object %s done' % name)
+    asmOutput = output[3]
+    asmOutput['name'] = name
+    asmOutput['timings'] = objectTimer.output()
+    asmOutput['profileFilename'] = None
+    return output
+
+
+def _initObjectWorker(segScan, levelScans, progressQueue, cancelEvent):
+    _objectWorker['segScan'] = segScan
+    _objectWorker['levelScans'] = levelScans
+    _objectWorker['progress'] = progressQueue
+    _objectWorker['cancelToken'] = CancelToken(cancelEvent)
+
+
+def _segmentObjectInWorker(task):
+    k, name, model, shapepcs, config, levels, trackMemory, sendProgress = task
+    return _segmentObject(k, name, model, shapepcs, config, levels,
+                          _objectWorker['segScan'], _objectWorker['levelScans'],
+                          _objectWorker['progress'].put if sendProgress else None,
+                          _objectWorker['cancelToken'], trackMemory)
+
+
+def _segmentObjectsInProcesses(tasks, nWorkers, segScan, levelScans, callback, cancelToken):
+    # the scan views are passed to each worker once, by inheritance where
+    # processes are forked, rather than with every task
+    progressQueue = multiprocessing.Queue()
+    cancelEvent = multiprocessing.Event()
+    pool = multiprocessing.Pool(nWorkers, initializer=_initObjectWorker,
+                                initargs=(segScan, levelScans, progressQueue, cancelEvent))
+    asyncResult = pool.map_async(_segmentObjectInWorker, tasks)
+    return runner.runInPool(pool, asyncResult, progressQueue, cancelEvent, callback, cancelToken)
+
+
+def segmentObjects(scan, objects, config, callback=None, cancelToken=None):
+    """
+    Segment several objects, e.g. the bones of a limb, in one scan. The
+    image work is done once for all objects: the scan is flipped, cropped
+    to the bounding box of every initial model padded by the longest search
+    distance of any object, and downsampled once per pyramid factor. The
+    objects are then segmented concurrently by [objects] workers, up to
+    [objects] max_workers at a time (one per object if 0).
+
+    Model fitting holds the GIL, so objects segmented by 'thread' workers
+    share one CPU for much of their run. 'process' workers get the shared
+    image views once per process, and return copies of the segmented
+    models. Segmentations already in a worker process, e.g. of a headless
+    step with [general] worker = 'process', use threads.
+
+    Multi-start is not supported, a ParameterError is raised if
+    [multistart] enabled is set. [profiling] profiler is not used, each
+    asmOutput['profileFilename'] is None.
+
+    objects: list of dicts of model, shapepcs and optionally name,
+        ppc_filename and ASM, a dict of the object's [ASM] overrides, see
+        objectsFromConfig
+    callback: as segment's, with the object's index and name added to each
+        progress dict. Called from the thread segmenting the object, or
+        from this thread with process workers.
+
+    returns a list of the (model, dataASM, meshParamsASM, asmOutput) of
+    each object, as segment. Each asmOutput has the object's name, the
+    shared crop, the object's stage timings and, in sharedTimings, those
+    of the shared image work. Peak memory is not tracked per object when
+    objects are segmented by concurrent threads.
+    """
+    if not objects:
+        raise ParameterError('no objects to segment')
+    if config.get('multistart', {}).get('enabled', False):
+        raise ParameterError('[multistart] is not supported in multi-object segmentation')
+    profilingConfigs = config.get('profiling', {})
+    objectsConfigs = config.get('objects', {})
+    nWorkers = min(len(objects), objectsConfigs.get('max_workers', 0) or len(objects))
+    workers = objectsConfigs.get('workers', DEFAULT_OBJECT_WORKERS)
+    if workers not in OBJECT_WORKERS:
+        raise ParameterError('unknown [objects] workers {}, expected one of {}'.format(
+            workers, ', '.join(OBJECT_WORKERS)))
+    if nWorkers == 1 or multiprocessing.current_process().daemon:
+        # daemonic pool workers cannot start processes of their own
+        workers = 'thread'
+    trackMemory = profilingConfigs.get('track_memory', False)
+
+    timer = profiling.StageTimer(trackMemory=trackMemory)
+    timer.start()
+    try:
+        with timer.stage('params'):
+            configs = [objectConfig(config, obj) for obj in objects]
+            for c in configs:
+                _checkPPCFilename(c)
+            levels = [pyramid.pyramidLevels(c) for c in configs]
+        ppccache.cache.setMaxMB(config['data_files'].get('ppc_cache_mb', ppccache.DEFAULT_MAX_MB))
+
+        searchConfigs = [c['ASM'] for c in configs] + [l[1] for objectLevels in levels for l in objectLevels]
+        points = np.vstack([obj['model'].get_all_point_positions() for obj in objects])
+        segScan, crop = _prepareScan(scan, config, points, searchConfigs, timer)
+        store = featurestore.storeFor(config)
+        levelScans = {}
+        for factor in sorted(set(l[0] for objectLevels in levels for l in objectLevels if l[0] > 1)):
+            with timer.stage('downsample', factor=factor) as record:
+                levelScans[factor] = pyramid.DownsampledScan(segScan, factor, store=store)
+                record['stored'] = levelScans[factor].stored
+    finally:
+        timer.stop()
+
+    names = [obj.get('name', 'object_{}'.format(k)) for k, obj in enumerate(objects)]
+    if workers == 'process':
+        tasks = [(k, names[k], obj['model'], obj['shapepcs'], configs[k], levels[k], trackMemory, callback is not None)
+                 for k, obj in enumerate(objects)]
+        outputs = _segmentObjectsInProcesses(tasks, nWorkers, segScan, levelScans, callback, cancelToken)
+    else:
+        # objects share the read-only scan views, and the texture model cache is thread-safe
+        def segmentObject(k):
+            return _segmentObject(k, names[k], objects[k]['model'], objects[k]['shapepcs'], configs[k], levels[k],
+                                  segScan, levelScans, callback, cancelToken, trackMemory and nWorkers == 1)
+
+        with concurrent.futures.ThreadPoolExecutor(nWorkers) as executor:
+            outputs = list(executor.map(segmentObject, range(len(objects))))
+
+    sharedTimings = timer.output()
+    for output in outputs:
+        output[3]['crop'] = crop
+        output[3]['sharedTimings'] = sharedTimings
+    return outputs
@@ -0,0 +1,327 @@
+"""
+ASM segmentation loop with per-stage instrumentation and hooks.
+
+ASMSolver is a gias3 ASMSegmentation whose segment() loop is split into
+stages (landmark evaluation, image sampling, landmark filtering, profile
+matching, conversion to data, mesh fitting) that are timed individually
+and between which a cancellation check is made. Profiles are sampled by a
+sampling.ProfileSampler and matched by a matching.TextureMatcher.
+"""
+import logging
+import time
+
+import numpy as np
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import landmarkdensity
+from mapclientplugins.asmsegmentationstep import matching
+from mapclientplugins.asmsegmentationstep import profiling
+from mapclientplugins.asmsegmentationstep import sampling
+
+log = logging.getLogger(__name__)
+
+
+class ASMSolver(ASM.ASMSegmentation):
+    """
+    ASMSegmentation with an instrumented segment loop.
+
+    timer: profiling.StageTimer recording each stage of each iteration.
+    checkCancel: callable called between stages, expected to raise to stop
+        the segmentation.
+    level: pyramid level, used to tag timer records.
+
+    The interpolation order and chunk memory cap of profile sampling are
+    read from params.sampleOrder and params.sampleChunkMB if set. The same
+    memory cap applies to each chunk of landmarks matched together.
+    featureStore: optional featurestore.FeatureStore of the sampler's
+        spline filtered images.
+
+    If params.adaptiveLandmarks is set, only the landmarks chosen by a
+    landmarkdensity.AdaptiveDensity are sampled, matched and fitted, see
+    landmarkCounts.
+
+    Besides ASMSegmentation's stopping criteria, the loop stops early when
+    no landmark moves by more than params.stopParamTol (in the scan's
+    physical units, e.g. mm) in an iteration, or over the last params.stopWindow iterations the mesh RMS
+    improves by less than params.stopRMSTol or the best pass fraction
+    rises by less than params.stopPFracTol. Criteria with a tolerance of 0
+    are not used. stopReason is set to why the loop stopped.
+    """
+
+    def __init__(self, image=None, params=None, getMeshCoords=None, getMeshNormals=None, fitMesh=None,
+                 timer=None, checkCancel=None, level=0, featureStore=None):
+        super(ASMSolver, self).__init__(image=image, params=params, getMeshCoords=getMeshCoords,
+                                        getMeshNormals=getMeshNormals, fitMesh=fitMesh)
+        self.timer = timer if timer is not None else profiling.StageTimer()
+        self.checkCancel = checkCancel
+        self.level = level
+        self.sampler = sampling.ProfileSampler(
+            order=getattr(params, 'sampleOrder', sampling.DEFAULT_ORDER),
+            chunkMB=getattr(params, 'sampleChunkMB', sampling.DEFAULT_CHUNK_MB),
+            store=featureStore,
+        )
+        self.sampleOffsets = None
+        self.matcher = None
+        self.density = None
+        self.stopReason = None
+
+    def _stage(self, name, it):
+        if self.checkCancel is not None:
+            self.checkCancel()
+        return self.timer.stage(name, level=self.level, iteration=it)
+
+    def _evaluateLandmarks(self, meshParams, XMesh=None):
+        # XMesh, if given, are the landmarks already evaluated at meshParams
+        self.XN = self.getMeshNormals(meshParams)
+        self.XMesh = XMesh if XMesh is not None else self.getMeshCoords(meshParams)
+
+    def _sampleImage(self, active=None):
+        """
+        As ASMSegmentation._sampleImage, but only landmarks and normals are
+        converted to image indices and the sample points are never built
+        in physical coordinates. self.XSample is not set. If active is
+        given, only the profiles of the landmarks it masks are sampled,
+        the others are zero.
+        """
+        kwargs = {'z_shift': self.params.imageZShift, 'neg_spacing': self.params.imageNegSpacing,
+                  'round_int': False}
+        self.sampleOffsets = sampling.profileOffsets(self.params.ND, self.params.NLim, self.params.NPad)
+        XMesh = self.XMesh if active is None else self.XMesh[active]
+        XMeshImg = self.image.coord2Index(XMesh, **kwargs)
+        XNImg = self.image.coord2Index(XMesh + (self.XN if active is None else self.XN[active]), **kwargs) - XMeshImg
+        P = self.sampler.sample(self.image.I, XMeshImg, XNImg, self.sampleOffsets)
+        if active is None:
+            self.P = P
+        else:
+            self.P = np.zeros((len(self.XMesh), len(self.sampleOffsets)))
+            self.P[active] = P
+        self.dP = ASM.calcDerivArray(self.P)
+
+    def _initDensity(self):
+        # landmarks of each element spread over the initial shape
+        minLandmarks = matching.MIN_ELEMENT_LANDMARKS if self.params.matchMode == 'elementmedian' else 1
+        self.density = landmarkdensity.AdaptiveDensity(
+            self.elementXIndices, self.XMesh,
+            startFrac=getattr(self.params, 'adaptiveStartFrac', landmarkdensity.DEFAULT_START_FRAC),
+            failFrac=getattr(self.params, 'adaptiveRefineFailFrac', landmarkdensity.DEFAULT_REFINE_FAIL_FRAC),
+            failFactor=getattr(self.params, 'adaptiveRefineFailFactor', landmarkdensity.DEFAULT_REFINE_FAIL_FACTOR),
+            mFactor=getattr(self.params, 'adaptiveRefineMFactor', landmarkdensity.DEFAULT_REFINE_M_FACTOR),
+            minLandmarks=minLandmarks,
+        )
+
+    def landmarkCounts(self):
+        """
+        Number of landmarks used on each element, at the end of the
+        segmentation if landmark density is adaptive.
+        """
+        if self.density is not None:
+            return self.density.counts.tolist()
+        return [len(e) for e in self.elementXIndices]
+
+    def _match2data(self, matchInd, landmarks):
+        # physical coordinates of the matched sample of each matched landmark
+        offsets = self.sampleOffsets[matchInd]
+        return self.XMesh[landmarks] + offsets[:, np.newaxis] * self.XN[landmarks]
+
+    def _matchProfiles(self, landmarkMask):
+        # the matched landmarks, in index order, and their matches. The
+        # element matchers may skip landmarks and return matches by element
+        if self.params.matchMode == 'default':
+            landmarks = np.where(landmarkMask)[0]
+            matchInd, m, M = self.matcher.matchPoints(self.dP, landmarks)
+            return landmarks, matchInd, m, M
+        elif self.params.matchMode == 'oneside':
+            if self.density is not None:
+                # only the landmarks in use
+                matchInd, m, M, landmarks = self.matcher.matchOneSide(
+                    self.dP, [e[landmarkMask[e]] for e in self.elementXIndices])
+            else:
+                matchInd, m, M, landmarks = self.matcher.matchOneSide(self.dP, self.elementXIndices)
+        elif self.params.matchMode == 'elementmedian':
+            matchInd, m, M, landmarks = self.matcher.matchElementMedian(self.dP, self.elementXIndices,
+                                                                        landmarkMask, 1.0)
+        else:
+            raise ValueError('unrecognised matchMode')
+        order = np.argsort(landmarks, kind='stable')
+        return landmarks[order], matchInd[order], m[order], M[order]
+
+    def _earlyStop(self, history):
+        # the first early stopping criterion met by the latest iteration, or None
+        paramTol = getattr(self.params, 'stopParamTol', 0.0)
+        if paramTol > 0 and history['paramDelta'][-1] < paramTol:
+            return 'paramDelta'
+
+        window = max(1, int(getattr(self.params, 'stopWindow', 3)))
+        if len(history['meshRMS']) <= window:
+            return None
+        rmsTol = getattr(self.params, 'stopRMSTol', 0.0)
+        if rmsTol > 0 and history['meshRMS'][-window - 1] - min(history['meshRMS'][-window:]) < rmsTol:
+            return 'rmsTolerance'
+        pFracTol = getattr(self.params, 'stopPFracTol', 0.0)
+        if pFracTol > 0 and max(history['passFrac'][-window:]) - max(history['passFrac'][:-window]) < pFracTol:
+            return 'passFracStagnation'
+        return None
+
+    def segment(self, mesh_params0, verbose=1, debug=0, callback=None):
+        """
+        Run the main segmentation loop. Same algorithm and outputs as
+        ASMSegmentation.segment, plus early stopping. The returned history
+        also has the number of landmarks sampled (nLandmarks), the largest
+        landmark displacement made by the fit (paramDelta, in physical
+        units) and the wall time (time) of every iteration.
+        """
+        if (len(self.PPC.L) - 1) < max(self.elementXIndicesFlat):
+            raise ValueError('Maximum landmark index ({}) greater than number of profile models ({}). Check PPC.'
+                             .format(max(self.elementXIndicesFlat), (len(self.PPC.L) - 1)))
+
+        it = 0
+        mRMSOld = 0.0
+        meshRMSOld = 0.0
+        meshParams = np.array(mesh_params0)
+        XMesh = None
+        converged = False
+        outputHistory = {'meshParams': [],
+                         'meshRMS': [],
+                         'meshSD': [],
+                         'passFrac': [],
+                         'mahaDist': [],
+                         'mRMS': [],
+                         'nLandmarks': [],
+                         'paramDelta': [],
+                         'time': [],
+                         }
+        dataHistory = {'data': [],
+                       'W': [],
+                       'm': [],
+                       'M': [],
+                       'landmarkMask': [],
+                       }
+
+        # calculate the modes needed for each profile PC based on PPCVarCutoff,
+        # and the matrices of the texture model cut to those modes
+        with self._stage('ppcModes', it):
+            ppcModes = self.PPC.getModesFracVariance(self.params.PPCVarCutoff)
+            self.matcher = matching.TextureMatcher(self.PPC.L, ppcModes, chunkMB=self.sampler.chunkMB)
+
+        self.stopReason = 'maxIt'
+        while it < self.params.maxIt:
+            tIt = time.perf_counter()
+            with self._stage('landmarks', it):
+                self._evaluateLandmarks(meshParams, XMesh)
+                if getattr(self.params, 'adaptiveLandmarks', False) and self.density is None:
+                    self._initDensity()
+                active = self.density.activeMask() if self.density is not None else None
+
+            # sample image along normals, self.P and self.dP are of shape
+            # (n landmarks, profile length)
+            with self._stage('sampling', it):
+                self._sampleImage(active)
+
+            # filter out out-of-bounds landmarks and landmarks in masked image regions
+            with self._stage('filtering', it):
+                if active is None:
+                    active = np.ones(self.XMesh.shape[0], dtype=bool)
+                if self.filterLandmarks:
+                    landmarkMask = active.copy()
+                    landmarkMask[active] = self._filterValidLandmarks(self.XMesh[active])
+                    if not np.any(landmarkMask):
+                        raise RuntimeError('All landmarks masked')
+                else:
+                    landmarkMask = active
+
+            with self._stage('matching', it):
+                landmarks, matchInd, m, M = self._matchProfiles(landmarkMask)
+                landmarkMask = np.zeros(len(self.XMesh), dtype=bool)
+                landmarkMask[landmarks] = True
+                data = self._match2data(matchInd, landmarks)
+                if self.params.MDistWeight:
+                    W = ASM.weightMDist(m, self.params.MDistWeightUpper)
+                else:
+                    W = np.ones(len(m))
+
+            # rigid + mode fit GF to data points
+            with self._stage('fitting', it):
+                newMeshParams, meshRMS, meshSD = self.fitMesh(data, x0=meshParams.copy(),
+                                                              weights=W,
+                                                              landmark_indices=landmarks)
+                # landmarks of the next iteration, how far the fit moved them
+                # weighs rigid and shape mode parameters in the same units
+                XMesh = self.getMeshCoords(newMeshParams)
+                paramDelta = float(np.sqrt(((XMesh - self.XMesh) ** 2).sum(1)).max())
+
+            stopSeg, passFrac = ASM._asmStopCrit(matchInd,
+                                                 self.params.ND + 2 * self.params.NPad,
+                                                 window=self.params.passWindow,
+                                                 threshold=self.params.minPassFrac)
+
+            if self.density is not None and not stopSeg:
+                with self._stage('refining', it):
+                    passed = landmarkdensity.passMask(matchInd, self.params.ND + 2 * self.params.NPad,
+                                                      self.params.passWindow)
+                    self.density.refine(landmarks, passed, m)
+
+            mRMS = np.sqrt(m.mean())
+            outputHistory['nLandmarks'].append(int(active.sum()))
+            outputHistory['paramDelta'].append(paramDelta)
+            outputHistory['time'].append(time.perf_counter() - tIt)
+            outputHistory['meshParams'].append(newMeshParams)
+            outputHistory['meshRMS'].append(meshRMS)
+            outputHistory['meshSD'].append(meshSD)
+            outputHistory['passFrac'].append(passFrac)
+            outputHistory['mRMS'].append(mRMS)
+            dataHistory['data'].append(data)
+            dataHistory['W'].append(W)
+            dataHistory['m'].append(m)
+            dataHistory['M'].append(M)
+            dataHistory['landmarkMask'].append(landmarkMask)
+
+            it += 1
+
+            if verbose:
+                log.debug('it: %(it)03i  M-distance RMS: %(mRMS)5.3f  passFrac: %(passFrac)5.3f  '
+                          'MeshRMS: %(meshRMS)5.3f  MeshSD: %(meshSD)5.3f'
+                          % {'it': it, 'mRMS': mRMS, 'passFrac': passFrac, 'meshRMS': meshRMS, 'meshSD': meshSD})
+
+            if callback:
+                callback(newMeshParams, data, meshRMS, passFrac)
+
+            if stopSeg or ((mRMS == mRMSOld) and (meshRMS == meshRMSOld)):
+                converged = True
+                self.stopReason = 'passFrac' if stopSeg else 'unchanged'
+                break
+
+            # a plateau keeps its best iteration, as a run to maxIt
+            earlyStop = self._earlyStop(outputHistory)
+            if earlyStop is not None:
+                self.stopReason = earlyStop
+                if verbose:
+                    log.debug('stopping early: %s' % earlyStop)
+                break
+
+            mRMSOld = mRMS
+            meshRMSOld = meshRMS
+            meshParams = newMeshParams
+
+        # if converged, use latest outputs
+        if converged:
+            self.meshParamsFinal = meshParams.copy()
+            rmsFinal = meshRMS
+            sdFinal = meshSD
+        else:
+            # use highest passFrac params
+            bestIt = int(np.argmax(outputHistory['passFrac']))
+            if verbose:
+                log.debug('using results from iteration %d' % (bestIt + 1))
+            self.meshParamsFinal = outputHistory['meshParams'][bestIt]
+            rmsFinal = outputHistory['meshRMS'][bestIt]
+            sdFinal = outputHistory['meshSD'][bestIt]
+            passFrac = outputHistory['passFrac'][bestIt]
+            data = dataHistory['data'][bestIt]
+            W = dataHistory['W'][bestIt]
+            m = dataHistory['m'][bestIt]
+            M = dataHistory['M'][bestIt]
+            landmarkMask = dataHistory['landmarkMask'][bestIt]
+
+        return self.meshParamsFinal, data, W, landmarkMask, \
+               rmsFinal, sdFinal, passFrac, m, M, outputHistory
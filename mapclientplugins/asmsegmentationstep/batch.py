@@ -0,0 +1,237 @@
+"""
+Headless batch ASM segmentation of many scans using a pool of worker
+processes.
+
+The manifest is a JSON list of scans, one dict per scan:
+
+    [
+        {"name": "case001", "dicom_dir": "/data/case001"},
+        {"name": "case002", "image": "/data/case002.npy",
+         "voxel_spacing": [0.8, 0.8, 1.0], "voxel_origin": [0.0, 0.0, 0.0]},
+        {"name": "case003", "image": "/data/case003.raw", "shape": [2048, 2048, 1500],
+         "dtype": "<i2", "voxel_spacing": [0.05, 0.05, 0.05]}
+    ]
+
+Image volumes (.npy or raw) are memory-mapped, so only the voxels sampled
+during segmentation are read from disk.
+
+Each worker loads the shared fieldwork model, shape PCs and params once,
+then segments every scan it is given with asmseg.segment. Results for each
+scan are written to the output directory and a throughput summary is
+written to batch_summary.json.
+
+Usage:
+    python -m mapclientplugins.asmsegmentationstep.batch manifest.json \\
+        --model femur.geof --ensemble femur.ens --mesh femur.mesh \\
+        --pcs femur.pc --ppc femur.ppc --out results -j 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from gias3.fieldwork.field import geometric_field
+from gias3.image_analysis import image_tools
+from gias3.learning import PCA
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import volumes
+
+SUMMARY_FILENAME = 'batch_summary.json'
+
+# per-process state, set by _initWorker
+_worker = {}
+
+
+def loadManifest(filename):
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+
+    names = [entry['name'] for entry in manifest]
+    if len(set(names)) != len(names):
+        raise asmseg.ParameterError('scan names in manifest {} are not unique'.format(filename))
+
+    return manifest
+
+
+def loadScan(entry):
+    """
+    Load the scan described by a manifest entry, either a DICOM folder
+    (dicom_dir) or a memory-mapped .npy or raw volume file (image). Raw
+    volumes also need shape and dtype, and optionally offset (header
+    bytes) and order ('C' or 'F').
+    """
+    if 'dicom_dir' in entry:
+        scan = image_tools.Scan(entry['name'])
+        scan.loadDicomFolder(entry['dicom_dir'], filter_=False,
+                             file_pattern=entry.get('file_pattern', r'\.dcm$'))
+    elif 'image' in entry:
+        rawArgs = {k: entry[k] for k in ('shape', 'dtype', 'offset', 'order') if k in entry}
+        scan = volumes.loadVolumeScan(entry['image'], entry.get('voxel_spacing'), entry.get('voxel_origin'),
+                                      name=entry['name'], **rawArgs)
+    else:
+        raise asmseg.ParameterError('manifest entry {} has no dicom_dir or image'.format(entry['name']))
+
+    return scan
+
+
+def writeResult(outputDir, name, model, dataASM, meshParamsASM, asmOutput, wallTime):
+    """
+    Write the segmented model parameters, segmented point cloud and fit
+    errors of one scan into outputDir. Returns the per-scan result dict.
+    """
+    np.save(os.path.join(outputDir, name + '_field_parameters.npy'), model.get_field_parameters())
+    np.save(os.path.join(outputDir, name + '_seg_xopt.npy'), meshParamsASM)
+    np.save(os.path.join(outputDir, name + '_seg_data.npy'), dataASM)
+
+    result = {
+        'name': name,
+        'status': 'done',
+        'segRMS': float(asmOutput['segRMS']),
+        'segPFrac': float(asmOutput['segPFrac']),
+        'iterations': asmseg.iterations(asmOutput),
+        'wallTime': wallTime,
+        'timings': asmOutput['timings']['summary'],
+        'crop': asmOutput['crop'],
+    }
+    with open(os.path.join(outputDir, name + '_result.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+
+    return result
+
+
+def _initWorker(modelFiles, shapePCFile, paramFile, ppcFile, outputDir):
+    _worker['model'] = geometric_field.load_geometric_field(*modelFiles)
+    _worker['modelParams'] = _worker['model'].get_field_parameters().copy()
+    _worker['shapepcs'] = PCA.loadPrincipalComponents(shapePCFile)
+    _worker['params'] = asmseg.loadParams(paramFile, ppcFile)
+    _worker['outputDir'] = outputDir
+
+
+def _segmentEntry(entry):
+    t0 = time.time()
+    try:
+        scan = loadScan(entry)
+        # segment() updates the model, start each scan from the loaded parameters
+        model = _worker['model']
+        model.set_field_parameters(_worker['modelParams'].copy())
+        model, dataASM, meshParamsASM, asmOutput = asmseg.segment(
+            scan, model, _worker['shapepcs'], _worker['params']
+        )
+        # a scan whose results cannot be written has failed, but the rest of the batch goes on
+        return writeResult(_worker['outputDir'], entry['name'], model, dataASM,
+                           meshParamsASM, asmOutput, time.time() - t0)
+    except Exception as e:
+        return {'name': entry['name'], 'status': 'failed', 'error': repr(e), 'wallTime': time.time() - t0}
+
+
+def summarise(results, totalWallTime):
+    """
+    Throughput summary of a batch run.
+    """
+    done = [r for r in results if r['status'] == 'done']
+    scanTimes = np.array([r['wallTime'] for r in done])
+    summary = {
+        'nScans': len(results),
+        'nDone': len(done),
+        'nFailed': len(results) - len(done),
+        'totalWallTime': totalWallTime,
+        'scansPerHour': 3600.0 * len(done) / totalWallTime if totalWallTime > 0 else 0.0,
+        'scanWallTimeMean': float(scanTimes.mean()) if len(done) else None,
+        'scanWallTimeMin': float(scanTimes.min()) if len(done) else None,
+        'scanWallTimeMax': float(scanTimes.max()) if len(done) else None,
+        'results': sorted(results, key=lambda r: r['name']),
+    }
+    return summary
+
+
+def runBatch(manifest, modelFiles, shapePCFile, outputDir, paramFile='', ppcFile='', processes=None, verbose=True):
+    """
+    Segment every scan in manifest across a pool of worker processes.
+
+    inputs:
+    manifest: list of manifest entry dicts, see loadManifest
+    modelFiles: (geof, ens, mesh) filenames of the initial fieldwork model
+    shapePCFile: shape principal components filename
+    outputDir: directory in which results are written
+    paramFile: params .ini filename, default params are used if empty
+    ppcFile: profile PC (texture model) filename
+    processes: number of worker processes, defaults to the number of CPUs
+
+    returns:
+    summary: dict of throughput and per-scan results
+    """
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    initArgs = (modelFiles, shapePCFile, paramFile, ppcFile, outputDir)
+    results = []
+    t0 = time.time()
+    if processes == 1:
+        _initWorker(*initArgs)
+        resultIter = map(_segmentEntry, manifest)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_initWorker, initargs=initArgs)
+        resultIter = pool.imap_unordered(_segmentEntry, manifest)
+
+    try:
+        for result in resultIter:
+            results.append(result)
+            if verbose:
+                if result['status'] == 'done':
+                    print('{} done ({:5.2f}s) RMS: {:6.4f} pFrac: {:5.3f} [{}/{}]'.format(
+                        result['name'], result['wallTime'], result['segRMS'], result['segPFrac'],
+                        len(results), len(manifest)))
+                else:
+                    print('{} failed: {} [{}/{}]'.format(result['name'], result['error'], len(results), len(manifest)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    summary = summarise(results, time.time() - t0)
+    with open(os.path.join(outputDir, SUMMARY_FILENAME), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    if verbose:
+        print('{nDone}/{nScans} scans segmented in {totalWallTime:.1f}s ({scansPerHour:.1f} scans/hour)'.format(**summary))
+        if summary['nDone']:
+            print('per-scan wall time mean {scanWallTimeMean:.1f}s, min {scanWallTimeMin:.1f}s, '
+                  'max {scanWallTimeMax:.1f}s'.format(**summary))
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch ASM segmentation of the scans in a manifest.')
+    parser.add_argument('manifest', help='JSON manifest of scans to segment')
+    parser.add_argument('--model', required=True, help='initial fieldwork model (.geof)')
+    parser.add_argument('--ensemble', default=None, help='fieldwork model ensemble file (.ens)')
+    parser.add_argument('--mesh', default=None, help='fieldwork model mesh file (.mesh)')
+    parser.add_argument('--pcs', required=True, help='shape principal components file')
+    parser.add_argument('--ppc', required=True, help='profile principal components (texture model) file')
+    parser.add_argument('--params', default='', help='params .ini file, default params are used if not given')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print progress')
+    args = parser.parse_args(argv)
+
+    summary = runBatch(
+        loadManifest(args.manifest),
+        (args.model, args.ensemble, args.mesh),
+        args.pcs,
+        args.out,
+        paramFile=args.params,
+        ppcFile=args.ppc,
+        processes=args.processes,
+        verbose=not args.quiet,
+    )
+    return 0 if summary['nFailed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
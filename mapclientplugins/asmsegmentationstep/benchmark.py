@@ -0,0 +1,587 @@
+"""
+Benchmark of asmseg.segment on synthetic data.
+
+Times segmentation of synthetic ellipsoid scans (see synthetic.py) over a
+grid of image sizes and [ASM] mesh_d, n_d, n_pad and shape_modes. All
+data are generated from a seed, so the benchmark runs offline and reports
+from different commits or machines can be compared.
+
+Usage:
+    python -m mapclientplugins.asmsegmentationstep.benchmark run --out report
+    python -m mapclientplugins.asmsegmentationstep.benchmark sampling --out sampling
+    python -m mapclientplugins.asmsegmentationstep.benchmark startup --out startup
+    python -m mapclientplugins.asmsegmentationstep.benchmark compare base.json report.json --tolerance 0.1
+
+run writes report.json (run metadata and one result per run) and
+report.csv (one row per run). sampling times profile sampling alone,
+gias3's ASMSegmentation._sampleImage against the batched sampler of
+sampling.py at several interpolation orders, on the same landmarks.
+startup times importing the plugin in a fresh interpreter, as MAP Client
+does when it scans plugins, and records which heavy packages the import
+loaded.
+compare prints the change in median wall time and peak memory of each
+configuration in two reports of the same kind, and exits with status 1
+if any got slower (or larger) by more than tolerance.
+"""
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import asmsolver
+from mapclientplugins.asmsegmentationstep import sampling
+from mapclientplugins.asmsegmentationstep import synthetic
+from mapclientplugins.asmsegmentationstep import volumes
+
+DEFAULT_GRID = {
+    'size': [64, 128],
+    'mesh_d': [[6, 6], [10, 10]],
+    'n_d': [20, 40],
+    'n_pad': [15, 25],
+    'shape_modes': [3, 5],
+}
+
+DEFAULT_SAMPLING_GRID = {
+    'size': [128, 256],
+    'mesh_d': [[10, 10], [20, 20]],
+    'n_d': [40],
+    'n_pad': [25],
+    'order': [0, 1, 3],
+}
+
+N_LIM = [-10.0, 10.0]
+
+DEFAULT_STARTUP_MODULES = ('mapclientplugins.asmsegmentationstep',)
+
+# packages the plugin must not load until a step is executed
+HEAVY_MODULES = ('mayavi', 'tvtk', 'vtkmodules', 'traits', 'pyface', 'gias3', 'scipy', 'sklearn')
+
+# top level imports listed in startup reports
+STARTUP_TOP_IMPORTS = 10
+
+# keys identifying a configuration when comparing reports
+CONFIG_KEYS = {
+    'segment': ('size', 'meshD', 'nD', 'nPad', 'shapeModes'),
+    'sampling': ('size', 'meshD', 'nD', 'nPad', 'sampler', 'order'),
+    'startup': ('module',),
+}
+
+CSV_FIELDS = {
+    'segment': ('size', 'voxelSpacing', 'meshD', 'nD', 'nPad', 'shapeModes', 'repeat', 'nLandmarks',
+                'wallTime', 'peakMB', 'iterations', 'segRMS', 'segPFrac', 'surfaceRMS', 'ppcHit'),
+    'sampling': ('size', 'meshD', 'nD', 'nPad', 'sampler', 'order', 'nLandmarks', 'nSamples',
+                 'wallTime', 'peakMB', 'speedup', 'maxAbsDiff'),
+    'startup': ('module', 'repeat', 'wallTime', 'heavyModules'),
+}
+
+# stages whose total time is reported as a csv column of segment reports
+CSV_STAGES = ('crop', 'ppcLoad', 'initialise', 'x0', 'landmarks', 'sampling', 'filtering', 'matching', 'fitting')
+
+
+def _gitCommit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runMeta(benchmark, grid, repeats, trackMemory, seed, memmap=False):
+    return {
+        'benchmark': benchmark,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _gitCommit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpuCount': os.cpu_count(),
+        'grid': grid,
+        'repeats': repeats,
+        'trackMemory': trackMemory,
+        'seed': seed,
+        'memmap': memmap,
+    }
+
+
+def makeConfig(ppcFilename, meshD, nD, nPad, shapeModes, trackMemory):
+    config = asmseg.loadParams('', ppcFilename)
+    config['general']['verbose'] = False
+    config['ASM'].update({
+        'mesh_d': list(meshD),
+        'n_d': nD,
+        'n_lim': list(N_LIM),
+        'n_pad': nPad,
+        'shape_modes': shapeModes,
+    })
+    config['profiling']['track_memory'] = trackMemory
+    return config
+
+
+def initialModel(seed=0):
+    """
+    The synthetic shape model, and the model of a unit sphere deformed to
+    its mean shape at the centre of the synthetic scans.
+
+    returns:
+    model: initial fieldwork model
+    sphereParams: field parameters of the unit sphere
+    shapepcs: shape principal components
+    """
+    model = synthetic.sphereModel()
+    sphereParams = model.get_field_parameters()
+    shapepcs = synthetic.shapeModel(sphereParams, seed=seed)
+    model.set_field_parameters(
+        shapepcs.getMean().reshape((3, -1, 1)) + np.full((3, 1, 1), 0.5 * synthetic.FOV)
+    )
+    return model, sphereParams, shapepcs
+
+
+def prepareData(grid, dataDir, seed=0, memmap=False, verbose=True):
+    """
+    Generate the shape model and, for each image size, a test scan and a
+    texture model per (mesh_d, n_d) in grid. Texture models are written
+    to dataDir. If memmap is True test scan images are written to dataDir
+    and memory-mapped.
+
+    returns:
+    model: initial fieldwork model, the mean shape at the centre of the scans
+    shapepcs: shape principal components
+    cases: {size: (scan, true radii, true centre, {(mesh_d, n_d): ppc filename})}
+    """
+    model, sphereParams, shapepcs = initialModel(seed)
+    profileKeys = [(tuple(meshD), nD) for meshD, nD in itertools.product(grid['mesh_d'], grid['n_d'])]
+    cases = {}
+    for size in grid['size']:
+        t0 = time.time()
+        ppcs = synthetic.trainPPCs(
+            model, sphereParams, size, [(list(meshD), nD, N_LIM) for meshD, nD in profileKeys], seed=seed,
+        )
+        ppcFilenames = {}
+        for (meshD, nD), ppc in zip(profileKeys, ppcs):
+            filename = os.path.join(dataDir, 'synthetic_{}_{}x{}_{}.ppc'.format(size, meshD[0], meshD[1], nD))
+            ppcFilenames[(meshD, nD)] = synthetic.savePPC(ppc, filename)
+        scan, radii, centre = synthetic.testCase(size, seed=seed)
+        if memmap:
+            filename = os.path.join(dataDir, 'synthetic_{}.npy'.format(size))
+            np.save(filename, scan.I)
+            scan = volumes.loadVolumeScan(filename, scan.voxelSpacing, scan.voxelOrigin, name=scan.name)
+        cases[size] = (scan, radii, centre, ppcFilenames)
+        if verbose:
+            print('size {}: synthetic data generated ({:5.2f}s)'.format(size, time.time() - t0))
+
+    return model, shapepcs, cases
+
+
+def runOne(scan, radii, centre, model, shapepcs, config):
+    """
+    Segment scan once and return a result dict of run time, memory, fit
+    errors and the distance of the segmented model to the true surface.
+    """
+    model = copy.deepcopy(model)
+    t0 = time.perf_counter()
+    model, dataASM, meshParamsASM, asmOutput = asmseg.segment(scan, model, shapepcs, config)
+    wallTime = time.perf_counter() - t0
+
+    summary = asmOutput['timings']['summary']
+    surfaceError = synthetic.surfaceDistance(model.get_all_point_positions(), radii, centre)
+    return {
+        'wallTime': wallTime,
+        'peakMB': summary['total'].get('peakMB'),
+        'iterations': asmseg.iterations(asmOutput),
+        'nLandmarks': len(asmOutput['segDataLandmarkMask']),
+        'segRMS': float(asmOutput['segRMS']),
+        'segPFrac': float(asmOutput['segPFrac']),
+        'surfaceRMS': float(np.sqrt((surfaceError ** 2).mean())),
+        'ppcHit': asmOutput['ppcCache']['hit'],
+        'stages': {name: s['total'] for name, s in summary.items()},
+    }
+
+
+def runBenchmark(grid=None, repeats=1, trackMemory=False, dataDir=None, seed=0, memmap=False, verbose=True):
+    """
+    Segment the synthetic scan of each image size in grid with every
+    combination of the [ASM] values in grid, repeats times each. If memmap
+    is True the scans are segmented from memory-mapped files.
+
+    returns:
+    report: dict of run metadata ('meta') and a list of per-run results
+        ('results')
+    """
+    grid = dict(DEFAULT_GRID, **(grid or {}))
+    tempDir = None
+    if dataDir is None:
+        tempDir = tempfile.TemporaryDirectory(prefix='asmseg_benchmark_')
+        dataDir = tempDir.name
+    elif not os.path.isdir(dataDir):
+        os.makedirs(dataDir)
+
+    try:
+        model, shapepcs, cases = prepareData(grid, dataDir, seed=seed, memmap=memmap, verbose=verbose)
+        results = []
+        for size in grid['size']:
+            scan, radii, centre, ppcFilenames = cases[size]
+            for meshD, nD, nPad, shapeModes in itertools.product(
+                    grid['mesh_d'], grid['n_d'], grid['n_pad'], grid['shape_modes']):
+                config = makeConfig(ppcFilenames[(tuple(meshD), nD)], meshD, nD, nPad, shapeModes, trackMemory)
+                for repeat in range(repeats):
+                    result = {
+                        'size': size,
+                        'voxelSpacing': synthetic.FOV / size,
+                        'meshD': list(meshD),
+                        'nD': nD,
+                        'nPad': nPad,
+                        'shapeModes': shapeModes,
+                        'repeat': repeat,
+                    }
+                    result.update(runOne(scan, radii, centre, model, shapepcs, config))
+                    results.append(result)
+                    if verbose:
+                        print('size {size} mesh_d {meshD} n_d {nD} n_pad {nPad} shape_modes {shapeModes}: '
+                              '{wallTime:6.2f}s, {iterations} its, surface RMS {surfaceRMS:5.2f}mm'.format(**result))
+    finally:
+        if tempDir is not None:
+            tempDir.cleanup()
+
+    return {'meta': runMeta('segment', grid, repeats, trackMemory, seed, memmap), 'results': results}
+
+
+def _timeSampling(asm, repeats):
+    # best of repeats wall time, then the peak memory of one more call
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        asm._sampleImage()
+        times.append(time.perf_counter() - t0)
+
+    startedTracing = not tracemalloc.is_tracing()
+    if startedTracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    asm._sampleImage()
+    peakMB = (tracemalloc.get_traced_memory()[1] - base) / 2.0 ** 20
+    if startedTracing:
+        tracemalloc.stop()
+
+    return min(times), peakMB
+
+
+def runSamplingBenchmark(grid=None, chunkMB=sampling.DEFAULT_CHUNK_MB, repeats=3, seed=0, verbose=True):
+    """
+    Time one ASM iteration's profile sampling of the initial model's
+    landmarks in the synthetic scan of each image size in grid, by gias3's
+    ASMSegmentation (sampler 'gias', trilinear) and by the batched sampler
+    at each interpolation order in grid. maxAbsDiff is the largest
+    difference from the gias3 profiles.
+
+    returns:
+    report: dict of run metadata ('meta') and a list of per-run results
+        ('results')
+    """
+    grid = dict(DEFAULT_SAMPLING_GRID, **(grid or {}))
+    model, sphereParams, shapepcs = initialModel(seed)
+    params = model.get_field_parameters()
+
+    results = []
+    for size in grid['size']:
+        scan = synthetic.testCase(size, seed=seed)[0]
+        for meshD, nD, nPad in itertools.product(grid['mesh_d'], grid['n_d'], grid['n_pad']):
+            meshEval, normalEval = synthetic.landmarkEvaluators(model, meshD)
+            landmarks = meshEval(params)
+            normals = normalEval(params)
+            asmKwargs = {'getMeshCoords': lambda x: landmarks, 'getMeshNormals': lambda x: normals}
+
+            samplers = [('gias', 1, ASM.ASMSegmentation(
+                scan, params=ASM.ASMSegmentationParams(ND=nD, NLim=N_LIM, NPad=nPad), **asmKwargs
+            ))]
+            for order in grid['order']:
+                samplers.append(('batched', order, asmsolver.ASMSolver(
+                    scan, params=ASM.ASMSegmentationParams(ND=nD, NLim=N_LIM, NPad=nPad, sampleOrder=order,
+                                                           sampleChunkMB=chunkMB), **asmKwargs
+                )))
+
+            reference = None
+            for name, order, asm in samplers:
+                asm._evaluateLandmarks(None)
+                wallTime, peakMB = _timeSampling(asm, repeats)
+                if reference is None:
+                    reference = (asm.P.copy(), wallTime)
+                result = {
+                    'size': size,
+                    'meshD': list(meshD),
+                    'nD': nD,
+                    'nPad': nPad,
+                    'sampler': name,
+                    'order': order,
+                    'nLandmarks': asm.P.shape[0],
+                    'nSamples': asm.P.shape[1],
+                    'wallTime': wallTime,
+                    'peakMB': peakMB,
+                    'speedup': reference[1] / wallTime,
+                    'maxAbsDiff': float(np.abs(asm.P - reference[0]).max()),
+                }
+                results.append(result)
+                if verbose:
+                    print('size {size} mesh_d {meshD} n_d {nD} n_pad {nPad} {sampler} order {order}: '
+                          '{nLandmarks} landmarks {wallTime:7.4f}s (x{speedup:4.2f}) {peakMB:7.1f}MB '
+                          'max diff {maxAbsDiff:.2e}'.format(**result))
+
+    meta = runMeta('sampling', grid, repeats, True, seed)
+    meta['chunkMB'] = chunkMB
+    return {'meta': meta, 'results': results}
+
+
+_STARTUP_SCRIPT = """
+import importlib, json, sys, time
+t0 = time.perf_counter()
+importlib.import_module({module!r})
+wallTime = time.perf_counter() - t0
+print(json.dumps({{'wallTime': wallTime, 'loaded': sorted(set(m.split('.')[0] for m in sys.modules))}}))
+"""
+
+
+def _parseImportTime(stderr):
+    # cumulative microseconds of each top level import in python -X importtime output
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # nested imports are indented by two spaces per level
+        if name.startswith(' ' * 3):
+            continue
+        times[name.strip()] = int(fields[1])
+    return times
+
+
+def runStartupBenchmark(modules=DEFAULT_STARTUP_MODULES, repeats=5, verbose=True):
+    """
+    Time importing each of modules in a fresh interpreter with python -X
+    importtime. heavyModules lists the HEAVY_MODULES the import loaded,
+    which should be none for the plugin package. topImports are the
+    slowest top level imports of each run, in milliseconds.
+
+    returns:
+    report: dict of run metadata ('meta') and a list of per-run results
+        ('results')
+    """
+    results = []
+    for module in modules:
+        for repeat in range(repeats):
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT.format(module=module)],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if proc.returncode != 0:
+                raise RuntimeError('importing {} failed:\n{}'.format(module, proc.stderr[-2000:]))
+            output = json.loads(proc.stdout.strip().splitlines()[-1])
+            topImports = sorted(_parseImportTime(proc.stderr).items(), key=lambda t: -t[1])[:STARTUP_TOP_IMPORTS]
+            result = {
+                'module': module,
+                'repeat': repeat,
+                'wallTime': output['wallTime'],
+                'heavyModules': ' '.join(m for m in HEAVY_MODULES if m in output['loaded']),
+                'topImports': [[name, us / 1000.0] for name, us in topImports],
+            }
+            results.append(result)
+            if verbose:
+                print('{module} repeat {repeat}: {wallTime:6.3f}s heavy modules loaded: {heavy}'.format(
+                    heavy=result['heavyModules'] or 'none', **result))
+
+    meta = runMeta('startup', {'module': list(modules)}, repeats, False, None)
+    return {'meta': meta, 'results': results}
+
+
+def writeReport(report, outputPrefix):
+    """
+    Write report to outputPrefix.json and its results to outputPrefix.csv.
+    """
+    with open(outputPrefix + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    benchmark = report['meta']['benchmark']
+    fields = list(CSV_FIELDS[benchmark])
+    stages = CSV_STAGES if benchmark == 'segment' else ()
+    with open(outputPrefix + '.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields + ['stage_' + s for s in stages])
+        for result in report['results']:
+            row = [result[k] for k in fields]
+            if 'meshD' in fields:
+                row[fields.index('meshD')] = 'x'.join(str(d) for d in result['meshD'])
+            writer.writerow(row + [result['stages'].get(s, 0.0) for s in stages])
+
+    return outputPrefix + '.json', outputPrefix + '.csv'
+
+
+def _configMedians(report):
+    values = {}
+    configKeys = CONFIG_KEYS[report['meta']['benchmark']]
+    for result in report['results']:
+        key = tuple(tuple(result[k]) if isinstance(result[k], list) else result[k] for k in configKeys)
+        v = values.setdefault(key, {'wallTime': [], 'peakMB': []})
+        v['wallTime'].append(result['wallTime'])
+        if result.get('peakMB') is not None:
+            v['peakMB'].append(result['peakMB'])
+    return {key: {name: float(np.median(v)) if v else None for name, v in vs.items()}
+            for key, vs in values.items()}
+
+
+def compareReports(baseline, current, tolerance=0.1):
+    """
+    Compare the median wall time and peak memory of each configuration in
+    both reports.
+
+    returns:
+    rows: list of (config key, measure, baseline, current, relative change)
+    regressions: the rows whose relative change is greater than tolerance
+    """
+    if baseline['meta']['benchmark'] != current['meta']['benchmark']:
+        raise ValueError('cannot compare a {} report to a {} report'.format(
+            baseline['meta']['benchmark'], current['meta']['benchmark']))
+    base = _configMedians(baseline)
+    cur = _configMedians(current)
+    rows = []
+    for key in sorted(set(base) & set(cur)):
+        for measure in ('wallTime', 'peakMB'):
+            b, c = base[key][measure], cur[key][measure]
+            if b is None or c is None or b == 0:
+                continue
+            rows.append((key, measure, b, c, (c - b) / b))
+    regressions = [row for row in rows if row[4] > tolerance]
+    return rows, regressions
+
+
+def _run(args):
+    grid = {}
+    if args.size:
+        grid['size'] = args.size
+    if args.mesh_d:
+        grid['mesh_d'] = [[d, d] for d in args.mesh_d]
+    if args.n_d:
+        grid['n_d'] = args.n_d
+    if args.n_pad:
+        grid['n_pad'] = args.n_pad
+    if args.shape_modes:
+        grid['shape_modes'] = args.shape_modes
+
+    report = runBenchmark(grid, repeats=args.repeats, trackMemory=args.memory, dataDir=args.data_dir,
+                          seed=args.seed, memmap=args.memmap, verbose=not args.quiet)
+    for filename in writeReport(report, args.out):
+        print('wrote', filename)
+    return 0
+
+
+def _sampling(args):
+    grid = {}
+    if args.size:
+        grid['size'] = args.size
+    if args.mesh_d:
+        grid['mesh_d'] = [[d, d] for d in args.mesh_d]
+    if args.n_d:
+        grid['n_d'] = args.n_d
+    if args.n_pad:
+        grid['n_pad'] = args.n_pad
+    if args.order:
+        grid['order'] = args.order
+
+    report = runSamplingBenchmark(grid, chunkMB=args.chunk_mb, repeats=args.repeats, seed=args.seed,
+                                  verbose=not args.quiet)
+    for filename in writeReport(report, args.out):
+        print('wrote', filename)
+    return 0
+
+
+def _startup(args):
+    report = runStartupBenchmark(args.module or DEFAULT_STARTUP_MODULES, repeats=args.repeats,
+                                 verbose=not args.quiet)
+    for filename in writeReport(report, args.out):
+        print('wrote', filename)
+    return 0
+
+
+def _compare(args):
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r') as f:
+        current = json.load(f)
+
+    rows, regressions = compareReports(baseline, current, args.tolerance)
+    for key, measure, b, c, change in rows:
+        print('{:<40s} {:<8s} {:10.3f} {:10.3f} {:+7.1%}{}'.format(
+            ' '.join(str(k) for k in key), measure, b, c, change, '  REGRESSION' if change > args.tolerance else ''))
+    print('{} of {} measures regressed by more than {:.0%}'.format(len(regressions), len(rows), args.tolerance))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ASM segmentation on synthetic data.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    runParser = subparsers.add_parser('run', help='run the benchmark')
+    runParser.add_argument('--out', default='asmseg_benchmark', help='report filename prefix')
+    runParser.add_argument('--size', type=int, nargs='+', help='image sizes (voxels along each axis)')
+    runParser.add_argument('--mesh-d', type=int, nargs='+', help='mesh_d values, used for both xi directions')
+    runParser.add_argument('--n-d', type=int, nargs='+', help='n_d values')
+    runParser.add_argument('--n-pad', type=int, nargs='+', help='n_pad values')
+    runParser.add_argument('--shape-modes', type=int, nargs='+', help='shape_modes values')
+    runParser.add_argument('--repeats', type=int, default=1, help='runs per configuration')
+    runParser.add_argument('--memory', action='store_true', help='track peak memory, slows down segmentation')
+    runParser.add_argument('--data-dir', default=None, help='directory for texture model files, temporary if not given')
+    runParser.add_argument('--memmap', action='store_true', help='segment memory-mapped scans')
+    runParser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    runParser.add_argument('-q', '--quiet', action='store_true', help='do not print progress')
+    runParser.set_defaults(func=_run)
+
+    samplingParser = subparsers.add_parser('sampling', help='benchmark profile sampling against gias3')
+    samplingParser.add_argument('--out', default='asmseg_sampling_benchmark', help='report filename prefix')
+    samplingParser.add_argument('--size', type=int, nargs='+', help='image sizes (voxels along each axis)')
+    samplingParser.add_argument('--mesh-d', type=int, nargs='+', help='mesh_d values, used for both xi directions')
+    samplingParser.add_argument('--n-d', type=int, nargs='+', help='n_d values')
+    samplingParser.add_argument('--n-pad', type=int, nargs='+', help='n_pad values')
+    samplingParser.add_argument('--order', type=int, nargs='+', help='interpolation orders of the batched sampler')
+    samplingParser.add_argument('--chunk-mb', type=float, default=sampling.DEFAULT_CHUNK_MB,
+                                help='memory cap of each chunk of the batched sampler')
+    samplingParser.add_argument('--repeats', type=int, default=3, help='runs per configuration, the fastest is kept')
+    samplingParser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    samplingParser.add_argument('-q', '--quiet', action='store_true', help='do not print progress')
+    samplingParser.set_defaults(func=_sampling)
+
+    startupParser = subparsers.add_parser('startup', help='benchmark the import time of the plugin')
+    startupParser.add_argument('--out', default='asmseg_startup_benchmark', help='report filename prefix')
+    startupParser.add_argument('--module', nargs='+', help='modules to import, the plugin package by default')
+    startupParser.add_argument('--repeats', type=int, default=5, help='imports of each module')
+    startupParser.add_argument('-q', '--quiet', action='store_true', help='do not print progress')
+    startupParser.set_defaults(func=_startup)
+
+    compareParser = subparsers.add_parser('compare', help='compare two benchmark reports')
+    compareParser.add_argument('baseline', help='baseline report .json')
+    compareParser.add_argument('current', help='current report .json')
+    compareParser.add_argument('--tolerance', type=float, default=0.1,
+                               help='largest allowed relative increase in wall time or peak memory')
+    compareParser.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
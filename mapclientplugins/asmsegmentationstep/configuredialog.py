@@ -28,6 +28,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._previousIdentifier = ''
         self._previousConfig = ''
         self._previousPPC = ''
+        self._previousCacheDir = ''
         # Set a place holder for a callable that will get set from the step.
         # We will use this method to decide whether the identifier is unique.
         self.identifierOccursCount = None
@@ -40,6 +41,8 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._ui.configLineEdit.textChanged.connect(self._configEdited)
         self._ui.ppcButton.clicked.connect(self._ppcClicked)
         self._ui.ppcLineEdit.textChanged.connect(self._ppcEdited)
+        self._ui.cacheButton.clicked.connect(self._cacheClicked)
+        self._ui.cacheLineEdit.textChanged.connect(self._cacheEdited)
 
     def accept(self):
         '''
@@ -87,7 +90,19 @@ class ConfigureDialog(QtWidgets.QDialog):
         else:
             self._ui.ppcLineEdit.setStyleSheet(INVALID_STYLE_SHEET)
 
-        valid = idValid and configValid and ppcValid
+        # if empty, results are not cached. Missing directories are created
+        # on first use, as long as their parent exists.
+        cacheDir = self._ui.cacheLineEdit.text()
+        if cacheDir != '':
+            cacheValid = os.path.isdir(cacheDir) or os.path.isdir(os.path.dirname(os.path.abspath(cacheDir)))
+        else:
+            cacheValid = True
+        if cacheValid:
+            self._ui.cacheLineEdit.setStyleSheet(DEFAULT_STYLE_SHEET)
+        else:
+            self._ui.cacheLineEdit.setStyleSheet(INVALID_STYLE_SHEET)
+
+        valid = idValid and configValid and ppcValid and cacheValid
         self._ui.buttonBox.button(QtWidgets.QDialogButtonBox.Ok).setEnabled(idValid)
 
         return valid
@@ -101,10 +116,12 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._previousIdentifier = self._ui.idLineEdit.text()
         self._previousConfig = self._ui.configLineEdit.text()
         self._previousPPC = self._ui.ppcLineEdit.text()
+        self._previousCacheDir = self._ui.cacheLineEdit.text()
         config = {}
         config['identifier'] = self._ui.idLineEdit.text()
         config['paramFileLoc'] = self._ui.configLineEdit.text()
         config['ppcFileLoc'] = self._ui.ppcLineEdit.text()
+        config['resultCacheDir'] = self._ui.cacheLineEdit.text()
         if self._ui.guiCheckBox.isChecked():
             config['GUI'] = 'True'
         else:
@@ -121,6 +138,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._ui.idLineEdit.setText(config['identifier'])
         self._ui.configLineEdit.setText(config['paramFileLoc'])
         self._ui.ppcLineEdit.setText(config['ppcFileLoc'])
+        self._ui.cacheLineEdit.setText(config.get('resultCacheDir', ''))
         if config['GUI'] == 'True':
             self._ui.guiCheckBox.setChecked(bool(True))
         else:
@@ -143,3 +161,13 @@ class ConfigureDialog(QtWidgets.QDialog):
 
     def _ppcEdited(self):
         self.validate()
+
+    def _cacheClicked(self):
+        location = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select Result Cache Directory',
+                                                              self._previousCacheDir)
+        if location:
+            self._previousCacheDir = location
+            self._ui.cacheLineEdit.setText(location)
+
+    def _cacheEdited(self):
+        self.validate()
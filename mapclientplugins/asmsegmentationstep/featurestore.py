@@ -0,0 +1,294 @@
+"""
+On-disk store of image volumes derived from a scan during segmentation.
+
+The block-averaged images of coarse pyramid levels, and the spline
+coefficients of images sampled with [ASM] sample_order 2 or more, only
+depend on the (cropped) image and the filter parameters, but were
+recomputed for every pass of every run. A FeatureStore writes each derived
+volume to its own .npy file, keyed by a hash of the source image and the
+filter parameters, and memory-maps it back in when the same volume is
+asked for again, by a later pass, run or process.
+
+The store's index.json records the feature, parameters, size and last use
+of every volume. Volumes written or deleted by other processes are picked
+up from the directory when the index is read, so the index never needs to
+be exact. The least recently used volumes are deleted once the store holds
+more than [feature_store] max_mb.
+
+Source images are hashed as by the result cache, so large images are
+hashed by a sample of slabs and an edit confined to the unsampled slabs is
+missed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep import resultcache
+
+MB = float(2 ** 20)
+
+STORE_VERSION = 1   # bump when a feature's computation changes
+
+DEFAULT_MAX_MB = 8192.0
+
+_SUFFIX = '.npy'
+_INDEX = 'index.json'
+
+_stores = {}
+_storesLock = threading.Lock()
+
+
+class FeatureStoreError(Exception):
+    pass
+
+
+def volumeKey(digest, feature, params):
+    """
+    Key of the volume feature(params) of the image with hash digest, as a
+    hex string.
+    """
+    h = hashlib.sha1()
+    h.update(repr(('asmfeature', STORE_VERSION, digest, feature, sorted(params.items()))).encode())
+    return h.hexdigest()
+
+
+class FeatureStore(object):
+    """
+    Directory of derived volumes saved as .npy files, evicted least
+    recently used first once their total size exceeds maxMB. Thread-safe,
+    and several processes may share one directory.
+    """
+
+    def __init__(self, directory, maxMB=DEFAULT_MAX_MB, hashFullMB=resultcache.DEFAULT_HASH_FULL_MB,
+                 hashSampleMB=resultcache.DEFAULT_HASH_SAMPLE_MB):
+        if not directory:
+            raise FeatureStoreError('feature store directory not set')
+        self.directory = directory
+        self.maxBytes = int(maxMB * MB)
+        self.hashFullMB = hashFullMB
+        self.hashSampleMB = hashSampleMB
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._digests = {}  # id(array): (weakref to array, digest)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def digest(self, I):
+        """
+        Hash of image I, remembered for as long as I exists so images
+        sampled by several passes, and volumes from the store, are only
+        hashed once.
+        """
+        with self._lock:
+            entry = self._digests.get(id(I))
+            if entry is not None and entry[0]() is I:
+                return entry[1]
+        digest = resultcache.hashArray(hashlib.sha1(), I, self.hashFullMB, self.hashSampleMB).hexdigest()
+        self._remember(I, digest)
+        return digest
+
+    def _remember(self, I, digest):
+        key = id(I)
+
+        def forget(ref):
+            with self._lock:
+                if self._digests.get(key, (None,))[0] is ref:
+                    del self._digests[key]
+
+        with self._lock:
+            self._digests[key] = (weakref.ref(I, forget), digest)
+
+    def volume(self, I, feature, params, compute):
+        """
+        The volume compute() derived from image I by feature with params,
+        memory-mapped read-only from the store if it is there, else
+        computed and stored.
+
+        returns the volume, and whether it was read from the store
+        """
+        key = volumeKey(self.digest(I), feature, params)
+        V = self.get(key)
+        if V is not None:
+            self._remember(V, key)
+            return V, True
+
+        V = compute()
+        self.put(key, V, feature, params)
+        self._remember(V, key)
+        return V, False
+
+    def get(self, key):
+        """
+        The volume stored under key, memory-mapped read-only, or None on a
+        miss. Unreadable files are deleted and count as misses.
+        """
+        path = self._path(key)
+        try:
+            V = np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            V = None
+        except Exception:
+            # truncated, or being replaced on a platform that cannot
+            self._delete(path)
+            V = None
+
+        with self._lock:
+            if V is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            index = self._readIndex()
+            if key in index:
+                index[key]['lastUsed'] = time.time()
+                self._writeIndex(index)
+        return V
+
+    def put(self, key, V, feature='', params=None):
+        """
+        Store volume V under key, then evict old volumes. The volume just
+        stored is never evicted, even if it alone exceeds the store size.
+        """
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(V))
+            # atomic, so other processes never map a partial volume
+            os.replace(tmpPath, self._path(key))
+        except Exception:
+            self._delete(tmpPath)
+            raise
+
+        with self._lock:
+            index = self._readIndex()
+            index[key] = {
+                'feature': feature,
+                'params': {k: repr(v) for k, v in (params or {}).items()},
+                'shape': list(V.shape),
+                'dtype': V.dtype.str,
+                'nBytes': os.path.getsize(self._path(key)),
+                'lastUsed': time.time(),
+            }
+            self._evict(index, keep=key)
+            self._writeIndex(index)
+
+    def _readIndex(self):
+        # the index file reconciled with the volumes in the directory
+        try:
+            with open(os.path.join(self.directory, _INDEX)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        onDisk = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            key = name[:-len(_SUFFIX)]
+            if key in index:
+                onDisk[key] = index[key]
+                continue
+            # stored by a process whose index update was lost
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            onDisk[key] = {'nBytes': stat.st_size, 'lastUsed': stat.st_mtime}
+        return onDisk
+
+    def _writeIndex(self, index):
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, os.path.join(self.directory, _INDEX))
+        except OSError:
+            # the index is rebuilt from the directory if it cannot be written
+            self._delete(tmpPath)
+
+    def _evict(self, index, keep=None):
+        nBytes = sum(e['nBytes'] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]['lastUsed']):
+            if nBytes <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            # volumes still mapped elsewhere stay readable where files can be unlinked
+            self._delete(self._path(key))
+            nBytes -= index.pop(key)['nBytes']
+            self.evictions += 1
+
+    def setMaxMB(self, maxMB):
+        with self._lock:
+            self.maxBytes = int(maxMB * MB)
+            index = self._readIndex()
+            self._evict(index)
+            self._writeIndex(index)
+
+    def entries(self):
+        """
+        Index entry of every stored volume by key.
+        """
+        with self._lock:
+            return self._readIndex()
+
+    def clear(self):
+        with self._lock:
+            for key in self._readIndex():
+                self._delete(self._path(key))
+            self._writeIndex({})
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'nBytes': sum(e['nBytes'] for e in entries.values()),
+                'maxBytes': self.maxBytes,
+            }
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def storeFor(config):
+    """
+    The process-wide FeatureStore of the [feature_store] directory in
+    config, or None if it is not set. Stores are kept for the life of the
+    process so images are not rehashed by every run.
+    """
+    storeConfigs = config.get('feature_store', {})
+    directory = storeConfigs.get('directory', '')
+    if not directory:
+        return None
+    directory = os.path.abspath(directory)
+    maxMB = storeConfigs.get('max_mb', DEFAULT_MAX_MB)
+    with _storesLock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = FeatureStore(
+                directory, maxMB,
+                hashFullMB=storeConfigs.get('hash_full_mb', resultcache.DEFAULT_HASH_FULL_MB),
+                hashSampleMB=storeConfigs.get('hash_sample_mb', resultcache.DEFAULT_HASH_SAMPLE_MB),
+            )
+            return store
+    if store.maxBytes != int(maxMB * MB):
+        store.setMaxMB(maxMB)
+    return store
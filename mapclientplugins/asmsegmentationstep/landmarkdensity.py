@@ -0,0 +1,149 @@
+"""
+Adaptive landmark density for ASM segmentation.
+
+mesh_d places the same grid of landmarks on every element, so flat
+regions get as many profile searches as detailed ones. With [ASM]
+adaptive_landmarks set, each element starts with a fraction of its
+landmarks, spread evenly over the element, and elements are refined
+(their number of landmarks doubled) after any iteration in which many
+more of their landmarks fail the pass_window test, or their match
+distances are much higher, than those of the median element. Refining
+relative to the other elements keeps the density low while the whole
+model is still moving to the boundary. Only the landmarks in use are
+sampled, matched and fitted.
+
+The texture model has one profile model per landmark of the mesh_d grid,
+so mesh_d is the finest density an element can be refined to.
+"""
+import numpy as np
+
+DEFAULT_START_FRAC = 0.25
+# tuned on the synthetic benchmark, about 40% fewer profiles than the full
+# mesh_d grid at the same pass fraction
+DEFAULT_REFINE_FAIL_FRAC = 0.3
+DEFAULT_REFINE_FAIL_FACTOR = 2.0
+DEFAULT_REFINE_M_FACTOR = 3.0
+
+
+class LandmarkDensityError(Exception):
+    pass
+
+
+def spreadOrder(points):
+    """
+    Order of points in which each point is the one furthest from all
+    points before it (farthest point sampling), starting from the point
+    closest to their centroid. The first k points of the order are spread
+    evenly over the points for any k.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        return np.zeros(0, dtype=int)
+    order = np.empty(len(points), dtype=int)
+    order[0] = np.argmin(((points - points.mean(0)) ** 2).sum(1))
+    distance = ((points - points[order[0]]) ** 2).sum(1)
+    for i in range(1, len(points)):
+        order[i] = np.argmax(distance)
+        distance = np.minimum(distance, ((points - points[order[i]]) ** 2).sum(1))
+    return order
+
+
+def passMask(matchInd, nSamples, window):
+    """
+    Whether each match is in the middle window proportion of profiles of
+    nSamples samples, as the pass test of ASM._asmStopCrit.
+    """
+    n0 = nSamples / 2.0 - nSamples * window
+    n1 = nSamples / 2.0 + nSamples * window
+    matchInd = np.asarray(matchInd)
+    return (n0 <= matchInd) & (matchInd <= n1)
+
+
+class AdaptiveDensity(object):
+    """
+    The landmarks in use on each element.
+
+    elementXIndices: landmark indices of each element
+    points: (n landmarks, 3) landmark positions the landmarks of each
+        element are spread over, e.g. those of the initial shape
+    startFrac: fraction of each element's landmarks used at the start
+    failFrac: elements with more than this fraction of their matched
+        landmarks failing the pass test, and more than failFactor times
+        the median element's fraction, are refined
+    failFactor: see failFrac
+    mFactor: elements whose mean match distance is more than this times
+        the median of all elements' are refined
+    minLandmarks: least number of landmarks used on an element, e.g. the
+        number elementmedian matching needs
+    """
+
+    def __init__(self, elementXIndices, points, startFrac=DEFAULT_START_FRAC, failFrac=DEFAULT_REFINE_FAIL_FRAC,
+                 failFactor=DEFAULT_REFINE_FAIL_FACTOR, mFactor=DEFAULT_REFINE_M_FACTOR, minLandmarks=1):
+        if not 0.0 < startFrac <= 1.0:
+            raise LandmarkDensityError('adaptive start fraction must be in (0, 1], not {}'.format(startFrac))
+        points = np.asarray(points, dtype=float)
+        self.elements = [np.asarray(e, dtype=int) for e in elementXIndices]
+        # each element's landmarks in the order they are added
+        self.orders = [e[spreadOrder(points[e])] for e in self.elements]
+        self.counts = np.array([min(len(e), max(minLandmarks, int(np.ceil(startFrac * len(e)))))
+                                for e in self.elements], dtype=int)
+        self.failFrac = failFrac
+        self.failFactor = failFactor
+        self.mFactor = mFactor
+        self.nLandmarks = len(points)
+
+    def activeMask(self):
+        """
+        Boolean mask of the landmarks in use.
+        """
+        active = np.zeros(self.nLandmarks, dtype=bool)
+        for order, count in zip(self.orders, self.counts):
+            active[order[:count]] = True
+        return active
+
+    def refine(self, landmarks, passed, m):
+        """
+        Double the landmarks of elements whose matched landmarks failed or
+        matched badly.
+
+        inputs:
+        landmarks: indices of the matched landmarks, as returned by the
+            matcher, which may skip landmarks in use
+        passed: whether each matched landmark passed
+        m: match distance of each matched landmark
+
+        returns the indices of the refined elements
+        """
+        landmarks = np.asarray(landmarks, dtype=int)
+        if not len(landmarks) == len(passed) == len(m):
+            raise LandmarkDensityError('{} matched landmarks but {} pass results and {} match distances'.format(
+                len(landmarks), len(passed), len(m)))
+        landmarkMask = np.zeros(self.nLandmarks, dtype=bool)
+        landmarkMask[landmarks] = True
+        landmarkPassed = np.zeros(self.nLandmarks, dtype=bool)
+        landmarkPassed[landmarks] = passed
+        landmarkM = np.full(self.nLandmarks, np.nan)
+        landmarkM[landmarks] = m
+
+        failFracs = np.zeros(len(self.elements))
+        meanM = np.full(len(self.elements), np.nan)
+        for i, e in enumerate(self.elements):
+            used = e[landmarkMask[e]]
+            if len(used):
+                failFracs[i] = 1.0 - landmarkPassed[used].mean()
+                meanM[i] = landmarkM[used].mean()
+
+        matched = np.isfinite(meanM)
+        failLimit = self.failFrac
+        if np.any(matched):
+            failLimit = max(failLimit, self.failFactor * np.median(failFracs[matched]))
+        refine = failFracs > failLimit
+        if np.any(matched):
+            with np.errstate(invalid='ignore'):
+                refine |= meanM > self.mFactor * np.nanmedian(meanM)
+        refine &= self.counts < np.array([len(e) for e in self.elements])
+
+        refined = np.where(refine)[0]
+        for i in refined:
+            self.counts[i] = min(len(self.elements[i]), 2 * self.counts[i])
+        return refined
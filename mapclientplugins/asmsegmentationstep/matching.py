@@ -0,0 +1,224 @@
+"""
+Matrix-form texture matching of sampled profiles against profile PCs.
+
+gias3's profile search (asm_search) scores one candidate window of one
+landmark's profile at a time: normalise the window, subtract the PC mean,
+project onto the PC modes and sum the squared weights over the mode
+variances. TextureMatcher precomputes, once per run, every landmark's
+mean, projection matrix and inverse mode variances as padded arrays, then
+scores all candidate windows of all landmarks with a few einsums per
+chunk of landmarks. Since the projection is linear, each window is
+projected before it is normalised, so the normalised windows are never
+built.
+
+The match modes ('default', 'oneside' and 'elementmedian') give the same
+matches as gias3's profileSearchElementPoints, profileSearchElementOneSide
+and profileSearchElementMedian, with match positions as integers.
+"""
+import numpy as np
+
+MB = float(2 ** 20)
+
+DEFAULT_CHUNK_MB = 64.0
+
+MIN_ELEMENT_LANDMARKS = 5   # elements with fewer valid landmarks are skipped in elementmedian matching
+
+
+class MatchingError(Exception):
+    pass
+
+
+def _windows(dP, length, nShift):
+    # shape (n profiles, nShift, length) view of the sliding windows of dP
+    nProfiles, nSamples = dP.shape
+    s0, s1 = dP.strides
+    return np.lib.stride_tricks.as_strided(dP, shape=(nProfiles, nShift, length), strides=(s0, s1, s1),
+                                           writeable=False)
+
+
+def findTroughs(M):
+    """
+    Boolean array of the troughs, M[i, j - 1] > M[i, j] < M[i, j + 1], of
+    each row of M. Rows without a trough have their minimum marked
+    instead, as asm_search.findTrough.
+    """
+    troughs = np.zeros(M.shape, dtype=bool)
+    troughs[:, 1:-1] = (M[:, 1:-1] < M[:, 2:]) & (M[:, 1:-1] < M[:, :-2])
+    none = ~troughs.any(1)
+    troughs[none, M[none].argmin(1)] = True
+    return troughs
+
+
+class TextureMatcher(object):
+    """
+    The profile PCs of every landmark in matrix form.
+
+    ppcs: list of PCA.PrincipalComponents, one per landmark
+    ppcModes: list of the modes of each profile PC used for matching, as
+        returned by PCList.getModesFracVariance
+    chunkMB: memory cap of the arrays of each chunk of landmarks scored
+        together
+    """
+
+    def __init__(self, ppcs, ppcModes, chunkMB=DEFAULT_CHUNK_MB):
+        if len(ppcs) != len(ppcModes):
+            raise MatchingError('{} profile PCs but modes for {}'.format(len(ppcs), len(ppcModes)))
+        self.chunkMB = chunkMB
+        self.length = len(ppcs[0].getMean())
+        nModes = max(len(modes) for modes in ppcModes)
+
+        # padded with zero modes of zero inverse variance, which add nothing
+        self.mean = np.zeros((len(ppcs), self.length))
+        self.projection = np.zeros((len(ppcs), self.length, nModes))
+        self.invVariance = np.zeros((len(ppcs), nModes))
+        for i, (pc, modes) in enumerate(zip(ppcs, ppcModes)):
+            mean = pc.getMean()
+            if len(mean) != self.length:
+                raise MatchingError('profile PC {} has length {}, not {}'.format(i, len(mean), self.length))
+            self.mean[i] = mean
+            self.projection[i, :, :len(modes)] = pc.modes[:, modes]
+            self.invVariance[i, :len(modes)] = 1.0 / pc.weights[modes]
+        self.meanWeights = np.einsum('ld,ldk->lk', self.mean, self.projection)
+
+    @property
+    def centre(self):
+        """
+        Offset of the centre of a window from its start.
+        """
+        return self.length // 2 + 1 if self.length % 2 else self.length // 2
+
+    def chunkSize(self, nShift):
+        """
+        Number of landmarks scored together at nShift window positions.
+        """
+        nModes = self.projection.shape[2]
+        # window abs sums, projected weights and their squares, plus temporaries
+        return max(1, int(self.chunkMB * MB // (nShift * (2 * nModes + 2) * 8 * 2)))
+
+    def distances(self, dP, landmarks):
+        """
+        Squared Mahalanobis distance of each window of each landmark's
+        derivative profile to the landmark's profile PC.
+
+        inputs:
+        dP: (n landmarks, n samples) array of derivative profiles
+        landmarks: indices of the landmarks to score
+
+        returns:
+        M: (len(landmarks), n samples - PC length) array of distances, one
+            per window start position
+        """
+        landmarks = np.asarray(landmarks, dtype=int)
+        nShift = dP.shape[1] - self.length
+        if nShift < 1:
+            raise MatchingError('profiles of {} samples are too short for profile PCs of length {}'
+                                .format(dP.shape[1], self.length))
+
+        M = np.empty((len(landmarks), nShift))
+        chunk = self.chunkSize(nShift)
+        for c0 in range(0, len(landmarks), chunk):
+            ind = landmarks[c0:c0 + chunk]
+            windows = _windows(np.ascontiguousarray(dP[ind]), self.length, nShift)
+            absSum = np.abs(windows).sum(2)
+            # windows of all zeros normalise to zero, as their nans are zeroed in asm_search
+            zero = absSum == 0.0
+            absSum[zero] = 1.0
+            W = np.einsum('lsd,ldk->lsk', windows, self.projection[ind]) / absSum[:, :, np.newaxis]
+            W[zero] = 0.0
+            W -= self.meanWeights[ind][:, np.newaxis, :]
+            M[c0:c0 + chunk] = np.einsum('lsk,lk->ls', W * W, self.invVariance[ind])
+
+        return M
+
+    def matchPoints(self, dP, landmarks):
+        """
+        Best match of each landmark, as asm_search.profileSearchElementPoints.
+
+        returns:
+        x: match position of each landmark, the centre of its best window
+        m: Mahalanobis distance of each match
+        M: distances of every window of each landmark
+        """
+        M = self.distances(dP, landmarks)
+        best = M.argmin(1)
+        return best + self.centre, M[np.arange(len(best)), best], M
+
+    def _elementMatches(self, dP, elements):
+        # match every landmark of every element at once, then split by element
+        elements = [np.asarray(e, dtype=int) for e in elements]
+        if not elements:
+            return []
+        x, m, M = self.matchPoints(dP, np.hstack(elements))
+        splits = np.cumsum([len(e) for e in elements])[:-1]
+        return list(zip(np.split(x, splits), np.split(m, splits), np.split(M, splits)))
+
+    def matchOneSide(self, dP, elementXIndices):
+        """
+        Matches constrained to be on one side of each element, as
+        asm_search.profileSearchElementOneSide: landmarks matched on the
+        minority side of their element are rematched on the majority side.
+
+        returns x, m and M as matchPoints, in element order, and the
+        landmark index of each match
+        """
+        elementXIndices = [np.asarray(e, dtype=int) for e in elementXIndices]
+        halfProfile = dP.shape[1] // 2
+        halfPC = self.length // 2
+        padLength = halfProfile - halfPC
+
+        x, m, M = [], [], []
+        for xE, mE, ME in self._elementMatches(dP, elementXIndices):
+            sides = np.sign(xE - halfProfile)
+            side = sides.sum()
+            if side != 0 and abs(side) != len(xE):
+                if side <= 0:
+                    redo = np.where(sides > 0)[0]
+                    t = ME[redo, :padLength].argmin(1)
+                else:
+                    redo = np.where(sides < 0)[0]
+                    t = ME[redo, padLength:].argmin(1) + padLength
+                xE[redo] = t + halfPC
+                mE[redo] = ME[redo, t]
+            x.append(xE)
+            m.append(mE)
+            M.append(ME)
+
+        return np.hstack(x), np.hstack(m), np.vstack(M), np.hstack(elementXIndices)
+
+    def matchElementMedian(self, dP, elementXIndices, landmarkMask, outSD=1.0):
+        """
+        Matches with per-element outliers rematched, as
+        asm_search.profileSearchElementMedian: landmarks matched further
+        than outSD standard deviations from their element's median match
+        are rematched at the trough of their distances closest to the
+        median. Elements with fewer than MIN_ELEMENT_LANDMARKS valid
+        landmarks are skipped.
+
+        returns x, m and M as matchPoints, of the valid landmarks of the
+        elements not skipped in element order, and the landmark index of
+        each match
+        """
+        halfPC = self.length // 2
+        elements = []
+        for e in elementXIndices:
+            e = np.asarray(e, dtype=int)
+            if landmarkMask[e].sum() >= MIN_ELEMENT_LANDMARKS:
+                elements.append(e[landmarkMask[e]])
+        if not elements:
+            raise MatchingError('no element has {} valid landmarks'.format(MIN_ELEMENT_LANDMARKS))
+
+        x, m, M = [], [], []
+        for xE, mE, ME in self._elementMatches(dP, elements):
+            median = np.median(xE)
+            out = np.where(abs(xE - median) > outSD * xE.std())[0]
+            if len(out):
+                positions = np.arange(ME.shape[1]) + halfPC
+                distance = np.where(findTroughs(ME[out]), abs(positions - median), np.inf)
+                t = distance.argmin(1)
+                xE[out] = t + halfPC
+                mE[out] = ME[out, t]
+            x.append(xE)
+            m.append(mE)
+            M.append(ME)
+
+        return np.hstack(x), np.hstack(m), np.vstack(M), np.hstack(elements)
@@ -21,18 +21,31 @@ import os
 
 os.environ['ETS_TOOLKIT'] = 'qt'
 
-from PySide6.QtWidgets import QDialog, QFileDialog, QAbstractItemView, QTableWidgetItem
+import threading
+import time
+import traceback
+
+from PySide6.QtWidgets import QDialog, QFileDialog, QAbstractItemView, QTableWidgetItem, QMessageBox
 from PySide6.QtCore import Qt, QThread, Signal
 
 from mapclientplugins.asmsegmentationstep.ui_mayaviasmsegmentationviewerwidget import Ui_Dialog
 
-from gias3.mapclientpluginutilities.viewers.mayaviviewerdatapoints import MayaviViewerDataPoints
+from gias3.mapclientpluginutilities.viewers.mayaviviewerdatapoints import MayaviViewerDataPoints, \
+    MayaviViewerDataPointsSceneObject
 from gias3.mapclientpluginutilities.viewers.mayaviviewerimageplane import MayaviViewerImagePlane
-from gias3.mapclientpluginutilities.viewers.mayaviviewerfieldworkmodel import MayaviViewerFieldworkModel
+from gias3.mapclientpluginutilities.viewers.mayaviviewerfieldworkmodel import MayaviViewerFieldworkModel, \
+    MayaviViewerFieldworkModelSceneObject
 from gias3.mapclientpluginutilities.viewers.mayaviviewerobjects import MayaviViewerObjectsContainer, colours
 
 import numpy as np
-from gias3.image_analysis import fw_segmentation_tools as fst
+from mayavi import mlab
+
+from gias3.fieldwork.field import geometric_field
+
+from mapclientplugins.asmsegmentationstep import pointclouds
+from mapclientplugins.asmsegmentationstep import sweep
+from mapclientplugins.asmsegmentationstep import volumes
+from mapclientplugins.asmsegmentationstep.sweeppanel import SweepPanel
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
 DEFAULT_STYLE_SHEET = ''
@@ -40,16 +53,303 @@ DEFAULT_STYLE_SHEET = ''
 
 class _ExecThread(QThread):
     update = Signal(tuple)
+    progress = Signal(object)
+    error = Signal(object)
 
     def __init__(self, func):
         QThread.__init__(self)
         self.func = func
 
     def run(self):
-        output = self.func()
+        try:
+            output = self.func(callback=self.progress.emit)
+        except Exception as e:
+            traceback.print_exc()
+            self.error.emit(e)
+            return
         self.update.emit(output)
 
 
+class _SliceLoader(QThread):
+    '''
+    Loads full resolution image slices in the background. Only the latest
+    requested slice is loaded, requests made while loading replace any
+    pending request.
+    '''
+    loaded = Signal(int, int, object)
+
+    def __init__(self, loadSlice):
+        QThread.__init__(self)
+        self._loadSlice = loadSlice
+        self._request = None
+        self._lock = threading.Lock()
+        # a request made as the thread was exiting is loaded by a new run
+        self.finished.connect(self._restartIfPending)
+
+    def request(self, axis, index):
+        with self._lock:
+            self._request = (axis, index)
+        if not self.isRunning():
+            self.start()
+
+    def _restartIfPending(self):
+        with self._lock:
+            pending = self._request is not None
+        if pending:
+            self.start()
+
+    def run(self):
+        while True:
+            with self._lock:
+                request = self._request
+                self._request = None
+            if request is None:
+                return
+            self.loaded.emit(request[0], request[1], self._loadSlice(*request))
+
+
+class _LODImagePlane(MayaviViewerImagePlane):
+    '''
+    Image plane of a large image displayed as a subsampled proxy, drawn
+    with the spacing of its voxels in the full resolution image's index
+    space. Once the plane stops moving, the slice it shows is loaded at
+    full resolution in the background and displayed in place of the
+    proxy's slice.
+    '''
+    _orientations = ('x_axes', 'y_axes', 'z_axes')
+
+    def __init__(self, name, proxy, stride, image, render_args=None):
+        super(_LODImagePlane, self).__init__(name, proxy, render_args=render_args)
+        self.stride = stride
+        self.image = image
+        self._scene = None
+        self._slice = None  # (axis, index) of the plane
+        self._sliceSrc = None
+        self._sliceWidget = None
+        self._loader = None
+        if stride > 1:
+            self._loader = _SliceLoader(lambda axis, index: volumes.imageSlice(self.image, axis, index))
+            self._loader.loaded.connect(self._sliceLoaded)
+
+    def draw(self, scene):
+        sceneObject = super(_LODImagePlane, self).draw(scene)
+        sceneObject.ISrc.spacing = [self.stride] * 3
+        if self._loader is not None:
+            self._scene = scene
+            ipw = sceneObject.slicerWidget.ipw
+            ipw.add_observer('InteractionEvent', self._planeMoved)
+            ipw.add_observer('EndInteractionEvent', self._planeReleased)
+            self._planeReleased()
+        return sceneObject
+
+    def setVisibility(self, visible):
+        super(_LODImagePlane, self).setVisibility(visible)
+        if self._sliceWidget is not None:
+            self._sliceWidget.visible = visible and self._slice is not None
+
+    def remove(self):
+        if self._sliceWidget is not None:
+            self._sliceWidget.remove()
+            self._sliceSrc.remove()
+            self._sliceWidget = None
+            self._sliceSrc = None
+        self._slice = None
+        super(_LODImagePlane, self).remove()
+
+    def changeSlicePlane(self, plane):
+        super(_LODImagePlane, self).changeSlicePlane(plane)
+        if self._loader is not None:
+            self._planeReleased()
+
+    def _planeMoved(self, obj=None, event=None):
+        # show the proxy while the plane moves
+        self._slice = None
+        self.sceneObject.slicerWidget.ipw.texture_visibility = True
+        if self._sliceWidget is not None:
+            self._sliceWidget.visible = False
+
+    def _planeReleased(self, obj=None, event=None):
+        ipw = self.sceneObject.slicerWidget.ipw
+        axis = int(ipw.plane_orientation)
+        index = int(np.clip(np.round(ipw.slice_position), 0, self.image.shape[axis] - 1))
+        self._slice = (axis, index)
+        self._loader.request(axis, index)
+
+    def _sliceLoaded(self, axis, index, data):
+        # called through a queued signal, drop slices the plane has moved off
+        if self.sceneObject is None or self._slice != (axis, index):
+            return
+
+        self._scene.disable_render = True
+        slab = np.expand_dims(data, axis)
+        origin = [0.0, 0.0, 0.0]
+        origin[axis] = float(index)
+        if self._sliceSrc is None:
+            self._sliceSrc = mlab.pipeline.scalar_field(slab)
+            self._sliceSrc.origin = origin
+            renderArgs = dict(self.renderArgs)
+            self._sliceWidget = mlab.pipeline.image_plane_widget(self._sliceSrc,
+                                                                 plane_orientation=self._orientations[axis],
+                                                                 slice_index=0,
+                                                                 **renderArgs)
+            self._sliceWidget.ipw.interaction = False
+        else:
+            self._sliceSrc.scalar_data = slab
+            self._sliceSrc.origin = origin
+            self._sliceSrc.update()
+            self._sliceWidget.ipw.plane_orientation = self._orientations[axis]
+            self._sliceWidget.ipw.slice_index = 0
+        self._sliceWidget.visible = self.sceneObject.slicerWidget.visible
+        self.sceneObject.slicerWidget.ipw.texture_visibility = False
+        self._scene.disable_render = False
+
+
+class _ImageSpaceGeometry(object):
+    '''
+    What is needed to draw a model in image voxel indices, computed once
+    per viewer: the physical to image index affine of the scan, the sparse
+    evaluator of the model's mesh at the display discretisation and the
+    triangulation of the evaluated points. Drawing a set of field
+    parameters is then one affine transform of the nodes and one sparse
+    product.
+    '''
+
+    def __init__(self, scan, model, discretisation, negSpacing, zShift):
+        self.A, self.b = volumes.indexAffine(scan, negSpacing=negSpacing, zShift=zShift)
+        self.evaluator = geometric_field.makeGeometricFieldEvaluatorSparse(model, discretisation)
+        self.triangles = model.triangulator._triangulate(discretisation)
+
+    def toImage(self, X):
+        '''
+        Image indices of an (n, 3) array of physical coordinates.
+        '''
+        return np.dot(X, self.A.T) + self.b
+
+    def imageParams(self, fieldParameters):
+        '''
+        Field parameters in image indices, as fst.makeImageSpaceGF.
+        '''
+        return self.toImage(fieldParameters[:, :, 0].T).T[:, :, np.newaxis]
+
+    def vertices(self, imageParams):
+        return self.evaluator(imageParams.ravel())
+
+
+class _ImageSpaceFieldworkModel(MayaviViewerFieldworkModel):
+    '''
+    A model drawn from a shared _ImageSpaceGeometry. updateGeometry takes
+    field parameters in physical coordinates, and neither it nor draw
+    evaluate or modify the model itself, so all displayed models share
+    the step's model.
+    '''
+
+    def __init__(self, name, model, geometry, fieldParameters, discrete, render_args=None):
+        super(_ImageSpaceFieldworkModel, self).__init__(name, model, discrete, evaluator=geometry.evaluator,
+                                                        render_args=render_args)
+        self.geometry = geometry
+        self.imageParams = geometry.imageParams(fieldParameters)
+
+    def draw(self, scene):
+        scene.disable_render = True
+        V = self.geometry.vertices(self.imageParams)
+        mesh = scene.mlab.triangular_mesh(V[0], V[1], V[2], self.geometry.triangles, name=self.name,
+                                          **self.renderArgs)
+        p = self.imageParams.reshape((3, -1))
+        points = scene.mlab.points3d(p[0], p[1], p[2], np.arange(p.shape[1]), mode='sphere', scale_mode='none',
+                                     scale_factor=0.5, color=(1, 0, 0))
+        points.visible = self.displayGFNodes
+        self.sceneObject = MayaviViewerFieldworkModelSceneObject(self.name, mesh, points)
+        scene.disable_render = False
+        return self.sceneObject
+
+    def updateGeometry(self, fieldParameters, scene):
+        self.imageParams = self.geometry.imageParams(fieldParameters)
+        if self.sceneObject is None:
+            self.draw(scene)
+        else:
+            V = self.geometry.vertices(self.imageParams)
+            p = self.imageParams.reshape((3, -1))
+            self.sceneObject.mesh.mlab_source.set(x=V[0], y=V[1], z=V[2])
+            self.sceneObject.points.mlab_source.set(x=p[0], y=p[1], z=p[2])
+
+
+class _PointCloud(MayaviViewerDataPoints):
+    '''
+    Point cloud drawn by a single glyph source, whose points are replaced
+    in place by setPoints. mode is 'point' for plain points or a Mayavi
+    glyph mode drawn at low resolution. Clouds of more than budget points
+    are voxel-grid decimated, 0 to draw every point. Points are coloured
+    by their match quality if it is given, green for the best matches.
+    '''
+    pointSize = 3.0
+    glyphResolution = 4
+    qualityPercentile = 95.0  # match distances above this percentile get the worst colour
+
+    def __init__(self, name, mode='point', budget=0, render_args=None):
+        super(_PointCloud, self).__init__(name, np.zeros((0, 3)), render_args=render_args)
+        self.mode = mode
+        self.budget = budget
+        self.quality = None
+
+    def setPoints(self, coordinates, quality, scene):
+        '''
+        Replace the points, and their match distances if quality is not
+        None, and show them.
+        '''
+        self._coordinates, self.quality = pointclouds.decimate(coordinates, self.budget, quality)
+        if self.sceneObject is None:
+            self.draw(scene)
+        elif not len(self._coordinates):
+            self.sceneObject.setVisibility(False)
+        else:
+            scene.disable_render = True
+            d = self._coordinates
+            # reset, since the number of points changes
+            self.sceneObject.points.mlab_source.reset(x=d[:, 0], y=d[:, 1], z=d[:, 2], scalars=self._scalars())
+            self._showQuality()
+            self.sceneObject.setVisibility(True)
+            scene.disable_render = False
+
+    def _scalars(self):
+        return self.quality if self.quality is not None else np.zeros(len(self._coordinates))
+
+    def _showQuality(self):
+        points = self.sceneObject.points
+        if self.quality is None:
+            points.actor.mapper.scalar_visibility = False
+            points.actor.property.color = self.renderArgs['color']
+        else:
+            lut = points.module_manager.scalar_lut_manager
+            lut.data_range = (self.quality.min(), max(np.percentile(self.quality, self.qualityPercentile),
+                                                      self.quality.min() + 1e-6))
+            points.actor.mapper.scalar_visibility = True
+
+    def draw(self, scene):
+        # nothing to draw until setPoints is called
+        if not len(self._coordinates):
+            return None
+
+        scene.disable_render = True
+        d = self._coordinates
+        renderArgs = dict(self.renderArgs)
+        renderArgs.pop('color', None)
+        if self.mode != 'point':
+            renderArgs.setdefault('resolution', self.glyphResolution)
+        points = scene.mlab.points3d(d[:, 0], d[:, 1], d[:, 2], self._scalars(), mode=self.mode,
+                                     scale_mode='none', colormap='RdYlGn', **renderArgs)
+        points.module_manager.scalar_lut_manager.reverse_lut = True
+        if self.mode == 'point':
+            points.actor.property.point_size = self.pointSize
+        self.sceneObject = MayaviViewerDataPointsSceneObject(self.name, points)
+        self._showQuality()
+        scene.disable_render = False
+        return self.sceneObject
+
+    def remove(self):
+        if self.sceneObject is not None:
+            super(_PointCloud, self).remove()
+
+
 class MayaviASMSegmentationViewerWidget(QDialog):
     '''
     Configure dialog to present the user with the options to configure this step.
@@ -57,12 +357,16 @@ class MayaviASMSegmentationViewerWidget(QDialog):
     defaultColor = colours['bone']
     objectTableHeaderColumns = {'visible': 0}
     backgroundColour = (0.0, 0.0, 0.0)
-    _pointCloudRenderArgs = {'mode': 'sphere', 'scale_factor': 1.0, 'color': (0, 1, 0)}
+    _pointCloudRenderArgs = {'scale_factor': 1.0, 'color': (0, 1, 0)}
+    _pointMode = 'point'  # default point cloud mode, 'point' or a glyph mode
+    _pointBudget = 20000  # default max number of drawn points of the segmented point cloud
     _modelInitRenderArgs = {'color': (1, 0, 0)}
     _modelFinalRenderArgs = {'color': (1, 1, 0)}
     # _landmarkRenderArgs = {'mode':'sphere', 'scale_factor':5.0, 'color':(0,1,0)}
     _imageRenderArgs = {'vmax': 2000, 'vmin': -200}
     _GFD = [8, 8]
+    _progressFPS = 5.0  # default max redraw rate of the segmented model during segmentation
+    _proxyMaxMB = 64.0  # default max size of the displayed proxy of large scans
 
     def __init__(self, step, parent=None):
         '''
@@ -80,6 +384,12 @@ class MayaviASMSegmentationViewerWidget(QDialog):
 
         self._worker = _ExecThread(self._step._segment)
         self._worker.update.connect(self._segUpdate)
+        self._worker.progress.connect(self._segProgress)
+        self._worker.error.connect(self._segError)
+        self._lastProgressDraw = 0.0
+
+        self._sweepPanel = SweepPanel(self._step, self)
+        self._ui.toolBox.addItem(self._sweepPanel, 'Parameter Sweep')
 
         self._initViewerObjects()
         self._setupGui()
@@ -99,7 +409,10 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         self._ui.screenshotSaveButton.clicked.connect(self._saveScreenShot)
 
         self._ui.segButton.clicked.connect(self._segButtonClicked)
+        self._ui.stopButton.clicked.connect(self._stopButtonClicked)
         self._ui.resetButton.clicked.connect(self._reset)
+        self._sweepPanel.resultSelected.connect(self._loadSweepResult)
+        self._sweepPanel.running.connect(self._sweepRunning)
         self._ui.abortButton.clicked.connect(self._abort)
         self._ui.acceptButton.clicked.connect(self._accept)
 
@@ -129,39 +442,48 @@ class MayaviASMSegmentationViewerWidget(QDialog):
     def _initViewerObjects(self):
         self._objects = MayaviViewerObjectsContainer()
 
-        I = np.array(self._step._scan.I)
-        if self._step._segParams['image']['flip_x']:
-            I = I[::-1, :, :]
-        if self._step._segParams['image']['flip_y']:
-            I = I[:, ::-1, :]
-        if self._step._segParams['image']['flip_z']:
-            I = I[:, :, ::-1]
+        # large scans are displayed as a subsampled proxy, with the viewed
+        # slice loaded at full resolution. Flips are views, so the scan
+        # image is never copied whole.
+        viewerConfigs = self._step._segParams.get('viewer', {})
+        maxMB = viewerConfigs.get('proxy_max_mb', self._proxyMaxMB)
+        flips = [self._step._segParams['image'][k] for k in ('flip_x', 'flip_y', 'flip_z')]
+        I = self._step._scan.I
+        for axis, flip in enumerate(flips):
+            if flip:
+                I = np.flip(I, axis)
+        proxy, stride = volumes.proxyVolume(I, maxMB)
         self._objects.addObject('image',
-                                MayaviViewerImagePlane('image',
-                                                       I,
-                                                       render_args=self._imageRenderArgs))
+                                _LODImagePlane('image',
+                                               proxy,
+                                               stride,
+                                               I,
+                                               render_args=self._imageRenderArgs))
+        # the step's model is modified by segmentations, the displayed models
+        # only use its mesh, which the geometry evaluates once
+        self._geometry = _ImageSpaceGeometry(self._step._scan, self._step._model, self._GFD,
+                                             self._step._segParams['image']['neg_spacing'],
+                                             self._step._segParams['image']['z_shift'])
         self._objects.addObject('Initial Model',
-                                MayaviViewerFieldworkModel('Initial Model',
-                                                           fst.makeImageSpaceGF(self._step._scan,
-                                                                                self._step._modelInit,
-                                                                                self._step._segParams['image'][
-                                                                                    'neg_spacing'],
-                                                                                self._step._segParams['image'][
-                                                                                    'z_shift']
-                                                                                ),
-                                                           self._GFD,
-                                                           render_args=self._modelInitRenderArgs))
+                                _ImageSpaceFieldworkModel('Initial Model',
+                                                          self._step._model,
+                                                          self._geometry,
+                                                          self._step._paramsInit,
+                                                          self._GFD,
+                                                          render_args=self._modelInitRenderArgs))
         self._objects.addObject('Segmented Model',
-                                MayaviViewerFieldworkModel('Segmented Model',
-                                                           fst.makeImageSpaceGF(self._step._scan,
-                                                                                self._step._modelFinal,
-                                                                                self._step._segParams['image'][
-                                                                                    'neg_spacing'],
-                                                                                self._step._segParams['image'][
-                                                                                    'z_shift']
-                                                                                ),
-                                                           self._GFD,
-                                                           render_args=self._modelFinalRenderArgs))
+                                _ImageSpaceFieldworkModel('Segmented Model',
+                                                          self._step._model,
+                                                          self._geometry,
+                                                          self._step._paramsFinal,
+                                                          self._GFD,
+                                                          render_args=self._modelFinalRenderArgs))
+        # one point cloud object, whose points are replaced by each segmentation
+        self._objects.addObject('Segmented Points',
+                                _PointCloud('Segmented Points',
+                                            mode=viewerConfigs.get('point_mode', self._pointMode),
+                                            budget=viewerConfigs.get('point_budget', self._pointBudget),
+                                            render_args=self._pointCloudRenderArgs))
         # self._objects.addObject('Segmented Points',
         #                         MayaviViewerDataPoints('Segmented Points',
         #                                                    self._pointCloudFinal,
@@ -280,10 +602,9 @@ class MayaviASMSegmentationViewerWidget(QDialog):
 
     def _segButtonClicked(self):
         self._saveConfig()
-        try:
-            self._objects.removeObject('Segmented Points')
-        except ValueError:
-            pass
+        segPointsTableItem = self._ui.tableWidget.item(3, self.objectTableHeaderColumns['visible'])
+        segPointsTableItem.setCheckState(Qt.Unchecked)
+        self._lastProgressDraw = 0.0
         self._worker.start()
         print('g')
         self._segLockUI()
@@ -292,20 +613,40 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         # output = self._step._segment()
         # self._segUpdate(output)
 
+    def _segProgress(self, progress):
+        # called through a queued signal after each ASM iteration
+        self._ui.RMSELineEdit.setText('{:6.4f}'.format(progress['segRMS']))
+        self._ui.pFracLineEdit.setText('{:5.2f}'.format(progress['segPFrac'] * 100.0))
+        self._ui.iterationLineEdit.setText('{}'.format(progress['iteration']))
+
+        # redraw the segmented model no faster than the configured frame rate
+        fps = self._step._segParams.get('viewer', {}).get('progress_fps', self._progressFPS)
+        now = time.time()
+        if fps <= 0 or (now - self._lastProgressDraw) < (1.0 / fps):
+            return
+        self._lastProgressDraw = now
+
+        segObj = self._objects.getObject('Segmented Model')
+        segObj.updateGeometry(progress['fieldParameters'], self._scene)
+        segTableItem = self._ui.tableWidget.item(2, self.objectTableHeaderColumns['visible'])
+        segTableItem.setCheckState(Qt.Checked)
+
+    def _stopButtonClicked(self):
+        # segmentation stops after its current iteration, then _segUpdate is called as usual
+        self._ui.stopButton.setEnabled(False)
+        self._step.cancelSegmentation()
+
     def _segUpdate(self, output):
         # update error fields
         rmse = self._step._asmOutput['segRMS']
         pFrac = self._step._asmOutput['segPFrac']
         self._ui.RMSELineEdit.setText('{:6.4f}'.format(rmse))
         self._ui.pFracLineEdit.setText('{:5.2f}'.format(pFrac * 100.0))
+        self._ui.iterationLineEdit.setText('{}'.format(len(self._step._asmOutput['segHistory']['passFrac'])))
 
         # update fitted GF
         segObj = self._objects.getObject('Segmented Model')
-        modelImage = fst.makeImageSpaceGF(self._step._scan,
-                                          self._step._model,
-                                          self._step._segParams['image']['neg_spacing'],
-                                          self._step._segParams['image']['z_shift'])
-        segObj.updateGeometry(modelImage.get_field_parameters(), self._scene)
+        segObj.updateGeometry(self._step._paramsFinal, self._scene)
         segTableItem = self._ui.tableWidget.item(2, self.objectTableHeaderColumns['visible'])
         segTableItem.setCheckState(Qt.Checked)
 
@@ -315,17 +656,9 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         # segTableItem = self._ui.tableWidget.item(2, self.objectTableHeaderColumns['visible'])
         # segTableItem.setCheckState(Qt.Checked)
 
-        self._objects.addObject('Segmented Points',
-                                MayaviViewerDataPoints('Segmented Points',
-                                                       self._step._scan.coord2Index(self._step._pointCloudFinal,
-                                                                                    self._step._segParams['image'][
-                                                                                        'z_shift'],
-                                                                                    self._step._segParams['image'][
-                                                                                        'neg_spacing'],
-                                                                                    False),
-                                                       render_args=self._pointCloudRenderArgs,
-                                                       )
-                                )
+        segPointsObj = self._objects.getObject('Segmented Points')
+        segPointsObj.setPoints(self._geometry.toImage(self._step._pointCloudFinal), self._matchQuality(),
+                               self._scene)
         # segPointsObj = self._objects.getObject('Segmented Points')
         # segPointsObj.draw(self._scene)
         segPointsTableItem = self._ui.tableWidget.item(3, self.objectTableHeaderColumns['visible'])
@@ -335,6 +668,44 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         # unlock reg ui
         self._segUnlockUI()
 
+    def _segError(self, error):
+        # called through a queued signal if the segmentation raised
+        self._segUnlockUI()
+        QMessageBox.critical(self, 'Segmentation failed', '{!r}'.format(error))
+
+    def _matchQuality(self):
+        '''
+        Texture match Mahalanobis distance of each segmented point, None if
+        points are not coloured by match quality.
+        '''
+        if not self._step._segParams.get('viewer', {}).get('colour_by_match', True):
+            return None
+        m = self._step._asmOutput.get('segProfileMatchM')
+        if m is None or len(m) != len(self._step._pointCloudFinal):
+            return None
+        return np.asarray(m, dtype=float)
+
+    def _sweepRunning(self, running):
+        # a segmentation and a sweep share the step's cancel token, so only one runs at a time
+        self._ui.segButton.setEnabled(not running)
+
+    def _loadSweepResult(self, result):
+        '''
+        Make a parameter sweep configuration's result the step's result, and
+        its parameters the step's parameters.
+        '''
+        for key, value in result['overrides'].items():
+            if key == sweep.PPC_KEY:
+                self._step._segParams['data_files'][key] = value
+            else:
+                self._step._segParams['ASM'][key] = value
+        self._initialiseSettings()
+
+        self._step._setResult(result['fieldParameters'], result['dataASM'], result['meshParamsASM'],
+                              result['asmOutput'])
+        self._segUpdate(None)
+        self._sweepRunning(self._sweepPanel.isRunning())
+
     def _segLockUI(self):
         self._ui.pcsToFitSpinBox.setEnabled(False)
         self._ui.mWeightDblSpinBox.setEnabled(False)
@@ -351,6 +722,7 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         self._ui.resetButton.setEnabled(False)
         self._ui.acceptButton.setEnabled(False)
         self._ui.abortButton.setEnabled(False)
+        self._ui.stopButton.setEnabled(True)
 
     def _segUnlockUI(self):
         self._ui.pcsToFitSpinBox.setEnabled(True)
@@ -368,6 +740,7 @@ class MayaviASMSegmentationViewerWidget(QDialog):
         self._ui.resetButton.setEnabled(True)
         self._ui.acceptButton.setEnabled(True)
         self._ui.abortButton.setEnabled(True)
+        self._ui.stopButton.setEnabled(False)
 
     def _segCallback(self, output):
         GFParamsFitted = output[1]
@@ -379,21 +752,16 @@ class MayaviASMSegmentationViewerWidget(QDialog):
     def _reset(self):
         # self._resetCallback()
         segObj = self._objects.getObject('Segmented Model')
-        modelImage = fst.makeImageSpaceGF(self._step._scan,
-                                          self._step._modelInit,
-                                          self._step._segParams['image']['neg_spacing'],
-                                          self._step._segParams['image']['z_shift'])
-        segObj.updateGeometry(modelImage.field_parameters.copy(), self._scene)
+        segObj.updateGeometry(self._step._paramsInit, self._scene)
         segTableItem = self._ui.tableWidget.item(2, self.objectTableHeaderColumns['visible'])
         segTableItem.setCheckState(Qt.Unchecked)
         segPointsTableItem = self._ui.tableWidget.item(3, self.objectTableHeaderColumns['visible'])
         segPointsTableItem.setCheckState(Qt.Unchecked)
 
-        self._objects.removeObject('Segmented Points')
-
         # clear error fields
         self._ui.RMSELineEdit.clear()
         self._ui.pFracLineEdit.clear()
+        self._ui.iterationLineEdit.clear()
 
     def _accept(self):
         self._close()
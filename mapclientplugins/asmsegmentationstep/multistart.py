@@ -0,0 +1,207 @@
+"""
+Multi-start initialisation of ASM segmentation.
+
+ASM only searches a short distance along each landmark normal, so a badly
+placed initial model converges to the wrong boundary. With [multistart]
+enabled, segment() first runs short passes (of [multistart] max_it
+iterations) from the initial model and from randomly perturbed copies of
+it, translated and rotated about its centroid within the configured
+bounds and optionally deformed along the leading shape modes. The passes
+run across a pool of worker processes, and the full segmentation starts
+from the result of the best pass, by segPFrac or segRMS.
+
+Rigid perturbations are applied to the model's field parameters, moving
+nodal positions and rotating any nodal derivatives. Shape mode
+perturbations need a shape model of the model's nodal positions.
+"""
+import copy
+import multiprocessing
+import time
+
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import runner
+
+DEFAULT_STARTS = 8
+DEFAULT_MAX_IT = 3
+SELECT_KEYS = ('segPFrac', 'segRMS')
+
+_worker = {}
+
+
+class MultiStartError(Exception):
+    pass
+
+
+def rotationMatrix(angles):
+    """
+    Rotation matrix of rotations by angles (radians) about the x, then y,
+    then z axis.
+    """
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    Rx = np.array([[1.0, 0.0, 0.0], [0.0, cx, -sx], [0.0, sx, cx]])
+    Ry = np.array([[cy, 0.0, sy], [0.0, 1.0, 0.0], [-sy, 0.0, cy]])
+    Rz = np.array([[cz, -sz, 0.0], [sz, cz, 0.0], [0.0, 0.0, 1.0]])
+    return Rz.dot(Ry).dot(Rx)
+
+
+def perturbations(nStarts, translation, rotation, shapeModes=0, shapeSD=0.0, seed=0):
+    """
+    List of nStarts perturbations, the first of which is no perturbation,
+    each a dict of translation (3 values within +-translation), rotation
+    (3 angles in degrees within +-rotation) and shapeSD (shapeModes values
+    within +-shapeSD standard deviations).
+    """
+    if nStarts < 1:
+        raise MultiStartError('multi-start needs at least 1 start, not {}'.format(nStarts))
+    rng = np.random.default_rng(seed)
+    starts = [{'translation': [0.0] * 3, 'rotation': [0.0] * 3, 'shapeSD': [0.0] * shapeModes}]
+    for _ in range(nStarts - 1):
+        starts.append({
+            'translation': rng.uniform(-translation, translation, 3).tolist(),
+            'rotation': rng.uniform(-rotation, rotation, 3).tolist(),
+            'shapeSD': rng.uniform(-shapeSD, shapeSD, shapeModes).tolist(),
+        })
+    return starts
+
+
+def perturbedParameters(fieldParameters, shapepcs, perturbation):
+    """
+    Field parameters (3, n nodes, n derivatives) perturbed along the
+    leading shape modes of shapepcs, then rotated about the centroid of
+    the nodal positions and translated.
+    """
+    params = np.array(fieldParameters, dtype=float)
+    shapeSD = np.asarray(perturbation.get('shapeSD', []), dtype=float)
+    if len(shapeSD) and np.any(shapeSD != 0.0):
+        modes = np.arange(len(shapeSD))
+        delta = shapepcs.reconstruct(shapepcs.getWeightsBySD(modes, shapeSD), modes) - shapepcs.getMean()
+        if delta.size != params[:, :, 0].size:
+            raise MultiStartError('shape model of {} values does not match a model of {} nodes'.format(
+                delta.size, params.shape[1]))
+        params[:, :, 0] += delta.reshape((3, -1))
+
+    R = rotationMatrix(np.radians(perturbation.get('rotation', [0.0] * 3)))
+    centroid = params[:, :, 0].mean(1)[:, np.newaxis]
+    positions = R.dot(params[:, :, 0] - centroid) + centroid + np.asarray(perturbation['translation'])[:, np.newaxis]
+    params[:, :, 1:] = np.einsum('ij,jnk->ink', R, params[:, :, 1:])
+    params[:, :, 0] = positions
+    return params
+
+
+def shortConfig(config, maxIt):
+    """
+    Config of the short pass of each start: [ASM] max_it set to maxIt, the
+    pyramid and multi-start disabled and nothing printed or profiled.
+    """
+    config = copy.deepcopy(config.dict() if hasattr(config, 'dict') else dict(config))
+    config['ASM']['max_it'] = maxIt
+    config['general']['verbose'] = False
+    config.setdefault('pyramid', {})['enabled'] = False
+    config.setdefault('multistart', {})['enabled'] = False
+    config.setdefault('profiling', {})['profiler'] = ''
+    return config
+
+
+def _initWorker(segmentFunc, scan, model, shapepcs, config, cancelEvent=None):
+    _worker['segment'] = segmentFunc
+    _worker['scan'] = scan
+    _worker['model'] = model
+    _worker['shapepcs'] = shapepcs
+    _worker['config'] = config
+    _worker['cancelToken'] = asmseg.CancelToken(cancelEvent)
+
+
+def _runStart(task):
+    index, perturbation, fieldParameters = task
+    cancelToken = _worker['cancelToken']
+    if cancelToken.isCancelled():
+        return None
+    result = {'index': index, 'perturbation': perturbation}
+    t0 = time.time()
+    try:
+        model = _worker['model']
+        model.set_field_parameters(fieldParameters)
+        model, dataASM, meshParamsASM, asmOutput = _worker['segment'](
+            _worker['scan'], model, _worker['shapepcs'], _worker['config'], cancelToken=cancelToken,
+        )
+    except Exception as e:
+        result.update(status='failed', error=repr(e), wallTime=time.time() - t0)
+        return result
+
+    result.update(
+        status='done',
+        wallTime=time.time() - t0,
+        cancelled=bool(asmOutput.get('cancelled', False)),
+        segRMS=float(asmOutput['segRMS']),
+        segPFrac=float(asmOutput['segPFrac']),
+        iterations=asmseg.iterations(asmOutput),
+        fieldParameters=model.get_field_parameters().copy(),
+    )
+    return result
+
+
+def bestStart(results, key='segPFrac'):
+    """
+    The finished start with the highest segPFrac, ties going to the lower
+    segRMS, or the lowest segRMS if key is 'segRMS'. None if no start
+    finished.
+    """
+    if key not in SELECT_KEYS:
+        raise MultiStartError('unknown multi-start selection {}, expected one of {}'.format(
+            key, ', '.join(SELECT_KEYS)))
+    done = [r for r in results if r['status'] == 'done' and np.isfinite(r['segRMS'])]
+    if not done:
+        return None
+    if key == 'segPFrac':
+        return min(done, key=lambda r: (-r['segPFrac'], r['segRMS']))
+    return min(done, key=lambda r: r['segRMS'])
+
+
+def runStarts(scan, model, shapepcs, config, segmentFunc, cancelToken=None):
+    """
+    Short passes of segmentFunc(scan, model, shapepcs, config,
+    cancelToken=...), e.g. asmseg.segment, from the initial model and from perturbed copies of
+    it, as set in config['multistart']. Passes run across [multistart]
+    processes worker processes (one per CPU if 0), or in this process if
+    processes is 1 or this is already a worker process. model is not
+    modified.
+
+    returns a list of dicts, in start order, of index, perturbation,
+    status ('done' or 'failed'), wallTime and either error or cancelled,
+    segRMS, segPFrac, iterations and fieldParameters (of the short pass's
+    result). Cancelling cancelToken stops the running passes, which return
+    their best iteration so far, and starts not yet run are missing.
+    """
+    msConfig = config.get('multistart', {})
+    starts = perturbations(
+        msConfig.get('starts', DEFAULT_STARTS),
+        msConfig.get('translation', 0.0),
+        msConfig.get('rotation', 0.0),
+        shapeModes=msConfig.get('shape_modes', 0),
+        shapeSD=msConfig.get('shape_sd', 0.0),
+        seed=msConfig.get('seed', 0),
+    )
+    initParams = model.get_field_parameters()
+    tasks = [(i, p, perturbedParameters(initParams, shapepcs, p)) for i, p in enumerate(starts)]
+    config = shortConfig(config, msConfig.get('max_it', DEFAULT_MAX_IT))
+
+    processes = msConfig.get('processes', 0) or multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+    if processes == 1 or multiprocessing.current_process().daemon:
+        # daemonic pool workers cannot start processes of their own
+        _initWorker(segmentFunc, scan, copy.deepcopy(model), shapepcs, config)
+        if cancelToken is not None:
+            _worker['cancelToken'] = cancelToken
+        results = [_runStart(task) for task in tasks]
+    else:
+        # workers check the event between starts and after every iteration
+        cancelEvent = multiprocessing.Event()
+        pool = multiprocessing.Pool(processes, initializer=_initWorker,
+                                    initargs=(segmentFunc, scan, model, shapepcs, config, cancelEvent))
+        asyncResult = pool.map_async(_runStart, tasks, chunksize=1)
+        results = runner.runInPool(pool, asyncResult, cancelEvent=cancelEvent, cancelToken=cancelToken)
+
+    return [r for r in results if r is not None]
@@ -0,0 +1,83 @@
+"""
+Voxel-grid decimation of point clouds for display.
+
+Dense mesh_d settings give segmented point clouds of tens of thousands of
+points, which are slow to draw as glyphs. decimate bins the points into
+cubic cells and replaces the points of each occupied cell by their mean,
+with the cell size chosen so that no more than a budget of cells are
+occupied.
+"""
+import numpy as np
+
+_SIZE_ITERATIONS = 12   # bisection steps of the log cell size, to within 0.5%
+
+
+class PointCloudError(Exception):
+    pass
+
+
+def cellIndices(points, size):
+    """
+    Index of the cubic cell of side size that each point falls in, and the
+    number of occupied cells. Cells are numbered in order of their
+    position along the first, then second, then third axis.
+    """
+    cells = np.floor((points - points.min(0)) / size).astype(np.int64)
+    shape = cells.max(0) + 1
+    keys = (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    return inverse, int(inverse.max()) + 1
+
+
+def cellSize(points, budget):
+    """
+    Smallest cell size, to within 0.5%, at which no more than
+    budget cells are occupied by points.
+    """
+    extent = float((points.max(0) - points.min(0)).max())
+    if extent == 0.0:
+        return 1.0
+    # every point in its own cell at the smallest size, one cell at the largest
+    lo = extent * 1e-6
+    hi = extent * 1.01
+    for _ in range(_SIZE_ITERATIONS):
+        size = np.sqrt(lo * hi)
+        if cellIndices(points, size)[1] > budget:
+            lo = size
+        else:
+            hi = size
+    return hi
+
+
+def decimate(points, budget, values=None):
+    """
+    Decimate an (n, 3) array of points to at most budget points, one per
+    occupied cell of a voxel grid, at the mean of the cell's points.
+
+    values: optional array of n values per point, e.g. match distances,
+        averaged over each cell the same way
+
+    returns:
+    points: (m, 3) array of cell means, the input points if there are no
+        more than budget of them or budget is 0
+    values: (m,) array of the mean values of each cell, None if values is
+        None
+    """
+    points = np.asarray(points, dtype=float)
+    if values is not None:
+        values = np.asarray(values, dtype=float)
+        if values.shape != (len(points),):
+            raise PointCloudError('{} values for {} points'.format(values.shape, len(points)))
+    if budget <= 0 or len(points) <= budget:
+        return points, values
+    if budget < 1:
+        raise PointCloudError('point budget must be at least 1')
+
+    inverse, nCells = cellIndices(points, cellSize(points, budget))
+    counts = np.bincount(inverse, minlength=nCells).astype(float)
+    means = np.array([np.bincount(inverse, weights=points[:, i], minlength=nCells) for i in range(3)]).T
+    means /= counts[:, np.newaxis]
+    if values is not None:
+        values = np.bincount(inverse, weights=values, minlength=nCells) / counts
+    return means, values
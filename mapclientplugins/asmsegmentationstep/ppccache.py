@@ -0,0 +1,131 @@
+"""
+Process-wide cache of loaded profile principal component (PPC, texture
+model) files.
+
+Entries are keyed by absolute path, modification time and size, so an
+edited PPC file is reloaded. The least recently used entries are evicted
+once the total size of the cached PPC arrays exceeds the memory budget.
+"""
+import collections
+import os
+import pickle
+import threading
+
+from gias3.learning import PCA
+
+DEFAULT_MAX_MB = 512.0
+
+_PC_ARRAY_ATTRS = ('mean', 'weights', 'modes', 'SD', 'projectedWeights', 'sizes')
+
+
+def _fileKey(filename):
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _loadPCList(filename):
+    # PCList.load opens the pickle in text mode, which fails on Python 3.
+    # Files pickled by Python 2 need latin1 to unpickle numpy arrays.
+    with open(filename, 'rb') as f:
+        try:
+            L = pickle.load(f)
+        except UnicodeDecodeError:
+            f.seek(0)
+            L = pickle.load(f, encoding='latin1')
+    return PCA.PCList(L)
+
+
+def _ppcNBytes(ppc):
+    nBytes = 0
+    for pc in ppc.L:
+        for attr in _PC_ARRAY_ATTRS:
+            nBytes += getattr(getattr(pc, attr, None), 'nbytes', 0)
+    return nBytes
+
+
+class PPCCache(object):
+    """
+    LRU cache of PCA.PCList instances loaded from PPC files.
+    """
+
+    def __init__(self, maxMB=DEFAULT_MAX_MB):
+        self.maxBytes = int(maxMB * 2 ** 20)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key: (ppc, nBytes)
+        self._nBytes = 0
+        self._lock = threading.Lock()
+
+    def setMaxMB(self, maxMB):
+        with self._lock:
+            self.maxBytes = int(maxMB * 2 ** 20)
+            self._evict()
+
+    def get(self, filename):
+        """
+        Return the PCList loaded from filename, loading it on a miss, and
+        whether it was a cache hit.
+        """
+        key = _fileKey(filename)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0], True
+
+        # load outside the lock, files can take a while to parse
+        ppc = _loadPCList(key[0])
+        nBytes = _ppcNBytes(ppc)
+
+        with self._lock:
+            self.misses += 1
+            # drop stale versions of the same file
+            for staleKey in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self._remove(staleKey)
+            if key not in self._entries:
+                self._entries[key] = (ppc, nBytes)
+                self._nBytes += nBytes
+            self._entries.move_to_end(key)
+            self._evict(keep=key)
+
+        return ppc, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nBytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'nBytes': self._nBytes,
+                'maxBytes': self.maxBytes,
+            }
+
+    def _remove(self, key):
+        self._nBytes -= self._entries.pop(key)[1]
+
+    def _evict(self, keep=None):
+        # never evict the entry just requested, even if it alone exceeds the budget
+        while self._nBytes > self.maxBytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+
+cache = PPCCache()
+
+
+def loadPPC(filename):
+    """
+    Load a PPC file through the process-wide cache.
+    """
+    return cache.get(filename)[0]
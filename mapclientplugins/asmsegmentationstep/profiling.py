@@ -0,0 +1,156 @@
+"""
+Per-stage timing, memory and profiler instrumentation of segmentation runs.
+"""
+import contextlib
+import itertools
+import os
+import time
+import tracemalloc
+
+MB = float(2 ** 20)
+
+_profileCount = itertools.count()
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class StageTimer(object):
+    """
+    Records the wall time, and optionally the peak traced memory, of named
+    stages. Stages can be nested, e.g. sampling inside a level.
+
+    Peak memory uses tracemalloc, which slows down allocation heavy code,
+    so it is only tracked if trackMemory is True.
+    """
+
+    def __init__(self, trackMemory=False):
+        self.trackMemory = trackMemory
+        self.records = []
+        self._peakStack = []
+        self._startedTracing = False
+
+    def start(self):
+        if self.trackMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+
+    def stop(self):
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name, **tags):
+        record = dict(tags, stage=name)
+        tracking = self.trackMemory and tracemalloc.is_tracing()
+        if tracking:
+            # fold the enclosing stage's peak so far into its running peak
+            # before resetting the peak for this stage
+            if self._peakStack:
+                self._peakStack[-1] = max(self._peakStack[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peakStack.append(0)
+
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - t0
+            if tracking:
+                peak = max(self._peakStack.pop(), tracemalloc.get_traced_memory()[1])
+                record['peakMB'] = peak / MB
+                if self._peakStack:
+                    self._peakStack[-1] = max(self._peakStack[-1], peak)
+            self.records.append(record)
+
+    def summary(self):
+        """
+        Count, total, mean and max time, and max peak memory, per stage name.
+        """
+        summary = {}
+        for record in self.records:
+            s = summary.setdefault(record['stage'], {'count': 0, 'total': 0.0, 'max': 0.0})
+            s['count'] += 1
+            s['total'] += record['time']
+            s['max'] = max(s['max'], record['time'])
+            if 'peakMB' in record:
+                s['peakMB'] = max(s.get('peakMB', 0.0), record['peakMB'])
+        for s in summary.values():
+            s['mean'] = s['total'] / s['count']
+        return summary
+
+    def output(self):
+        return {'stages': self.records, 'summary': self.summary()}
+
+
+class _CProfileRunner(object):
+    suffix = '.prof'
+
+    def __init__(self):
+        import cProfile
+        self._profiler = cProfile.Profile()
+
+    def start(self):
+        self._profiler.enable()
+
+    def stop(self, filename):
+        self._profiler.disable()
+        self._profiler.dump_stats(filename)
+
+
+class _PyinstrumentRunner(object):
+    suffix = '.html'
+
+    def __init__(self):
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ProfilingError('profiler pyinstrument requested but pyinstrument is not installed')
+        self._profiler = pyinstrument.Profiler()
+
+    def start(self):
+        self._profiler.start()
+
+    def stop(self, filename):
+        self._profiler.stop()
+        with open(filename, 'w') as f:
+            f.write(self._profiler.output_html())
+
+
+PROFILERS = {
+    'cProfile': _CProfileRunner,
+    'pyinstrument': _PyinstrumentRunner,
+}
+
+
+@contextlib.contextmanager
+def profileRun(profiler, profileDir, name='asmseg'):
+    """
+    Profile the enclosed code with profiler ('cProfile' or 'pyinstrument')
+    and dump the profile to a new file in profileDir. Yields a dict whose
+    'filename' is set once the profile is written. Does nothing if profiler
+    is empty.
+    """
+    output = {'filename': None}
+    if not profiler:
+        yield output
+        return
+
+    if profiler not in PROFILERS:
+        raise ProfilingError('unknown profiler {}, must be one of {}'.format(profiler, sorted(PROFILERS)))
+    runner = PROFILERS[profiler]()
+    if profileDir and not os.path.isdir(profileDir):
+        os.makedirs(profileDir)
+
+    runner.start()
+    try:
+        yield output
+    finally:
+        filename = os.path.join(
+            profileDir, '{}_{}_{}-{}{}'.format(name, time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                                               next(_profileCount), runner.suffix)
+        )
+        runner.stop(filename)
+        output['filename'] = filename
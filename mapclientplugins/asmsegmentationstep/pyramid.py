@@ -0,0 +1,108 @@
+"""
+Coarse-to-fine (image pyramid) support for ASM segmentation.
+
+Coarse levels are configured as sub-sections of the [pyramid] section of
+the params file, each giving an integer image downsample factor and any
+[ASM] keys to override at that level.
+"""
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep.scanviews import ScanView
+
+# changing any of these changes the number or length of the texture profiles
+PPC_DEPENDENT_KEYS = ('mesh_d', 'n_d', 'n_lim')
+
+
+class PyramidError(Exception):
+    pass
+
+
+def blockMean(I, factor):
+    """
+    Downsample a 3D array by averaging factor**3 blocks of voxels. Trailing
+    voxels that do not fill a block are dropped. Works one output slab at a
+    time so I is never copied whole.
+    """
+    f = int(factor)
+    shape = np.array(I.shape) // f
+    if np.any(shape == 0):
+        raise PyramidError('downsample factor {} too large for image of shape {}'.format(f, I.shape))
+
+    out = np.empty(shape, dtype=np.float32)
+    for k in range(shape[0]):
+        block = np.asarray(I[k * f:(k + 1) * f, :shape[1] * f, :shape[2] * f], dtype=np.float32)
+        out[k] = block.reshape(f, shape[1], f, shape[2], f).mean(axis=(0, 2, 4))
+    return out
+
+
+class DownsampledScan(ScanView):
+    """
+    View of a scan (or scan view) with a block-averaged image. Voxel k of the
+    downsampled image covers voxels k*factor to (k+1)*factor-1 of the wrapped
+    scan's image, so its centre is at index k*factor + (factor-1)/2.
+
+    The mask of masked scans is not downsampled. If store, a
+    featurestore.FeatureStore, is given the downsampled image is read from
+    it, or computed and stored; stored says which.
+    """
+
+    def __init__(self, scan, factor, store=None):
+        super(DownsampledScan, self).__init__(scan)
+        self.factor = int(factor)
+        if store is None:
+            self.I = blockMean(scan.I, self.factor)
+            self.stored = False
+        else:
+            self.I, self.stored = store.volume(scan.I, 'blockMean', {'factor': self.factor},
+                                               lambda: blockMean(scan.I, self.factor))
+        self.isMasked = False
+        self._offset = 0.5 * (self.factor - 1)
+
+    def coord2Index(self, coordinates, z_shift=False, neg_spacing=False, round_int=True):
+        ind = self.scan.coord2Index(coordinates, z_shift=z_shift, neg_spacing=neg_spacing, round_int=False)
+        ind = (ind - self._offset) / self.factor
+        if round_int:
+            ind = np.around(ind).astype(int)
+        return ind
+
+    def index2Coord(self, indices, neg_spacing=False, z_shift=False):
+        return self.scan.index2Coord(np.asarray(indices) * self.factor + self._offset,
+                                     neg_spacing=neg_spacing, z_shift=z_shift)
+
+    def checkIndexInBounds(self, ind):
+        return not (np.any(ind < 0) or np.any(ind > (np.array(self.I.shape) - 1)))
+
+    def checkIndexIsMasked(self, ind):
+        return False
+
+
+def pyramidLevels(config):
+    """
+    Return a list of (downsample factor, [ASM] config, ppc filename) for each
+    coarse level in config['pyramid'], in file order. Returns an empty list
+    if the pyramid is missing or not enabled.
+    """
+    pyramidConfig = config.get('pyramid')
+    if pyramidConfig is None or not pyramidConfig.get('enabled', False):
+        return []
+
+    levels = []
+    for name in pyramidConfig.sections:
+        levelConfig = dict(pyramidConfig[name])
+        factor = int(levelConfig.pop('downsample', 1))
+        if factor < 1:
+            raise PyramidError('pyramid level {}: downsample must be >= 1'.format(name))
+        ppcFilename = levelConfig.pop('ppc_filename', config['data_files']['ppc_filename'])
+
+        asmConfig = dict(config['ASM'])
+        for key, value in levelConfig.items():
+            if key not in asmConfig:
+                raise PyramidError('pyramid level {}: unknown [ASM] key {}'.format(name, key))
+            if key in PPC_DEPENDENT_KEYS and value != asmConfig[key] and 'ppc_filename' not in pyramidConfig[name]:
+                raise PyramidError(
+                    'pyramid level {}: changing {} needs a ppc_filename trained for this level'.format(name, key)
+                )
+            asmConfig[key] = value
+        levels.append((factor, asmConfig, ppcFilename))
+
+    return levels
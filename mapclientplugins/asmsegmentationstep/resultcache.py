@@ -0,0 +1,285 @@
+"""
+Persistent on-disk cache of segmentation results.
+
+Results are keyed by a hash of everything segment() depends on: the scan
+image, voxel spacing and origin, the initial model, the shape model, the
+contents of every texture model (PPC) file used and the segmentation
+parameters. Sections of the parameters that do not change the result
+(viewer, profiling, result_cache and feature_store settings, verbosity
+and the headless worker) are left out of the key.
+
+Large scans are hashed by a sample of evenly spaced slabs so a hit stays
+cheap, at the risk of missing an edit confined to the unsampled slabs.
+Scans up to [result_cache] hash_full_mb are hashed whole.
+
+Each result is pickled to its own file in the cache directory. Hits touch
+the file, and the least recently used files are deleted once the cache
+holds more than [result_cache] max_mb.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+MB = float(2 ** 20)
+
+CACHE_VERSION = 1   # bump when segment() changes its results or outputs
+
+DEFAULT_MAX_MB = 4096.0
+DEFAULT_HASH_FULL_MB = 256.0
+DEFAULT_HASH_SAMPLE_MB = 32.0
+
+# parameters that do not affect the segmentation result
+IGNORED_SECTIONS = ('viewer', 'profiling', 'result_cache', 'feature_store')
+IGNORED_KEYS = (('general', 'verbose'), ('general', 'worker'))
+
+_PC_ARRAY_ATTRS = ('mean', 'weights', 'modes', 'SD')
+
+_SUFFIX = '.asmresult'
+
+
+class ResultCacheError(Exception):
+    pass
+
+
+def _slabs(I, fullMB, sampleMB):
+    # indices of the slabs along the first axis of I that are hashed
+    nSlabs = I.shape[0] if I.ndim else 1
+    nBytes = float(I.size) * I.dtype.itemsize
+    if nBytes <= fullMB * MB or nSlabs < 2:
+        return np.arange(nSlabs)
+    slabBytes = nBytes / nSlabs
+    nSample = int(min(nSlabs, max(2, sampleMB * MB // slabBytes)))
+    return np.unique(np.linspace(0, nSlabs - 1, nSample).round().astype(int))
+
+
+def hashArray(h, I, fullMB=DEFAULT_HASH_FULL_MB, sampleMB=DEFAULT_HASH_SAMPLE_MB):
+    """
+    Update hash h with array I: its shape, dtype and contents, or a sample
+    of evenly spaced slabs along its first axis if it is larger than
+    fullMB. Only the hashed slabs are read, so memory-mapped arrays are
+    not loaded whole.
+    """
+    I = np.asarray(I)
+    h.update(repr((I.shape, I.dtype.str)).encode())
+    if I.ndim == 0:
+        h.update(I.tobytes())
+        return h
+    for k in _slabs(I, fullMB, sampleMB):
+        h.update(np.ascontiguousarray(I[k]).tobytes())
+    return h
+
+
+def _canonical(value):
+    # configobj sections to nested sorted tuples, for a stable repr
+    if hasattr(value, 'items'):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return _canonical(value.tolist())
+    return value
+
+
+def _paramsForKey(config):
+    # copy of config without the ignored settings and with every PPC file
+    # name replaced by a hash of its contents
+    def strip(section, path):
+        out = {}
+        for k, v in section.items():
+            if path + (k,) in IGNORED_KEYS or (not path and k in IGNORED_SECTIONS):
+                continue
+            if hasattr(v, 'items'):
+                out[k] = strip(v, path + (k,))
+            elif k == 'ppc_filename' and v:
+                out[k] = fileDigest(v)
+            else:
+                out[k] = v
+        return out
+    return strip(config, ())
+
+
+def fileDigest(filename):
+    """
+    Hash of the contents of a file.
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(int(MB)), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def resultKey(scan, model, shapepcs, config, fullMB=DEFAULT_HASH_FULL_MB, sampleMB=DEFAULT_HASH_SAMPLE_MB):
+    """
+    Cache key of segmenting scan from model with shape model shapepcs
+    using parameters config, as a hex string.
+    """
+    h = hashlib.sha1()
+    h.update(repr(('asmresult', CACHE_VERSION)).encode())
+
+    hashArray(h, scan.I, fullMB, sampleMB)
+    for attr in ('voxelSpacing', 'voxelOrigin'):
+        hashArray(h, np.asarray(getattr(scan, attr, ()), dtype=float))
+
+    # the pickled model includes its mesh and basis as well as its parameters
+    h.update(pickle.dumps(model, protocol=2))
+
+    for attr in _PC_ARRAY_ATTRS:
+        value = getattr(shapepcs, attr, None)
+        if value is not None:
+            hashArray(h, value)
+
+    h.update(repr(_canonical(_paramsForKey(config))).encode())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Directory of pickled segment() results, evicted least recently used
+    first once their total size exceeds maxMB.
+    """
+
+    def __init__(self, directory, maxMB=DEFAULT_MAX_MB):
+        if not directory:
+            raise ResultCacheError('result cache directory not set')
+        self.directory = directory
+        self.maxBytes = int(maxMB * MB)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        """
+        The (model, dataASM, meshParamsASM, asmOutput) result stored under
+        key, or None on a miss. Unreadable entries are deleted and count as
+        misses.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            result = None
+        except Exception:
+            # truncated or from an incompatible version
+            self._delete(path)
+            result = None
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Store result under key, then evict old entries. The entry just
+        stored is never evicted, even if it alone exceeds the cache size.
+        """
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # atomic, so concurrent readers never see a partial entry
+            os.replace(tmpPath, self._path(key))
+        except Exception:
+            self._delete(tmpPath)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        (path, size, last used time) of every entry, least recently used
+        first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self, keep=None):
+        keepPath = self._path(keep) if keep is not None else None
+        entries = self.entries()
+        nBytes = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if nBytes <= self.maxBytes:
+                break
+            if path == keepPath:
+                continue
+            self._delete(path)
+            nBytes -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self._delete(path)
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'nBytes': sum(e[1] for e in entries),
+                'maxBytes': self.maxBytes,
+            }
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def segment(cache, scan, model, shapepcs, config, segmentFunc, **kwargs):
+    """
+    segmentFunc(scan, model, shapepcs, config, **kwargs), e.g.
+    asmseg.segment, through cache. On a hit the stored result is returned
+    without segmenting, with model given the stored result's field
+    parameters as segmentFunc would have left it. Cancelled segmentations
+    are not stored. asmOutput['resultCache'] records the key and whether
+    it was a hit.
+    """
+    cacheConfigs = config.get('result_cache', {})
+    key = resultKey(scan, model, shapepcs, config,
+                    fullMB=cacheConfigs.get('hash_full_mb', DEFAULT_HASH_FULL_MB),
+                    sampleMB=cacheConfigs.get('hash_sample_mb', DEFAULT_HASH_SAMPLE_MB))
+
+    result = cache.get(key)
+    if result is not None:
+        cachedModel, dataASM, meshParamsASM, asmOutput = result
+        model.set_field_parameters(cachedModel.get_field_parameters())
+        asmOutput['resultCache'] = {'key': key, 'hit': True}
+        return model, dataASM, meshParamsASM, asmOutput
+
+    result = segmentFunc(scan, model, shapepcs, config, **kwargs)
+    result[3]['resultCache'] = {'key': key, 'hit': False}
+    if not result[3].get('cancelled', False):
+        cache.put(key, result)
+    return result
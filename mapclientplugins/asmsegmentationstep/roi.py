@@ -0,0 +1,74 @@
+"""
+Cropping of scans to the region of interest around the initial model.
+
+Profile sampling only reads the image within the search distance of the
+model surface, so the scan is cropped to the bounding box of the initial
+model padded by the longest search distance of any ASM pass plus a
+margin for the model moving during segmentation.
+"""
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep.scanviews import CroppedScan
+
+MB = float(2 ** 20)
+
+
+def searchDistance(asmConfigs):
+    """
+    Largest distance from the model surface, in physical units, that a
+    pass with [ASM] config asmConfigs samples the image.
+    """
+    nLim = asmConfigs['n_lim']
+    nRes = (nLim[1] - nLim[0]) / float(asmConfigs['n_d'])
+    return max(abs(nLim[0]), abs(nLim[1])) + asmConfigs['n_pad'] * nRes
+
+
+def cropBounds(scan, points, padding, zShift=False, negSpacing=False):
+    """
+    Voxel index bounds (start, stop) of the bounding box of points padded
+    by padding (physical units), clipped to the image. Returns None if the
+    padded box does not overlap the image.
+    """
+    ind = scan.coord2Index(np.asarray(points), z_shift=zShift, neg_spacing=negSpacing, round_int=False)
+    pad = padding / np.abs(np.asarray(scan.voxelSpacing, dtype=float))
+    shape = np.array(scan.I.shape)
+    start = np.clip(np.floor(ind.min(0) - pad).astype(int), 0, shape)
+    stop = np.clip(np.ceil(ind.max(0) + pad).astype(int) + 1, 0, shape)
+    if np.any(stop <= start):
+        return None
+    return start, stop
+
+
+def cropToModel(scan, points, padding, copyMaxMB, zShift=False, negSpacing=False):
+    """
+    Crop scan to the padded bounding box of the model points. The cropped
+    image is copied into contiguous memory if it is at most copyMaxMB,
+    else it is a slice of the scan image, e.g. for memory-mapped scans.
+
+    returns:
+    cropScan: CroppedScan, or scan itself if the box does not overlap the
+        image
+    crop: dict of the crop start and stop indices into scan.I, which for
+        a scanviews.FlippedScan is the unflipped image array,
+        the cropped and full image shapes, the cropped fraction of the
+        image, the padding and whether the image was copied. None if the
+        scan was not cropped.
+    """
+    bounds = cropBounds(scan, points, padding, zShift, negSpacing)
+    if bounds is None:
+        return scan, None
+
+    start, stop = bounds
+    shape = stop - start
+    nBytes = float(np.prod(shape)) * scan.I.dtype.itemsize
+    copy = nBytes <= copyMaxMB * MB
+    crop = {
+        'start': start.tolist(),
+        'stop': stop.tolist(),
+        'shape': shape.tolist(),
+        'scanShape': list(scan.I.shape),
+        'fraction': float(np.prod(shape)) / float(np.prod(scan.I.shape)),
+        'padding': float(padding),
+        'copied': bool(copy),
+    }
+    return CroppedScan(scan, start, stop, copy=copy), crop
@@ -0,0 +1,126 @@
+"""
+Runs the step's segmentation in this process or in a worker process.
+
+A segmentation on a thread shares the interpreter with the MAP Client UI,
+so the UI stays responsive but slows down while numpy is not releasing
+the GIL. A worker process keeps the UI fully responsive, at the cost of
+starting the process and pickling the scan and models to it, which copies
+memory-mapped scans into the worker. Progress and cancellation are passed
+between the processes through a queue and an event.
+"""
+import multiprocessing
+import queue
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import resultcache
+
+WORKERS = ('thread', 'process')
+DEFAULT_WORKER = 'thread'
+
+POLL_INTERVAL = 0.1  # seconds between checks of worker processes for progress and cancellation
+
+_worker = {}
+
+
+class RunnerError(Exception):
+    pass
+
+
+def checkWorker(worker):
+    if worker not in WORKERS:
+        raise RunnerError('unknown worker {}, expected one of {}'.format(worker, ', '.join(WORKERS)))
+    return worker
+
+
+def runSegmentation(scan, model, shapepcs, config, cache=None, callback=None, cancelToken=None):
+    """
+    asmseg.segment, through cache if it is a resultcache.ResultCache. If
+    model and shapepcs are lists, their objects are segmented by
+    asmseg.segmentObjects, without the cache, and a list of outputs is
+    returned.
+    """
+    if isinstance(model, (list, tuple)):
+        objects = asmseg.objectsFromConfig(config, model, shapepcs)
+        return asmseg.segmentObjects(scan, objects, config, callback=callback, cancelToken=cancelToken)
+    if cache is None:
+        return asmseg.segment(scan, model, shapepcs, config, callback=callback, cancelToken=cancelToken)
+    # returns the stored result if nothing changed since it was segmented
+    return resultcache.segment(cache, scan, model, shapepcs, config, asmseg.segment,
+                               callback=callback, cancelToken=cancelToken)
+
+
+def _initWorker(progressQueue, cancelEvent):
+    _worker['progress'] = progressQueue
+    _worker['cancelled'] = cancelEvent
+
+
+def _segmentInWorker(scan, model, shapepcs, config, cacheDir, cacheMaxMB):
+    cache = resultcache.ResultCache(cacheDir, cacheMaxMB) if cacheDir else None
+    return runSegmentation(scan, model, shapepcs, config, cache,
+                           callback=_worker['progress'].put,
+                           cancelToken=asmseg.CancelToken(_worker['cancelled']))
+
+
+def segmentInProcess(scan, model, shapepcs, config, cacheDir='', cacheMaxMB=resultcache.DEFAULT_MAX_MB,
+                     callback=None, cancelToken=None):
+    """
+    runSegmentation in a worker process, with a result cache in cacheDir
+    if it is set. callback is called in this process with each progress
+    dict, and cancelling cancelToken cancels the worker's segmentation,
+    which then returns its best result so far. Errors in the worker are
+    raised here.
+
+    returns the output of runSegmentation, where the segmented models are
+    copies of model.
+    """
+    progressQueue = multiprocessing.Queue()
+    cancelEvent = multiprocessing.Event()
+    pool = multiprocessing.Pool(1, initializer=_initWorker, initargs=(progressQueue, cancelEvent))
+    asyncResult = pool.apply_async(_segmentInWorker, (scan, model, shapepcs, config, cacheDir, cacheMaxMB))
+    return runInPool(pool, asyncResult, progressQueue, cancelEvent, callback, cancelToken)
+
+
+def runInPool(pool, asyncResult, progressQueue=None, cancelEvent=None, callback=None, cancelToken=None):
+    """
+    Wait for asyncResult of work submitted to pool, passing each progress
+    dict the workers put on progressQueue to callback and setting
+    cancelEvent, which the workers check, once cancelToken is cancelled.
+    The pool is closed when the work is done, or terminated if waiting
+    failed. Errors in the workers are raised here.
+
+    returns asyncResult's result
+    """
+    finished = False
+    try:
+        while True:
+            if cancelEvent is not None and cancelToken is not None and cancelToken.isCancelled():
+                cancelEvent.set()
+            if progressQueue is None:
+                asyncResult.wait(POLL_INTERVAL)
+                if asyncResult.ready():
+                    break
+                continue
+            try:
+                progress = progressQueue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if asyncResult.ready():
+                    break
+                continue
+            if callback is not None:
+                callback(progress)
+        result = asyncResult.get()
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+    # progress sent just before the workers finished
+    while progressQueue is not None and callback is not None:
+        try:
+            callback(progressQueue.get_nowait())
+        except queue.Empty:
+            break
+    return result
@@ -0,0 +1,142 @@
+"""
+Batched sampling of image intensity profiles along landmark normals.
+
+ASMSegmentation._sampleImage builds the physical coordinates of every
+profile sample, converts them all to image indices, then interpolates.
+Since the physical to index mapping is affine, ProfileSampler instead
+converts only the landmarks and normals, builds the index coordinates of
+all samples of a chunk of landmarks in one array and interpolates the
+chunk in a single call. Chunks are sized to keep the coordinate arrays
+under a memory cap.
+"""
+import threading
+import weakref
+
+import numpy as np
+from scipy import ndimage
+
+MB = float(2 ** 20)
+
+DEFAULT_ORDER = 1
+DEFAULT_CHUNK_MB = 64.0
+
+# voxels of edge padding spline filtered images get, as ndimage.map_coordinates
+# pads for mode 'nearest', so samples near the image border are not distorted
+SPLINE_PAD = 12
+
+# spline filtered images, kept for as long as their image exists so the
+# samplers of every pass over an image share them
+_filtered = {}  # (id(image), order): (weakref to image, spline filtered image)
+_filteredLock = threading.Lock()
+
+
+class SamplingError(Exception):
+    pass
+
+
+def profileOffsets(nD, nLim, nPad):
+    """
+    Distances along the normal of the n_d + 2 * n_pad samples of each
+    profile, as sampled by ASMSegmentation._sampleImage.
+    """
+    nRes = (nLim[1] - nLim[0]) / nD
+    return np.linspace(int(nLim[0] - nPad * nRes), int(nLim[1] + nPad * nRes), int(nD + nPad * 2))
+
+
+class ProfileSampler(object):
+    """
+    Samples profiles of an image along straight lines, in image index
+    coordinates.
+
+    order: interpolation order. 0 is nearest voxel, 1 trilinear (as
+        ASMSegmentation), 2 to 5 spline interpolation of the image, which
+        is spline filtered once per image, edge padded as
+        ndimage.map_coordinates does so samples at the border match it.
+        The filtered image is a float64 copy of the whole (padded) image,
+        in memory while the image exists, even if the image is
+        memory-mapped, unless it is read from store.
+    chunkMB: memory cap of the sample coordinate arrays of each chunk.
+    store: optional featurestore.FeatureStore the spline filtered image
+        is read from, or stored in, so it is computed once per image
+        across runs and processes too.
+    """
+
+    def __init__(self, order=DEFAULT_ORDER, chunkMB=DEFAULT_CHUNK_MB, store=None):
+        if order not in range(6):
+            raise SamplingError('interpolation order must be 0 to 5, not {}'.format(order))
+        self.order = order
+        self.chunkMB = chunkMB
+        self.store = store
+
+    def chunkSize(self, nSamples):
+        """
+        Number of profiles of nSamples samples per chunk.
+        """
+        # 3 float64 coordinates per sample, and as much again for temporaries
+        return max(1, int(self.chunkMB * MB // (nSamples * 3 * 8 * 2)))
+
+    def sample(self, I, origins, directions, offsets):
+        """
+        Sample image I at origins + offsets[j] * directions for each profile.
+
+        inputs:
+        origins: (n profiles, 3) array of profile origins in voxel indices
+        directions: (n profiles, 3) array of profile directions in voxel
+            indices per unit offset
+        offsets: (n samples,) array of offsets along each profile
+
+        returns:
+        P: (n profiles, n samples) float array of sampled intensities
+        """
+        origins = np.asarray(origins, dtype=float)
+        directions = np.asarray(directions, dtype=float)
+        offsets = np.asarray(offsets, dtype=float)
+        nProfiles, nSamples = len(origins), len(offsets)
+        image = self._image(I)
+
+        P = np.empty((nProfiles, nSamples), dtype=float)
+        chunk = self.chunkSize(nSamples)
+        for c0 in range(0, nProfiles, chunk):
+            c1 = min(c0 + chunk, nProfiles)
+            # shape (3, chunk profiles, n samples)
+            coords = origins[c0:c1].T[:, :, np.newaxis] + directions[c0:c1].T[:, :, np.newaxis] * offsets
+            P[c0:c1] = self._interpolate(image, coords.reshape((3, -1))).reshape((c1 - c0, nSamples))
+        return P
+
+    def _image(self, I):
+        if self.order < 2:
+            return I
+        key = (id(I), self.order)
+        with _filteredLock:
+            entry = _filtered.get(key)
+            if entry is not None and entry[0]() is I:
+                return entry[1]
+        if self.store is None:
+            filtered = self._splineFilter(I)
+        else:
+            filtered = self.store.volume(I, 'splineFilter', {'order': self.order, 'pad': SPLINE_PAD},
+                                         lambda: self._splineFilter(I))[0]
+
+        def forget(ref):
+            with _filteredLock:
+                if _filtered.get(key, (None,))[0] is ref:
+                    del _filtered[key]
+
+        with _filteredLock:
+            _filtered[key] = (weakref.ref(I, forget), filtered)
+        return filtered
+
+    def _splineFilter(self, I):
+        padded = np.pad(np.asarray(I, dtype=np.float64), SPLINE_PAD, mode='edge')
+        return ndimage.spline_filter(padded, order=self.order, output=np.float64, mode='nearest')
+
+    def _interpolate(self, image, coords):
+        if self.order == 0:
+            upper = np.array(image.shape)[:, np.newaxis] - 1
+            ind = np.clip(np.rint(coords), 0, upper).astype(np.intp)
+            return image[tuple(ind)].astype(float)
+        if self.order > 1:
+            # spline filtered images are padded
+            coords = coords + SPLINE_PAD
+        return ndimage.map_coordinates(image, coords, output=float, order=self.order, mode='nearest',
+                                       prefilter=False)
@@ -0,0 +1,92 @@
+"""
+Lightweight views of gias3 Scan instances used during segmentation.
+
+Views wrap a scan without modifying or copying its image array, so one
+scan can be shared by several concurrent segmentations.
+"""
+import numpy as np
+
+
+class ScanView(object):
+    """
+    Base class for views of a Scan. Attributes not defined by the view are
+    read from the wrapped scan.
+    """
+
+    def __init__(self, scan):
+        self.scan = scan
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the view itself
+        if name == 'scan':
+            raise AttributeError(name)
+        return getattr(self.scan, name)
+
+
+class FlippedScan(ScanView):
+    """
+    View of a scan with its image mirrored along some axes. The mirroring is
+    applied to voxel indices in coord2Index and index2Coord, so sampling
+    scan.I at the returned indices is equivalent to sampling the mirrored
+    image while scan.I itself is never touched.
+    """
+
+    def __init__(self, scan, flips):
+        super(FlippedScan, self).__init__(scan)
+        self.flips = tuple(bool(f) for f in flips)
+        self._flipAxes = np.array([i for i, f in enumerate(self.flips) if f], dtype=int)
+
+    def _flipIndices(self, ind):
+        ind = np.array(ind)
+        if len(self._flipAxes):
+            shape = np.array(self.scan.I.shape)
+            ind[..., self._flipAxes] = (shape[self._flipAxes] - 1) - ind[..., self._flipAxes]
+        return ind
+
+    def coord2Index(self, coordinates, z_shift=False, neg_spacing=False, round_int=True):
+        return self._flipIndices(
+            self.scan.coord2Index(coordinates, z_shift=z_shift, neg_spacing=neg_spacing, round_int=round_int)
+        )
+
+    def index2Coord(self, indices, neg_spacing=False, z_shift=False):
+        return self.scan.index2Coord(self._flipIndices(indices), neg_spacing=neg_spacing, z_shift=z_shift)
+
+
+def flipView(scan, flipX, flipY, flipZ):
+    """
+    Return a FlippedScan of scan if any flips are set, else scan itself.
+    """
+    if flipX or flipY or flipZ:
+        return FlippedScan(scan, (flipX, flipY, flipZ))
+    return scan
+
+
+class CroppedScan(ScanView):
+    """
+    View of the sub-volume start:stop (voxel indices along each axis) of a
+    scan or scan view. Indices of the view are offset by start from the
+    wrapped scan's, physical coordinates are unchanged.
+
+    If copy is True the sub-volume is copied into a contiguous array, else
+    the view's image is a slice of the wrapped scan's image.
+    """
+
+    def __init__(self, scan, start, stop, copy=True):
+        super(CroppedScan, self).__init__(scan)
+        self.start = np.array(start, dtype=int)
+        self.stop = np.array(stop, dtype=int)
+        I = scan.I[tuple(slice(a, b) for a, b in zip(self.start, self.stop))]
+        self.I = np.ascontiguousarray(I) if copy else I
+
+    def coord2Index(self, coordinates, z_shift=False, neg_spacing=False, round_int=True):
+        ind = self.scan.coord2Index(coordinates, z_shift=z_shift, neg_spacing=neg_spacing, round_int=round_int)
+        return ind - self.start
+
+    def index2Coord(self, indices, neg_spacing=False, z_shift=False):
+        return self.scan.index2Coord(np.asarray(indices) + self.start, neg_spacing=neg_spacing, z_shift=z_shift)
+
+    def checkIndexInBounds(self, ind):
+        return not (np.any(ind < 0) or np.any(ind > (np.array(self.I.shape) - 1)))
+
+    def checkIndexIsMasked(self, ind):
+        return self.scan.checkIndexIsMasked(np.asarray(ind) + self.start)
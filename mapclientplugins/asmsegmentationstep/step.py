@@ -2,20 +2,43 @@
 MAP Client Plugin Step
 '''
 import os
+import traceback
 
-from PySide6 import QtCore
+import numpy as np
+from PySide6 import QtCore, QtWidgets
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
 from mapclientplugins.asmsegmentationstep.configuredialog import ConfigureDialog
-from mapclientplugins.asmsegmentationstep.mayaviasmsegmentationviewerwidget import MayaviASMSegmentationViewerWidget
-from mapclientplugins.asmsegmentationstep import asmseg
+
+# The viewer (Mayavi, VTK), asmseg (gias3, scipy) and the modules that use
+# them are imported where they are first needed, so that MAP Client's plugin
+# scan and headless workflows do not load them.
 
 # from configuredialog import ConfigureDialog
 # from mayaviasmsegmentationviewerwidget import MayaviASMSegmentationViewerWidget
 # import asmseg
 
-import configobj
-import copy
+
+class _SegmentThread(QtCore.QThread):
+    '''
+    Runs a segmentation function off the main thread. done is emitted with
+    the function's output and None, or None and the (exception, traceback)
+    it raised.
+    '''
+    progress = QtCore.Signal(object)
+    done = QtCore.Signal(object, object)
+
+    def __init__(self, func):
+        QtCore.QThread.__init__(self)
+        self.func = func
+
+    def run(self):
+        try:
+            output = self.func(callback=self.progress.emit)
+        except Exception as e:
+            self.done.emit(None, (e, traceback.format_exc()))
+        else:
+            self.done.emit(output, None)
 
 
 class ASMSegmentationStep(WorkflowStepMountPoint):
@@ -53,16 +76,22 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         self._config['paramFileLoc'] = ''
         self._config['ppcFileLoc'] = ''
         self._config['GUI'] = 'True'
+        self._config['resultCacheDir'] = ''
 
         self._scan = None
         self._shapepcs = None
         self._model = None
-        self._modelInit = None
-        self._modelFinal = None
+        self._paramsInit = None  # field parameters of the input model
+        self._paramsFinal = None  # field parameters of the segmented model
         self._transformFinal = None
         self._pointCloudFinal = None
         self._segParams = None
         self._asmOutput = None
+        self._cancelToken = None
+        self._resultCache = None
+        self._segmentThread = None
+        self._executionError = None
+        self._errorBox = None
 
     def execute(self):
         '''
@@ -75,8 +104,14 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         # load params file
         self._loadParams()
 
-        if self._config['GUI'] == 'True':
+        if self._config['GUI'] == 'True' and self.isMultiObject():
+            # the viewer shows one model
+            self._showStatus('ASM Segmentation: {} objects are segmented without the viewer'.format(len(self._model)))
+            self._executeHeadless()
+        elif self._config['GUI'] == 'True':
             # start gui
+            from mapclientplugins.asmsegmentationstep.mayaviasmsegmentationviewerwidget import \
+                MayaviASMSegmentationViewerWidget
             self._widget = MayaviASMSegmentationViewerWidget(self)
 
             # self._widget._ui.registerButton.clicked.connect(self._register)
@@ -86,32 +121,198 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
             self._widget.setModal(True)
             self._setCurrentWidget(self._widget)
         else:
-            self._segment()
-            self._doneExecution()
+            self._executeHeadless()
+
+    def _executeHeadless(self):
+        '''
+        Segment on a background thread, or in a worker process if [general]
+        worker is 'process', so the MAP Client UI stays responsive.
+        _doneExecution is called on the main thread once segmentation
+        finishes. If it fails, the error is reported and the workflow stops
+        at this step.
+        '''
+        from mapclientplugins.asmsegmentationstep import runner
+        self._executionError = None
+        try:
+            worker = runner.checkWorker(self._segParams['general'].get('worker', runner.DEFAULT_WORKER))
+        except runner.RunnerError as e:
+            self._reportError(e, '')
+            return
+
+        self._segmentThread = _SegmentThread(lambda callback: self._segment(callback, worker=worker))
+        self._segmentThread.progress.connect(self._headlessProgress, QtCore.Qt.QueuedConnection)
+        self._segmentThread.done.connect(self._headlessDone, QtCore.Qt.QueuedConnection)
+        self._showStatus('ASM Segmentation: segmenting in a background {}'.format(worker))
+        self._segmentThread.start()
+
+    def _headlessProgress(self, progress):
+        self._showStatus('ASM Segmentation: level {level} iteration {iteration}, '
+                         'RMSE {segRMS:6.4f}, landmarks passed {pFrac:5.1f}%'.format(
+                             pFrac=progress['segPFrac'] * 100.0, **progress))
+
+    def _headlessDone(self, output, error):
+        self._segmentThread.wait()
+        self._segmentThread = None
+        if error is not None:
+            self._reportError(*error)
+            return
+        asmOutputs = self._asmOutput if self.isMultiObject() else [self._asmOutput]
+        self._showStatus('ASM Segmentation: done, RMSE {}'.format(
+            ', '.join('{:6.4f}'.format(o['segRMS']) for o in asmOutputs)))
+        self._doneExecution()
+
+    def _showStatus(self, message):
+        '''
+        Show message in the MAP Client status bar, and print it if verbose.
+        '''
+        mainWindow = getattr(self, '_main_window', None)
+        if mainWindow is not None and hasattr(mainWindow, 'statusBar'):
+            mainWindow.statusBar().showMessage(message)
+        if self._segParams is None or self._segParams['general'].get('verbose', True):
+            print(message)
+
+    def _reportError(self, error, trace):
+        '''
+        Report a failed headless segmentation. The error is kept in
+        _executionError and shown without blocking, so unattended workflows
+        are not held up by a modal dialog.
+        '''
+        self._executionError = error
+        if trace:
+            print(trace)
+        self._showStatus('ASM Segmentation failed: {}'.format(error))
+        mainWindow = getattr(self, '_main_window', None)
+        if mainWindow is not None:
+            self._errorBox = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Critical, 'ASM Segmentation',
+                                                   'Segmentation failed:\n{}'.format(error),
+                                                   parent=mainWindow)
+            self._errorBox.setDetailedText(trace)
+            self._errorBox.setModal(False)
+            self._errorBox.show()
+
+    def isMultiObject(self):
+        '''
+        True if the step was given lists of models and shape models, which
+        are segmented together, see asmseg.segmentObjects. Its outputs are
+        then lists with one item per object.
+        '''
+        return isinstance(self._model, (list, tuple))
 
     def _loadParams(self):
-        if self._config['paramFileLoc'] == '':
-            paramFileLoc = os.path.join(os.path.dirname(__file__), 'default_params.ini')
-            self._segParams = configobj.ConfigObj(paramFileLoc, unrepr=True)
+        from mapclientplugins.asmsegmentationstep import asmseg
+        self._segParams = asmseg.loadParams(self._config['paramFileLoc'], self._config['ppcFileLoc'])
+
+    def cancelSegmentation(self):
+        '''
+        Ask a running segmentation to stop after its current ASM iteration.
+        The segmentation then finishes with its best result so far.
+        '''
+        if self._cancelToken is not None:
+            self._cancelToken.cancel()
+
+    def _resetCancelToken(self):
+        '''
+        The step's cancel token, created on first use, cleared for a new
+        segmentation or sweep.
+        '''
+        from mapclientplugins.asmsegmentationstep import asmseg
+        if self._cancelToken is None:
+            self._cancelToken = asmseg.CancelToken()
+        self._cancelToken.reset()
+        return self._cancelToken
+
+    def _getResultCache(self):
+        '''
+        The result cache in the configured directory, None if no directory
+        is configured.
+        '''
+        cacheDir = self._config.get('resultCacheDir', '')
+        if not cacheDir:
+            self._resultCache = None
+            return None
+        from mapclientplugins.asmsegmentationstep import resultcache
+        maxMB = self._segParams.get('result_cache', {}).get('max_mb', resultcache.DEFAULT_MAX_MB)
+        if self._resultCache is None or self._resultCache.directory != cacheDir:
+            self._resultCache = resultcache.ResultCache(cacheDir, maxMB)
         else:
-            self._segParams = configobj.ConfigObj(self._config['paramFileLoc'], unrepr=True)
+            self._resultCache.maxBytes = int(maxMB * resultcache.MB)
+        return self._resultCache
 
-        self._segParams['data_files']['ppc_filename'] = self._config['ppcFileLoc']
+    def _segment(self, callback=None, worker='thread'):
+        '''
+        Segment in this process, or in a worker process if worker is
+        'process', see runner.segmentInProcess. The segmented model
+        replaces the step's model.
+        '''
+        from mapclientplugins.asmsegmentationstep import resultcache
+        from mapclientplugins.asmsegmentationstep import runner
+        cancelToken = self._resetCancelToken()
+        if worker == 'process':
+            output = runner.segmentInProcess(
+                self._scan,
+                self._model,
+                self._shapepcs,
+                self._segParams,
+                cacheDir=self._config.get('resultCacheDir', ''),
+                cacheMaxMB=self._segParams.get('result_cache', {}).get('max_mb', resultcache.DEFAULT_MAX_MB),
+                callback=callback,
+                cancelToken=cancelToken,
+            )
+        else:
+            output = runner.runSegmentation(
+                self._scan,
+                self._model,
+                self._shapepcs,
+                self._segParams,
+                cache=self._getResultCache(),
+                callback=callback,
+                cancelToken=cancelToken,
+            )
 
-    def _segment(self):
-        segModel, segPoints, \
-        segTransform, asmOutput = asmseg.segment(
-            self._scan,
-            self._model,
-            self._shapepcs,
-            self._segParams
-        )
-        self._modelFinal = segModel
+        if self.isMultiObject():
+            self._model = [o[0] for o in output]
+            self._paramsFinal = [m.get_field_parameters().copy() for m in self._model]
+            self._pointCloudFinal = [o[1] for o in output]
+            self._transformFinal = [o[2] for o in output]
+            self._asmOutput = [o[3] for o in output]
+            return output
+
+        segModel, segPoints, segTransform, asmOutput = output
         self._model = segModel
+        self._setResult(segModel.get_field_parameters(), segPoints, segTransform, asmOutput)
+        return output
+
+    def _setResult(self, fieldParameters, segPoints, segTransform, asmOutput):
+        '''
+        Make a segmentation result, e.g. of a parameter sweep configuration,
+        the step's output.
+        '''
+        self._paramsFinal = np.array(fieldParameters)
+        self._model.set_field_parameters(self._paramsFinal.copy())
         self._pointCloudFinal = segPoints
         self._transformFinal = segTransform
         self._asmOutput = asmOutput
-        return segModel, segPoints, segTransform, asmOutput
+
+    def runSweep(self, overrides, processes=None, callback=None):
+        '''
+        Segment the scan from the initial model with the step's parameters
+        updated by each dict of [ASM] values in overrides, across a pool of
+        worker processes. See sweep.runSweep. cancelSegmentation stops the
+        sweep.
+        '''
+        from mapclientplugins.asmsegmentationstep import sweep
+        self._resetCancelToken()
+        return sweep.runSweep(
+            self._scan,
+            self._model,
+            self._shapepcs,
+            self._segParams,
+            overrides,
+            processes=processes,
+            callback=callback,
+            cancelToken=self._cancelToken,
+            initParams=self._paramsInit,
+        )
 
     def setPortData(self, index, dataIn):
         '''
@@ -122,9 +323,14 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         if index == 0:
             self._scan = dataIn  # ju#scan
         elif index == 1:
-            self._model = dataIn  # ju#fieldworkmodel
-            self._modelInit = copy.deepcopy(self._model)
-            self._modelFinal = copy.deepcopy(self._model)
+            self._model = dataIn  # ju#fieldworkmodel, or a list of them for multi-object segmentation
+            if self.isMultiObject():
+                self._model = list(dataIn)
+                self._paramsInit = [m.get_field_parameters().copy() for m in self._model]
+                self._paramsFinal = [p.copy() for p in self._paramsInit]
+            else:
+                self._paramsInit = self._model.get_field_parameters().copy()
+                self._paramsFinal = self._paramsInit.copy()
         else:
             self._shapepcs = dataIn  # ju#principalcomponents
 
@@ -135,7 +341,13 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         provides port for this step then the index can be ignored.
         '''
         if index == 3:
-            return self._modelFinal
+            # the model may have been redrawn at other parameters since it was segmented
+            if self.isMultiObject():
+                for model, params in zip(self._model, self._paramsFinal):
+                    model.set_field_parameters(params.copy())
+            elif self._model is not None and self._paramsFinal is not None:
+                self._model.set_field_parameters(self._paramsFinal.copy())
+            return self._model
         elif index == 4:
             return self._transformFinal
         else:
@@ -188,6 +400,7 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         conf.setValue('paramFileLoc', self._config['paramFileLoc'])
         conf.setValue('ppcFileLoc', self._config['ppcFileLoc'])
         conf.setValue('GUI', self._config['GUI'])
+        conf.setValue('resultCacheDir', self._config['resultCacheDir'])
         conf.endGroup()
 
     def deserialize(self, string):
@@ -204,6 +417,7 @@ class ASMSegmentationStep(WorkflowStepMountPoint):
         self._config['paramFileLoc'] = conf.value('paramFileLoc', '')
         self._config['ppcFileLoc'] = conf.value('ppcFileLoc', '')
         self._config['GUI'] = conf.value('GUI', 'True')
+        self._config['resultCacheDir'] = conf.value('resultCacheDir', '')
         conf.endGroup()
 
         d = ConfigureDialog()
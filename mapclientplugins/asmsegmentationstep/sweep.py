@@ -0,0 +1,277 @@
+"""
+Parameter sweeps: segment one scan with many [ASM] configurations across
+a pool of worker processes.
+
+A sweep is a dict of value lists for any [ASM] keys (and ppc_filename,
+for sweeps of mesh_d, n_d or n_lim, which need a texture model trained
+with the same values). Configurations are the Cartesian product of the
+lists, or a random or Latin hypercube subset of it. Every configuration
+starts from the same initial model.
+
+    ranges = sweep.parseRanges('shape_modes = 2:6\\nn_pad = 15, 25, 40')
+    overrides = sweep.sweepConfigs(ranges, mode='lhs', nSamples=8)
+    results = sweep.runSweep(scan, model, shapepcs, config, overrides)
+
+The scan, models and config are pickled to each worker process, so
+memory-mapped scans are copied into every worker.
+"""
+import ast
+import copy
+import itertools
+import multiprocessing
+import re
+import time
+
+import configobj
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import runner
+
+MODES = ('grid', 'random', 'lhs')
+
+# keys swept outside of [ASM]
+PPC_KEY = 'ppc_filename'
+
+_RANGE_RE = re.compile(r'^\s*(-?[\d.]+)\s*:\s*(-?[\d.]+)\s*(?::\s*(-?[\d.]+)\s*)?$')
+
+_worker = {}
+
+
+class SweepError(Exception):
+    pass
+
+
+def parseValues(text):
+    """
+    Values of one swept key from text: an inclusive range start:stop or
+    start:stop:step (step defaults to 1), or comma separated Python
+    literals, e.g. "0.05, 0.1, 0.2", "'default', 'elementmedian'" or
+    "[-10, 10], [-15, 15]".
+    """
+    match = _RANGE_RE.match(text)
+    if match is not None:
+        start, stop, step = match.groups()
+        isInt = all(v is None or re.match(r'^-?\d+$', v) for v in (start, stop, step))
+        cast = int if isInt else float
+        start, stop, step = cast(start), cast(stop), cast(step) if step is not None else cast(1)
+        if step <= 0 or stop < start:
+            raise SweepError('invalid range {}'.format(text))
+        values = np.arange(start, stop + 0.5 * step, step)
+        return [cast(v) for v in values]
+
+    try:
+        values = ast.literal_eval('[' + text + ']')
+    except (ValueError, SyntaxError):
+        raise SweepError('cannot parse sweep values {}'.format(text))
+    if not values:
+        raise SweepError('no sweep values in {}'.format(text))
+    return values
+
+
+def parseRanges(text):
+    """
+    Sweep ranges from lines of "key = values", see parseValues. Blank
+    lines and lines starting with # are ignored.
+    """
+    ranges = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '=' not in line:
+            raise SweepError('expected "key = values", got {}'.format(line))
+        key, values = line.split('=', 1)
+        ranges[key.strip()] = parseValues(values.strip())
+    return ranges
+
+
+def checkRanges(ranges, config):
+    """
+    Raise SweepError if ranges sweeps a key that is not in [ASM].
+    """
+    if not ranges:
+        raise SweepError('nothing to sweep')
+    for key in ranges:
+        if key != PPC_KEY and key not in config['ASM']:
+            raise SweepError('unknown [ASM] key {}'.format(key))
+
+
+def sweepConfigs(ranges, mode='grid', nSamples=None, seed=0):
+    """
+    List of dicts of the values of each swept key in each configuration.
+
+    mode: 'grid' for every combination of values, 'random' for nSamples
+        distinct combinations, 'lhs' for a Latin hypercube sample of
+        nSamples combinations, in which each key's values are used as
+        evenly as possible.
+    """
+    keys = list(ranges)
+    values = [list(ranges[k]) for k in keys]
+    shape = tuple(len(v) for v in values)
+    total = int(np.prod(shape))
+
+    if mode == 'grid':
+        combinations = list(itertools.product(*values))
+    elif mode in ('random', 'lhs'):
+        if not nSamples or nSamples < 1:
+            raise SweepError('{} sweeps need a number of samples'.format(mode))
+        rng = np.random.default_rng(seed)
+        if mode == 'random':
+            flat = np.sort(rng.choice(total, size=min(nSamples, total), replace=False))
+            indices = np.array(np.unravel_index(flat, shape)).T
+        else:
+            # each key's range split into nSamples strata, one sample per stratum
+            strata = (np.array([rng.permutation(nSamples) for _ in keys]).T + rng.uniform(size=(nSamples, len(keys))))
+            indices = np.floor(strata / nSamples * np.array(shape)).astype(int)
+        combinations = [tuple(v[i] for v, i in zip(values, ind)) for ind in indices]
+    else:
+        raise SweepError('unknown sweep mode {}, expected one of {}'.format(mode, ', '.join(MODES)))
+
+    return [dict(zip(keys, c)) for c in combinations]
+
+
+def applyOverrides(config, overrides):
+    """
+    A copy of config with overrides set in [ASM], and ppc_filename in
+    [data_files].
+    """
+    newConfig = configobj.ConfigObj(copy.deepcopy(config.dict() if hasattr(config, 'dict') else dict(config)))
+    for key, value in overrides.items():
+        if key == PPC_KEY:
+            newConfig['data_files'][PPC_KEY] = value
+        else:
+            newConfig['ASM'][key] = value
+    return newConfig
+
+
+def _initWorker(scan, model, shapepcs, config, initParams, cancelEvent=None):
+    _worker['scan'] = scan
+    _worker['model'] = model
+    _worker['shapepcs'] = shapepcs
+    _worker['config'] = config
+    _worker['initParams'] = initParams
+    _worker['cancelToken'] = asmseg.CancelToken(cancelEvent)
+
+
+def _runConfig(indexedOverrides):
+    index, overrides = indexedOverrides
+    cancelToken = _worker['cancelToken']
+    if cancelToken.isCancelled():
+        return None
+    result = {'index': index, 'overrides': overrides}
+    t0 = time.time()
+    try:
+        config = applyOverrides(_worker['config'], overrides)
+        config['general']['verbose'] = False
+        # every configuration starts from the initial model
+        model = _worker['model']
+        model.set_field_parameters(_worker['initParams'].copy())
+        model, dataASM, meshParamsASM, asmOutput = asmseg.segment(
+            _worker['scan'], model, _worker['shapepcs'], config, cancelToken=cancelToken,
+        )
+    except Exception as e:
+        result.update(status='failed', error=repr(e), wallTime=time.time() - t0)
+        return result
+
+    result.update(
+        status='cancelled' if asmOutput.get('cancelled', False) else 'done',
+        wallTime=time.time() - t0,
+        segRMS=float(asmOutput['segRMS']),
+        segPFrac=float(asmOutput['segPFrac']),
+        iterations=asmseg.iterations(asmOutput),
+        fieldParameters=model.get_field_parameters().copy(),
+        dataASM=dataASM,
+        meshParamsASM=meshParamsASM,
+        asmOutput=asmOutput,
+    )
+    return result
+
+
+def runSweep(scan, model, shapepcs, config, overrides, processes=None, callback=None, cancelToken=None,
+             initParams=None):
+    """
+    Segment scan with config updated by each dict in overrides, across a
+    pool of worker processes.
+
+    inputs:
+    overrides: list of dicts of [ASM] values, see sweepConfigs
+    processes: number of worker processes, defaults to the number of CPUs.
+        1 runs every configuration in this process.
+    callback: called with each result as it finishes, in completion order
+    cancelToken: asmseg.CancelToken, once cancelled the running
+        configurations stop at their next iteration and no more are
+        started
+    initParams: field parameters every configuration starts from,
+        defaults to the current parameters of model
+
+    returns:
+    results: list of dicts, in the order of overrides, of index, overrides,
+        status ('done', 'cancelled' or 'failed'), wallTime and either error
+        or segRMS, segPFrac, iterations, fieldParameters (of the segmented
+        model), dataASM, meshParamsASM and asmOutput. Configurations not
+        started because of cancellation are missing.
+    """
+    checkRanges({k: None for o in overrides for k in o}, config)
+    if initParams is None:
+        initParams = model.get_field_parameters()
+    config = config.dict() if hasattr(config, 'dict') else dict(config)
+    tasks = list(enumerate(overrides))
+
+    results = []
+
+    def collect(result):
+        if result is None:
+            return
+        results.append(result)
+        if callback is not None:
+            callback(result)
+
+    if processes == 1:
+        # keep the caller's model unmodified
+        _initWorker(scan, copy.deepcopy(model), shapepcs, config, np.array(initParams))
+        if cancelToken is not None:
+            _worker['cancelToken'] = cancelToken
+        for task in tasks:
+            collect(_runConfig(task))
+        return sorted(results, key=lambda r: r['index'])
+
+    # workers check the event between configurations and after every iteration
+    cancelEvent = multiprocessing.Event()
+    pool = multiprocessing.Pool(processes, initializer=_initWorker,
+                                initargs=(scan, model, shapepcs, config, np.array(initParams), cancelEvent))
+    finished = False
+    try:
+        resultIter = pool.imap_unordered(_runConfig, tasks)
+        while True:
+            if cancelToken is not None and cancelToken.isCancelled():
+                cancelEvent.set()
+            try:
+                result = resultIter.next(timeout=runner.POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                continue
+            except StopIteration:
+                break
+            collect(result)
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+    return sorted(results, key=lambda r: r['index'])
+
+
+def bestResult(results, key='segRMS'):
+    """
+    The finished result with the lowest segRMS, or the highest segPFrac
+    if key is 'segPFrac'. None if no configuration finished.
+    """
+    done = [r for r in results if r['status'] == 'done' and np.isfinite(r[key])]
+    if not done:
+        return None
+    if key == 'segPFrac':
+        return max(done, key=lambda r: r[key])
+    return min(done, key=lambda r: r[key])
@@ -0,0 +1,219 @@
+'''
+Viewer panel for running parameter sweeps and browsing their results.
+'''
+import multiprocessing
+
+from PySide6.QtCore import Qt, QThread, Signal
+from PySide6.QtWidgets import (QAbstractItemView, QComboBox, QFormLayout, QHBoxLayout, QLabel, QPlainTextEdit,
+                               QPushButton, QSpinBox, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget)
+
+from mapclientplugins.asmsegmentationstep import sweep
+
+INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
+DEFAULT_STYLE_SHEET = ''
+
+RANGES_HELP = ('One [ASM] key per line, as start:stop[:step] or comma separated values, e.g.\n'
+               'shape_modes = 2:6\n'
+               'fit_mweight = 0.05, 0.1, 0.2\n'
+               'n_lim = [-10, 10], [-15, 15]')
+
+RESULT_COLUMNS = ('segRMS', 'segPFrac', 'iterations', 'wallTime', 'status')
+
+
+class _SweepThread(QThread):
+    result = Signal(object)
+    done = Signal(object)
+
+    def __init__(self, func):
+        QThread.__init__(self)
+        self.func = func
+        self.args = ()
+
+    def run(self):
+        try:
+            self.func(*self.args, callback=self.result.emit)
+            self.done.emit(None)
+        except Exception as e:
+            self.done.emit(e)
+
+
+class _NumericItem(QTableWidgetItem):
+    '''
+    Table item sorted by its numeric value rather than its text.
+    '''
+
+    def __init__(self, text, value):
+        QTableWidgetItem.__init__(self, text)
+        self.value = value
+
+    def __lt__(self, other):
+        if isinstance(other, _NumericItem):
+            return self.value < other.value
+        return QTableWidgetItem.__lt__(self, other)
+
+
+class SweepPanel(QWidget):
+    '''
+    Runs a parameter sweep of a step's segmentation in the background and
+    lists each configuration's result in a sortable table. Clicking a row
+    emits resultSelected with that configuration's result. running is
+    emitted with True when a sweep starts and False when it ends.
+    '''
+    resultSelected = Signal(object)
+    running = Signal(bool)
+
+    def __init__(self, step, parent=None):
+        QWidget.__init__(self, parent)
+        self._step = step
+        self._results = {}
+        self._keys = []
+        self._nConfigs = 0
+
+        self._worker = _SweepThread(self._step.runSweep)
+        self._worker.result.connect(self._addResult)
+        self._worker.done.connect(self._sweepDone)
+
+        self._setupGui()
+        self._makeConnections()
+
+    def _setupGui(self):
+        layout = QVBoxLayout(self)
+
+        helpLabel = QLabel(RANGES_HELP, self)
+        helpLabel.setWordWrap(True)
+        layout.addWidget(helpLabel)
+
+        self.rangesEdit = QPlainTextEdit(self)
+        self.rangesEdit.setPlaceholderText('shape_modes = 2:6')
+        self.rangesEdit.setMaximumHeight(100)
+        layout.addWidget(self.rangesEdit)
+
+        form = QFormLayout()
+        self.modeComboBox = QComboBox(self)
+        self.modeComboBox.addItems(['grid', 'random', 'lhs'])
+        form.addRow('Mode:', self.modeComboBox)
+        self.samplesSpinBox = QSpinBox(self)
+        self.samplesSpinBox.setRange(1, 10000)
+        self.samplesSpinBox.setValue(20)
+        self.samplesSpinBox.setEnabled(False)
+        form.addRow('Samples:', self.samplesSpinBox)
+        self.processesSpinBox = QSpinBox(self)
+        self.processesSpinBox.setRange(1, 256)
+        self.processesSpinBox.setValue(multiprocessing.cpu_count())
+        form.addRow('Processes:', self.processesSpinBox)
+        layout.addLayout(form)
+
+        buttons = QHBoxLayout()
+        self.runButton = QPushButton('Run Sweep', self)
+        self.stopButton = QPushButton('Stop', self)
+        self.stopButton.setEnabled(False)
+        buttons.addWidget(self.runButton)
+        buttons.addWidget(self.stopButton)
+        layout.addLayout(buttons)
+
+        self.statusLabel = QLabel('', self)
+        self.statusLabel.setWordWrap(True)
+        layout.addWidget(self.statusLabel)
+
+        self.resultsTable = QTableWidget(self)
+        self.resultsTable.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.resultsTable.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.resultsTable.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.resultsTable)
+
+    def _makeConnections(self):
+        self.modeComboBox.currentTextChanged.connect(self._modeChanged)
+        self.runButton.clicked.connect(self._runClicked)
+        self.stopButton.clicked.connect(self._stopClicked)
+        self.resultsTable.itemClicked.connect(self._resultClicked)
+
+    def isRunning(self):
+        return self._worker.isRunning()
+
+    def _modeChanged(self, mode):
+        self.samplesSpinBox.setEnabled(mode != 'grid')
+
+    def _runClicked(self):
+        try:
+            ranges = sweep.parseRanges(self.rangesEdit.toPlainText())
+            sweep.checkRanges(ranges, self._step._segParams)
+            overrides = sweep.sweepConfigs(ranges, mode=self.modeComboBox.currentText(),
+                                           nSamples=self.samplesSpinBox.value())
+        except sweep.SweepError as e:
+            self.rangesEdit.setStyleSheet(INVALID_STYLE_SHEET)
+            self.statusLabel.setText(str(e))
+            return
+        self.rangesEdit.setStyleSheet(DEFAULT_STYLE_SHEET)
+
+        self._keys = list(ranges)
+        self._results = {}
+        self._nConfigs = len(overrides)
+        self._resetTable()
+        self.statusLabel.setText('0/{} configurations done'.format(self._nConfigs))
+
+        self._worker.args = (overrides, self.processesSpinBox.value())
+        self._lockUI(True)
+        self._worker.start()
+
+    def _stopClicked(self):
+        self.stopButton.setEnabled(False)
+        self._step.cancelSegmentation()
+
+    def _lockUI(self, running):
+        self.running.emit(running)
+        self.runButton.setEnabled(not running)
+        self.rangesEdit.setEnabled(not running)
+        self.modeComboBox.setEnabled(not running)
+        self.samplesSpinBox.setEnabled(not running and self.modeComboBox.currentText() != 'grid')
+        self.processesSpinBox.setEnabled(not running)
+        self.stopButton.setEnabled(running)
+
+    def _resetTable(self):
+        headers = self._keys + list(RESULT_COLUMNS)
+        self.resultsTable.setSortingEnabled(False)
+        self.resultsTable.clear()
+        self.resultsTable.setRowCount(0)
+        self.resultsTable.setColumnCount(len(headers))
+        self.resultsTable.setHorizontalHeaderLabels(headers)
+
+    def _addResult(self, result):
+        # called through a queued signal as each configuration finishes
+        self._results[result['index']] = result
+
+        # rows move when sorted, so sorting is paused while one is filled
+        self.resultsTable.setSortingEnabled(False)
+        row = self.resultsTable.rowCount()
+        self.resultsTable.insertRow(row)
+        items = [QTableWidgetItem(str(result['overrides'][k])) for k in self._keys]
+        for name, fmt in (('segRMS', '{:6.4f}'), ('segPFrac', '{:5.3f}'), ('iterations', '{}'), ('wallTime', '{:6.1f}')):
+            value = result.get(name)
+            if value is None:
+                items.append(_NumericItem('', float('inf')))
+            else:
+                items.append(_NumericItem(fmt.format(value), value))
+        statusItem = QTableWidgetItem(result['status'])
+        if result['status'] != 'done':
+            statusItem.setToolTip(result.get('error', ''))
+        items.append(statusItem)
+        for column, item in enumerate(items):
+            item.setData(Qt.UserRole, result['index'])
+            self.resultsTable.setItem(row, column, item)
+        self.resultsTable.setSortingEnabled(True)
+
+        self.statusLabel.setText('{}/{} configurations done'.format(len(self._results), self._nConfigs))
+
+    def _sweepDone(self, error):
+        self._lockUI(False)
+        if error is not None:
+            self.statusLabel.setText('Sweep failed: {!r}'.format(error))
+            return
+        best = sweep.bestResult(list(self._results.values()))
+        if best is not None:
+            self.statusLabel.setText('{}/{} configurations done, lowest segRMS {:6.4f} with {}'.format(
+                len(self._results), self._nConfigs, best['segRMS'],
+                ', '.join('{} = {}'.format(k, v) for k, v in best['overrides'].items())))
+
+    def _resultClicked(self, item):
+        result = self._results.get(item.data(Qt.UserRole))
+        if result is not None and result['status'] == 'done':
+            self.resultSelected.emit(result)
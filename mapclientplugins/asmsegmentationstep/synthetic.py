@@ -0,0 +1,208 @@
+"""
+Synthetic scans, shape models and texture models for benchmarking ASM
+segmentation without any patient data.
+
+Scans are ellipsoids of uniform intensity with a blurred edge in Gaussian
+noise. The shape model is trained on ellipsoid-like deformations (axis
+scaling, taper and bend) of a fieldwork sphere, and the texture model
+(PPC) is trained on profiles sampled normal to the true surfaces of
+synthetic training scans, so segmenting a synthetic scan exercises the
+same code paths as segmenting a real one.
+
+Everything is generated from a seed, so data are identical between runs.
+"""
+import pickle
+
+import numpy as np
+from scipy import special
+
+from gias3.fieldwork.field import geometric_field
+from gias3.fieldwork.field import template_fields
+from gias3.image_analysis import asm_segmentation as ASM
+from gias3.image_analysis import fw_segmentation_tools as fst
+from gias3.image_analysis import image_tools
+from gias3.learning import PCA
+
+FOV = 128.0                         # field of view of synthetic scans in mm, along each axis
+RADII_MEAN = (40.0, 34.0, 28.0)     # mean ellipsoid semi-axes in mm
+RADII_SD = (3.0, 3.0, 2.5)
+TAPER_SD = 0.05                     # fractional change in x and y radius per unit z of the unit sphere
+BEND_SD = 0.05                      # x offset of the poles as a fraction of the x radius
+INTENSITY = 1000.0
+NOISE_SD = 100.0
+EDGE_SD = 1.5                       # SD in mm of the blur across the object edge
+SPHERE_DIVS = (6, 4)                # azimuth and inclination divisions of the template sphere
+
+
+def _rng(seed):
+    return np.random.RandomState(seed)
+
+
+def ellipsoidImage(size, radii, centre, fov=FOV, intensity=INTENSITY, noiseSD=NOISE_SD, edgeSD=EDGE_SD, seed=0):
+    """
+    A size**3 float32 image of an axis-aligned ellipsoid of the given radii
+    and centre (in mm) with a blurred edge, plus Gaussian noise. Voxel i is
+    centred at i * fov / size mm. Built one slab at a time so no full size
+    coordinate arrays are allocated.
+    """
+    spacing = fov / size
+    x = np.arange(size) * spacing - centre[0]
+    y = (np.arange(size) * spacing - centre[1])[:, np.newaxis]
+    z = (np.arange(size) * spacing - centre[2])[np.newaxis, :]
+    rng = _rng(seed)
+
+    I = np.empty((size, size, size), dtype=np.float32)
+    for k in range(size):
+        q = np.sqrt((x[k] / radii[0]) ** 2 + (y / radii[1]) ** 2 + (z / radii[2]) ** 2)
+        r = np.sqrt(x[k] ** 2 + y ** 2 + z ** 2)
+        # distance to the surface along the ray from the centre, exact for spheres
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = np.where(q > 0, r * (1.0 - 1.0 / q), -min(radii))
+        I[k] = 0.5 * intensity * special.erfc(d / (np.sqrt(2.0) * edgeSD))
+        I[k] += rng.normal(0.0, noiseSD, size=(size, size))
+
+    return I
+
+
+def ellipsoidScan(size, radii, centre, fov=FOV, seed=0, name='synthetic'):
+    """
+    An image_tools.Scan of ellipsoidImage with matching voxel spacing.
+    """
+    scan = image_tools.Scan(name)
+    scan.setImageArray(ellipsoidImage(size, radii, centre, fov=fov, seed=seed),
+                       voxel_spacing=[fov / size] * 3, voxel_origin=[0.0, 0.0, 0.0])
+    return scan
+
+
+def surfaceDistance(points, radii, centre):
+    """
+    Approximate signed distance in mm of points to the surface of an
+    axis-aligned ellipsoid, measured along rays from its centre.
+    """
+    p = np.asarray(points) - centre
+    q = np.sqrt(((p / radii) ** 2).sum(1))
+    return np.sqrt((p ** 2).sum(1)) * (1.0 - 1.0 / q)
+
+
+def sphereModel(name='ellipsoid'):
+    """
+    A fieldwork model of a unit sphere centred at the origin.
+    """
+    ens, xParams, yParams, zParams = template_fields.sphere(SPHERE_DIVS[0], SPHERE_DIVS[1], 1.0, np.pi)[:4]
+    model = geometric_field.GeometricField(name, 3, ensemble_field_function=ens)
+    model.set_field_parameters(np.array([xParams, yParams, zParams], dtype=float))
+    return model
+
+
+def deformSphere(sphereParams, radii, taper=0.0, bend=0.0, centre=(0.0, 0.0, 0.0)):
+    """
+    Field parameters of the unit sphere sphereParams, shape (3, n, 1),
+    scaled to radii, tapered and bent along z, then moved to centre.
+    """
+    x, y, z = sphereParams
+    params = np.array([
+        radii[0] * (x * (1.0 + taper * z) + bend * z ** 2),
+        radii[1] * y * (1.0 + taper * z),
+        radii[2] * z,
+    ])
+    return params + np.reshape(centre, (3, 1, 1))
+
+
+def randomShapes(n, seed=0):
+    """
+    n random (radii, taper, bend) tuples.
+    """
+    rng = _rng(seed)
+    return [(rng.normal(RADII_MEAN, RADII_SD), rng.normal(0.0, TAPER_SD), rng.normal(0.0, BEND_SD))
+            for _ in range(n)]
+
+
+def shapeModel(sphereParams, nTrain=30, seed=0):
+    """
+    PCA.PrincipalComponents of nTrain random deformations of the unit
+    sphere, centred at the origin. Has 5 meaningful modes.
+    """
+    X = np.array([deformSphere(sphereParams, *shape).ravel() for shape in randomShapes(nTrain, seed)])
+    pca = PCA.PCA()
+    pca.setData(X.T)
+    pca.svd_decompose()
+    return pca.PC
+
+
+def landmarkEvaluators(model, meshD):
+    """
+    Functions evaluating the landmark coordinates and normals of model,
+    at a mesh_d grid of points per element, from its field parameters.
+    """
+    meshEval = fst.makeGFEvaluator('XiGrid', model, GD=meshD)[0]
+    normalEval = fst.makeGFNormalEvaluator('XiGrid', model, GD=meshD)
+    return meshEval, normalEval
+
+
+def sampleProfiles(scan, landmarks, normals, nD, nLim):
+    """
+    Derivative intensity profiles of length nD sampled along normals at
+    landmarks, as ASMSegmentation samples them, each normalised by its sum
+    of absolute values as in profile matching.
+    """
+    params = ASM.ASMSegmentationParams(ND=nD, NLim=nLim, NPad=0, filterLandmarks=False)
+    asm = ASM.ASMSegmentation(scan, params=params,
+                              getMeshCoords=lambda x: landmarks,
+                              getMeshNormals=lambda x: normals)
+    asm._evaluateLandmarks(None)
+    asm._sampleImage()
+    dP = asm.dP / np.abs(asm.dP).sum(1)[:, np.newaxis]
+    return np.where(np.isfinite(dP), dP, 0.0)
+
+
+def trainPPCs(model, sphereParams, size, profileConfigs, nTrain=10, fov=FOV, seed=0):
+    """
+    Train a texture model for each (mesh_d, n_d, n_lim) in profileConfigs
+    on nTrain random synthetic scans of the given size. The scans are
+    generated one at a time and shared by all configs. Returns a list of
+    PCA.PCList in the order of profileConfigs.
+    """
+    evaluators = [landmarkEvaluators(model, meshD) for meshD, nD, nLim in profileConfigs]
+    profiles = [[] for _ in profileConfigs]
+    for i, (radii, taper, bend) in enumerate(randomShapes(nTrain, seed)):
+        centre = np.full(3, 0.5 * fov)
+        scan = ellipsoidScan(size, radii, centre, fov=fov, seed=seed + i + 1)
+        trueParams = deformSphere(sphereParams, radii, centre=centre)
+        for (meshD, nD, nLim), (meshEval, normalEval), configProfiles in zip(profileConfigs, evaluators, profiles):
+            configProfiles.append(sampleProfiles(scan, meshEval(trueParams), normalEval(trueParams), nD, nLim))
+
+    ppcs = []
+    for configProfiles in profiles:
+        # shape (n training scans, n landmarks, n_d)
+        dP = np.array(configProfiles)
+        ppc = PCA.PCList()
+        for l in range(dP.shape[1]):
+            pca = PCA.PCA()
+            pca.setData(dP[:, l, :].T)
+            pca.svd_decompose()
+            ppc.append(pca.PC)
+        ppcs.append(ppc)
+
+    return ppcs
+
+
+def savePPC(ppc, filename):
+    """
+    Pickle the list of profile PCs of ppc to filename, readable by
+    ppccache. PCList.save writes in text mode, which fails on Python 3.
+    """
+    with open(filename, 'wb') as f:
+        pickle.dump(ppc.L, f, protocol=2)
+    return filename
+
+
+def testCase(size, fov=FOV, seed=0):
+    """
+    A random synthetic scan to segment and its true (radii, centre). The
+    centre is offset a few mm from the centre of the field of view, where
+    the initial model is placed.
+    """
+    rng = _rng(seed)
+    radii = rng.normal(RADII_MEAN, RADII_SD)
+    centre = 0.5 * fov + rng.uniform(-3.0, 3.0, 3)
+    return ellipsoidScan(size, radii, centre, fov=fov, seed=seed), radii, centre
@@ -49,12 +49,12 @@ class Ui_Dialog(object):
         self.guiLabel = QLabel(self.configGroupBox)
         self.guiLabel.setObjectName(u"guiLabel")
 
-        self.formLayout.setWidget(3, QFormLayout.LabelRole, self.guiLabel)
+        self.formLayout.setWidget(4, QFormLayout.LabelRole, self.guiLabel)
 
         self.guiCheckBox = QCheckBox(self.configGroupBox)
         self.guiCheckBox.setObjectName(u"guiCheckBox")
 
-        self.formLayout.setWidget(3, QFormLayout.FieldRole, self.guiCheckBox)
+        self.formLayout.setWidget(4, QFormLayout.FieldRole, self.guiCheckBox)
 
         self.horizontalLayout = QHBoxLayout()
         self.horizontalLayout.setObjectName(u"horizontalLayout")
@@ -91,6 +91,26 @@ class Ui_Dialog(object):
 
         self.formLayout.setLayout(2, QFormLayout.FieldRole, self.horizontalLayout_2)
 
+        self.cacheLabel = QLabel(self.configGroupBox)
+        self.cacheLabel.setObjectName(u"cacheLabel")
+
+        self.formLayout.setWidget(3, QFormLayout.LabelRole, self.cacheLabel)
+
+        self.horizontalLayout_3 = QHBoxLayout()
+        self.horizontalLayout_3.setObjectName(u"horizontalLayout_3")
+        self.cacheLineEdit = QLineEdit(self.configGroupBox)
+        self.cacheLineEdit.setObjectName(u"cacheLineEdit")
+
+        self.horizontalLayout_3.addWidget(self.cacheLineEdit)
+
+        self.cacheButton = QPushButton(self.configGroupBox)
+        self.cacheButton.setObjectName(u"cacheButton")
+
+        self.horizontalLayout_3.addWidget(self.cacheButton)
+
+
+        self.formLayout.setLayout(3, QFormLayout.FieldRole, self.horizontalLayout_3)
+
 
         self.gridLayout.addWidget(self.configGroupBox, 0, 0, 1, 1)
 
@@ -105,7 +125,9 @@ class Ui_Dialog(object):
         QWidget.setTabOrder(self.configLineEdit, self.configButton)
         QWidget.setTabOrder(self.configButton, self.ppcLineEdit)
         QWidget.setTabOrder(self.ppcLineEdit, self.ppcButton)
-        QWidget.setTabOrder(self.ppcButton, self.guiCheckBox)
+        QWidget.setTabOrder(self.ppcButton, self.cacheLineEdit)
+        QWidget.setTabOrder(self.cacheLineEdit, self.cacheButton)
+        QWidget.setTabOrder(self.cacheButton, self.guiCheckBox)
         QWidget.setTabOrder(self.guiCheckBox, self.buttonBox)
 
         self.retranslateUi(Dialog)
@@ -125,5 +147,8 @@ class Ui_Dialog(object):
         self.configButton.setText(QCoreApplication.translate("Dialog", u"...", None))
         self.ppcLabel.setText(QCoreApplication.translate("Dialog", u"Texture PC File:", None))
         self.ppcButton.setText(QCoreApplication.translate("Dialog", u"...", None))
+        self.cacheLabel.setText(QCoreApplication.translate("Dialog", u"Result Cache Dir:", None))
+        self.cacheLineEdit.setPlaceholderText(QCoreApplication.translate("Dialog", u"none (no caching)", None))
+        self.cacheButton.setText(QCoreApplication.translate("Dialog", u"...", None))
     # retranslateUi
 
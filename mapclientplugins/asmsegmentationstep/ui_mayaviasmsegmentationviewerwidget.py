@@ -225,6 +225,12 @@ class Ui_Dialog(object):
 
         self.fitButtonsGroup.addWidget(self.segButton, 0, 0, 1, 1)
 
+        self.stopButton = QPushButton(self.page_fitting)
+        self.stopButton.setObjectName(u"stopButton")
+        self.stopButton.setEnabled(False)
+
+        self.fitButtonsGroup.addWidget(self.stopButton, 2, 0, 1, 2)
+
 
         self.verticalLayout.addLayout(self.fitButtonsGroup)
 
@@ -257,6 +263,18 @@ class Ui_Dialog(object):
 
         self.formLayout_2.setWidget(1, QFormLayout.FieldRole, self.pFracLineEdit)
 
+        self.iterationLabel = QLabel(self.errorGroup)
+        self.iterationLabel.setObjectName(u"iterationLabel")
+
+        self.formLayout_2.setWidget(2, QFormLayout.LabelRole, self.iterationLabel)
+
+        self.iterationLineEdit = QLineEdit(self.errorGroup)
+        self.iterationLineEdit.setObjectName(u"iterationLineEdit")
+        self.iterationLineEdit.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        self.iterationLineEdit.setReadOnly(True)
+
+        self.formLayout_2.setWidget(2, QFormLayout.FieldRole, self.iterationLineEdit)
+
 
         self.verticalLayout.addWidget(self.errorGroup)
 
@@ -354,7 +372,8 @@ class Ui_Dialog(object):
         QWidget.setTabOrder(self.profileModelButton, self.searchDistSpinBox)
         QWidget.setTabOrder(self.searchDistSpinBox, self.maxItSpinBox)
         QWidget.setTabOrder(self.maxItSpinBox, self.segButton)
-        QWidget.setTabOrder(self.segButton, self.resetButton)
+        QWidget.setTabOrder(self.segButton, self.stopButton)
+        QWidget.setTabOrder(self.stopButton, self.resetButton)
         QWidget.setTabOrder(self.resetButton, self.abortButton)
         QWidget.setTabOrder(self.abortButton, self.acceptButton)
         QWidget.setTabOrder(self.acceptButton, self.RMSELineEdit)
@@ -391,12 +410,17 @@ class Ui_Dialog(object):
         self.resetButton.setText(QCoreApplication.translate("Dialog", u"Reset", None))
         self.abortButton.setText(QCoreApplication.translate("Dialog", u"Abort", None))
         self.segButton.setText(QCoreApplication.translate("Dialog", u"Segment", None))
+#if QT_CONFIG(tooltip)
+        self.stopButton.setToolTip(QCoreApplication.translate("Dialog", u"Stop the running segmentation and keep its best result so far", None))
+#endif // QT_CONFIG(tooltip)
+        self.stopButton.setText(QCoreApplication.translate("Dialog", u"Stop", None))
         self.errorGroup.setTitle(QCoreApplication.translate("Dialog", u"Segmentation Results", None))
         self.RMSELabel.setText(QCoreApplication.translate("Dialog", u"RMSE:", None))
 #if QT_CONFIG(whatsthis)
         self.pFracLabel.setWhatsThis(QCoreApplication.translate("Dialog", u"Percentage of landmarks that have converged to their texture match.", None))
 #endif // QT_CONFIG(whatsthis)
         self.pFracLabel.setText(QCoreApplication.translate("Dialog", u"Convergence %:", None))
+        self.iterationLabel.setText(QCoreApplication.translate("Dialog", u"Iteration:", None))
         self.toolBox.setItemText(self.toolBox.indexOf(self.page_fitting), QCoreApplication.translate("Dialog", u"Segmentation", None))
         self.pixelsXLabel.setText(QCoreApplication.translate("Dialog", u"Pixels X:", None))
         self.screenshotPixelXLineEdit.setText(QCoreApplication.translate("Dialog", u"800", None))
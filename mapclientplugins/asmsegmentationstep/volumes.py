@@ -0,0 +1,119 @@
+"""
+Scans whose image array is memory-mapped from disk.
+
+ASM segmentation only samples the image along short profiles around the
+model surface, so a memory-mapped image only has the pages around those
+profiles read into memory. This lets scans larger than RAM be segmented
+as long as nothing makes an in-memory copy of the whole image.
+"""
+import numpy as np
+
+from gias3.image_analysis import image_tools
+
+
+class VolumeError(Exception):
+    pass
+
+
+def openVolume(filename, shape=None, dtype=None, offset=0, order='C'):
+    """
+    Memory-map a volume read-only. .npy files are opened with np.load,
+    anything else is treated as a raw volume and needs shape and dtype.
+    """
+    if filename.lower().endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+
+    if shape is None or dtype is None:
+        raise VolumeError('raw volume {} needs a shape and dtype'.format(filename))
+    return np.memmap(filename, dtype=np.dtype(dtype), mode='r', shape=tuple(shape), offset=offset, order=order)
+
+
+def isOnDisk(I):
+    """
+    True if array I, or the array it is a view of, is memory-mapped.
+    """
+    while I is not None:
+        if isinstance(I, np.memmap):
+            return True
+        I = getattr(I, 'base', None)
+    return False
+
+
+def lazyScan(I, voxelSpacing=None, voxelOrigin=None, name='scan'):
+    """
+    An image_tools.Scan of image array I that does not read I.
+
+    Scan.setImageArray computes the image centre of mass and principal
+    axes, which reads the whole image and makes a 64-bit copy of it, so it
+    must not be used for memory-mapped images. The returned scan's CoM,
+    pAxes and M00 are not set.
+    """
+    scan = image_tools.Scan(name)
+    scan.I = I
+    scan.voxelSpacing = np.array(voxelSpacing if voxelSpacing is not None else [1.0, 1.0, 1.0], dtype=float)
+    scan.voxelOrigin = np.array(voxelOrigin if voxelOrigin is not None else [0.0, 0.0, 0.0], dtype=float)
+    return scan
+
+
+def loadVolumeScan(filename, voxelSpacing=None, voxelOrigin=None, name='scan', **rawArgs):
+    """
+    A lazyScan of the memory-mapped volume in filename. rawArgs (shape,
+    dtype, offset, order) are passed to openVolume for raw volumes.
+    """
+    return lazyScan(openVolume(filename, **rawArgs), voxelSpacing, voxelOrigin, name)
+
+
+def strideFor(shape, itemsize, maxMB):
+    """
+    Smallest integer stride along every axis so that a strided copy of an
+    array of the given shape and item size is at most maxMB.
+    """
+    nBytes = float(np.prod(shape)) * itemsize
+    maxBytes = maxMB * 2 ** 20
+    stride = 1
+    while nBytes / stride ** 3 > maxBytes:
+        stride += 1
+    return stride
+
+
+def proxyVolume(I, maxMB):
+    """
+    Subsampled copy of image I of at most maxMB, and its stride, for
+    display. Only the subsampled voxels are read, so I may be
+    memory-mapped or a flipped view. I is returned as is, with stride 1,
+    if it fits or maxMB is 0.
+    """
+    if maxMB <= 0:
+        return I, 1
+    stride = strideFor(I.shape, I.dtype.itemsize, maxMB)
+    if stride == 1:
+        return I, 1
+    return np.ascontiguousarray(I[::stride, ::stride, ::stride]), stride
+
+
+def imageSlice(I, axis, index):
+    """
+    Contiguous copy of slice index of image I along axis. Only the slice
+    is read, so I may be memory-mapped or a flipped view.
+    """
+    return np.ascontiguousarray(I[(slice(None),) * axis + (index,)])
+
+
+def indexAffine(scan, negSpacing=False, zShift=False):
+    """
+    Matrix A and offset b mapping physical coordinates p to the image
+    indices p.dot(A.T) + b that scan.coord2Index(p, zShift, negSpacing,
+    round_int=False) returns.
+    """
+    if scan.USE_DICOM_AFFINE:
+        M = np.asarray(scan.coord2IndexA, dtype=float)
+        return M[:3, :3].copy(), M[:3, 3].copy()
+
+    spacing = np.asarray(scan.voxelSpacing, dtype=float)
+    if negSpacing:
+        spacing = -spacing
+    A = np.diag(1.0 / spacing)
+    b = -np.asarray(scan.voxelOrigin, dtype=float) / spacing
+    if zShift:
+        b[2] += scan.I.shape[2]
+    return A, b
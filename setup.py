@@ -17,4 +17,9 @@ setup(name=u'mapclientplugins.asmsegmentationstep',
       install_requires=[
           # -*- Extra requirements: -*-
       ],
+      entry_points={
+          'console_scripts': [
+              'asmseg-batch = mapclientplugins.asmsegmentationstep.batch:main',
+          ],
+      },
       )
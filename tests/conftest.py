@@ -0,0 +1,84 @@
+"""
+Shared synthetic data for the tests: the synthetic shape model, a small
+synthetic scan, a texture model trained on it and the landmarks of the
+initial model. See synthetic.py and benchmark.py.
+"""
+import pytest
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import benchmark
+from mapclientplugins.asmsegmentationstep import synthetic
+
+SIZE = 32
+MESH_D = [6, 6]
+N_D = 20
+N_LIM = [-10.0, 10.0]
+N_PAD = 15
+
+
+@pytest.fixture(scope='session')
+def shape():
+    """
+    model, sphereParams and shapepcs of benchmark.initialModel.
+    """
+    return benchmark.initialModel(0)
+
+
+@pytest.fixture(scope='session')
+def scan():
+    return synthetic.testCase(SIZE)[0]
+
+
+@pytest.fixture(scope='session')
+def ppc(shape):
+    model, sphereParams, shapepcs = shape
+    return synthetic.trainPPCs(model, sphereParams, SIZE, [(MESH_D, N_D, N_LIM)])[0]
+
+
+@pytest.fixture(scope='session')
+def ppcFilename(ppc, tmp_path_factory):
+    return synthetic.savePPC(ppc, str(tmp_path_factory.mktemp('ppc') / 'synthetic.ppc'))
+
+
+@pytest.fixture
+def config(ppcFilename):
+    """
+    Segmentation params for the synthetic scan, with a few iterations.
+    """
+    config = benchmark.makeConfig(ppcFilename, MESH_D, N_D, N_PAD, 3, False)
+    config['ASM']['max_it'] = 3
+    return config
+
+
+@pytest.fixture(scope='session')
+def landmarks(shape):
+    """
+    Landmarks and normals of the initial model at MESH_D.
+    """
+    model = shape[0]
+    meshEval, normalEval = synthetic.landmarkEvaluators(model, MESH_D)
+    params = model.get_field_parameters()
+    return meshEval(params), normalEval(params)
+
+
+@pytest.fixture(scope='session')
+def giasASM(scan, landmarks):
+    """
+    gias3 ASMSegmentation that has sampled the initial model's profiles.
+    """
+    X, N = landmarks
+    asm = ASM.ASMSegmentation(scan, params=ASM.ASMSegmentationParams(ND=N_D, NLim=N_LIM, NPad=N_PAD),
+                              getMeshCoords=lambda x: X, getMeshNormals=lambda x: N)
+    asm._evaluateLandmarks(None)
+    asm._sampleImage()
+    return asm
+
+
+@pytest.fixture(scope='session')
+def elements(shape):
+    """
+    Landmark indices of each element of the initial model at MESH_D.
+    """
+    model = shape[0]
+    return model.getElementPointIPerTrueElement(MESH_D, list(model.ensemble_field_function.mesh.elements.keys()))
@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import batch
+
+
+@pytest.fixture
+def batchFiles(tmp_path, shape, scan, config):
+    """
+    The initial model, shape PCs, params and a two scan manifest written
+    to tmp_path.
+    """
+    model, sphereParams, shapepcs = shape
+    geof, ens, mesh = [str(tmp_path / ('model' + ext)) for ext in ('.geof', '.ens', '.mesh')]
+    model.save_geometric_field(geof, ens, mesh)
+    shapePCFile = str(tmp_path / 'model.pc')
+    shapepcs.save(shapePCFile)
+
+    ppcFile = config['data_files']['ppc_filename']
+    config.filename = str(tmp_path / 'params.ini')
+    config.write()
+
+    np.save(str(tmp_path / 'scan.npy'), scan.I)
+    entry = {'image': str(tmp_path / 'scan.npy'), 'voxel_spacing': list(scan.voxelSpacing),
+             'voxel_origin': list(scan.voxelOrigin)}
+    manifest = [dict(entry, name='a'), dict(entry, name='b')]
+    return (geof, ens, mesh), shapePCFile, config.filename, ppcFile, manifest
+
+
+def test_loadManifest(tmp_path):
+    filename = str(tmp_path / 'manifest.json')
+    with open(filename, 'w') as f:
+        json.dump([{'name': 'a', 'dicom_dir': 'a'}, {'name': 'b', 'image': 'b.npy'}], f)
+    assert [entry['name'] for entry in batch.loadManifest(filename)] == ['a', 'b']
+
+    with open(filename, 'w') as f:
+        json.dump([{'name': 'a', 'dicom_dir': 'a'}, {'name': 'a', 'image': 'b.npy'}], f)
+    with pytest.raises(asmseg.ParameterError):
+        batch.loadManifest(filename)
+
+
+def test_loadScan_no_image():
+    with pytest.raises(asmseg.ParameterError):
+        batch.loadScan({'name': 'a'})
+
+
+def test_summarise():
+    results = [
+        {'name': 'b', 'status': 'done', 'wallTime': 3.0},
+        {'name': 'a', 'status': 'done', 'wallTime': 1.0},
+        {'name': 'c', 'status': 'failed', 'error': 'x', 'wallTime': 10.0},
+    ]
+    summary = batch.summarise(results, 7200.0)
+    assert (summary['nScans'], summary['nDone'], summary['nFailed']) == (3, 2, 1)
+    assert summary['scansPerHour'] == 1.0
+    # failed scans do not count towards the per-scan wall times
+    assert (summary['scanWallTimeMean'], summary['scanWallTimeMin'], summary['scanWallTimeMax']) == (2.0, 1.0, 3.0)
+    assert [r['name'] for r in summary['results']] == ['a', 'b', 'c']
+
+    summary = batch.summarise(results[2:], 0.0)
+    assert summary['scansPerHour'] == 0.0 and summary['scanWallTimeMean'] is None
+
+
+def test_runBatch(tmp_path, batchFiles):
+    modelFiles, shapePCFile, paramFile, ppcFile, manifest = batchFiles
+    # a scan that cannot be loaded fails without stopping the batch
+    manifest.append({'name': 'missing', 'image': str(tmp_path / 'missing.npy')})
+    outputDir = str(tmp_path / 'out')
+    summary = batch.runBatch(manifest, modelFiles, shapePCFile, outputDir, paramFile, ppcFile,
+                             processes=1, verbose=False)
+
+    assert (summary['nDone'], summary['nFailed']) == (2, 1)
+    a, b, missing = summary['results']
+    assert missing['status'] == 'failed' and 'FileNotFoundError' in missing['error']
+    # every scan starts from the loaded model
+    assert a['segRMS'] == b['segRMS'] and a['iterations'] == b['iterations'] == 3
+    for name in ('a', 'b'):
+        for suffix in ('_field_parameters.npy', '_seg_xopt.npy', '_seg_data.npy', '_result.json'):
+            assert os.path.exists(os.path.join(outputDir, name + suffix))
+    with open(os.path.join(outputDir, 'a_result.json')) as f:
+        assert json.load(f) == a
+    with open(os.path.join(outputDir, batch.SUMMARY_FILENAME)) as f:
+        assert json.load(f)['nDone'] == 2
+
+
+def test_runBatch_write_failed(tmp_path, batchFiles):
+    modelFiles, shapePCFile, paramFile, ppcFile, manifest = batchFiles
+    # results of a scan named after a missing directory cannot be written
+    manifest[0]['name'] = os.path.join('missing', 'a')
+    outputDir = str(tmp_path / 'out')
+    summary = batch.runBatch(manifest, modelFiles, shapePCFile, outputDir, paramFile, ppcFile,
+                             processes=1, verbose=False)
+
+    assert (summary['nDone'], summary['nFailed']) == (1, 1)
+    assert [r['status'] for r in summary['results']] == ['done', 'failed']
+    assert os.path.exists(os.path.join(outputDir, batch.SUMMARY_FILENAME))
+
+
+def test_import_without_gui():
+    # the package and batch import without MAP Client and PySide6
+    code = ("import sys; sys.modules['mapclient'] = None; sys.modules['PySide6'] = None; "
+            "sys.path[:0] = {!r}; "
+            "import mapclientplugins.asmsegmentationstep.batch".format(sys.path))
+    subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,77 @@
+import copy
+
+import numpy as np
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import runner
+
+
+def _cancelAt(cancelToken, level, iteration, progress):
+    # callback recording progress, which cancels after the given iteration
+    def callback(p):
+        progress.append((p['level'], p['iteration']))
+        if (p['level'], p['iteration']) == (level, iteration):
+            cancelToken.cancel()
+    return callback
+
+
+def test_cancelled_before_start(shape, scan, config):
+    model = copy.deepcopy(shape[0])
+    params = model.get_field_parameters().copy()
+    cancelToken = asmseg.CancelToken()
+    cancelToken.cancel()
+    model, dataASM, meshParamsASM, asmOutput = asmseg.segment(scan, model, shape[2], config, cancelToken=cancelToken)
+
+    assert asmOutput['cancelled'] and meshParamsASM is None
+    assert len(dataASM) == 0
+    np.testing.assert_array_equal(model.get_field_parameters(), params)
+
+
+def test_cancelled_during_pass(shape, scan, config):
+    model = copy.deepcopy(shape[0])
+    params = model.get_field_parameters().copy()
+    I = scan.I.copy()
+    cancelToken = asmseg.CancelToken()
+    progress = []
+    model, dataASM, meshParamsASM, asmOutput = asmseg.segment(
+        scan, model, shape[2], config, callback=_cancelAt(cancelToken, 0, 1, progress), cancelToken=cancelToken)
+
+    # the pass stops at the next stage and returns the iteration it finished
+    assert progress == [(0, 1)]
+    assert asmOutput['cancelled'] and asmOutput['stopReason'] == 'cancelled'
+    assert meshParamsASM is not None and len(dataASM) > 0
+    assert not np.array_equal(model.get_field_parameters(), params)
+    np.testing.assert_array_equal(scan.I, I)
+
+    # a reset token segments again
+    cancelToken.reset()
+    asmOutput = asmseg.segment(scan, copy.deepcopy(shape[0]), shape[2], config, cancelToken=cancelToken)[3]
+    assert not asmOutput['cancelled'] and len(asmOutput['segHistory']['passFrac']) == 3
+
+
+def test_cancelled_between_levels(shape, scan, config):
+    config['pyramid']['enabled'] = True
+    config['pyramid']['level_0']['max_it'] = 2
+    config['pyramid']['level_1']['max_it'] = 2
+    cancelToken = asmseg.CancelToken()
+    progress = []
+    asmOutput = asmseg.segment(scan, copy.deepcopy(shape[0]), shape[2], config,
+                               callback=_cancelAt(cancelToken, 0, 2, progress), cancelToken=cancelToken)[3]
+
+    # the later levels are not run, the coarse level's result is returned
+    assert progress == [(0, 1), (0, 2)]
+    assert asmOutput['cancelled']
+    assert [level['downsample'] for level in asmOutput['pyramid']] == [4]
+    assert asmOutput['segXOpt'] is asmOutput['pyramid'][0]['segXOpt']
+
+
+def test_cancelled_in_process(shape, scan, config):
+    # the worker's token is cancelled as soon as this process starts waiting
+    cancelToken = asmseg.CancelToken()
+    cancelToken.cancel()
+    model, dataASM, meshParamsASM, asmOutput = runner.segmentInProcess(
+        scan, shape[0], shape[2], config, cancelToken=cancelToken)
+
+    assert asmOutput['cancelled'] and meshParamsASM is None
+    assert model is not shape[0]
+    np.testing.assert_array_equal(model.get_field_parameters(), shape[0].get_field_parameters())
@@ -0,0 +1,101 @@
+import copy
+
+import numpy as np
+import pytest
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import asmsolver
+
+
+def _earlyStop(history, **params):
+    solver = asmsolver.ASMSolver(params=ASM.ASMSegmentationParams(**params))
+    return solver._earlyStop(history)
+
+
+def _history(meshRMS, passFrac=None, paramDelta=None):
+    n = len(meshRMS)
+    return {
+        'meshRMS': list(meshRMS),
+        'passFrac': list(passFrac) if passFrac is not None else [0.5] * n,
+        'paramDelta': list(paramDelta) if paramDelta is not None else [1.0] * n,
+    }
+
+
+def test_disabled():
+    # every tolerance defaults to 0, which disables its criterion
+    history = _history([1.0] * 6, [0.5] * 6, [0.0] * 6)
+    assert _earlyStop(history, stopWindow=2) is None
+
+
+def test_paramDelta():
+    history = _history([3.0, 2.0], paramDelta=[1.0, 0.01])
+    assert _earlyStop(history, stopParamTol=0.05) == 'paramDelta'
+    assert _earlyStop(history, stopParamTol=0.01) is None
+    # needs no window of iterations
+    assert _earlyStop(_history([3.0], paramDelta=[0.01]), stopParamTol=0.05, stopWindow=3) == 'paramDelta'
+
+
+def test_rmsTolerance():
+    history = _history([5.0, 4.0, 3.99, 3.98])
+    assert _earlyStop(history, stopWindow=2, stopRMSTol=0.05) == 'rmsTolerance'
+    assert _earlyStop(history, stopWindow=2, stopRMSTol=0.01) is None
+    # the window reaches back to the larger improvement
+    assert _earlyStop(history, stopWindow=3, stopRMSTol=0.05) is None
+
+
+def test_rmsTolerance_worse():
+    # a mesh RMS that only gets worse over the window has not improved
+    history = _history([2.0, 2.5, 2.4])
+    assert _earlyStop(history, stopWindow=2, stopRMSTol=0.01) == 'rmsTolerance'
+
+
+def test_passFracStagnation():
+    history = _history([5.0, 4.0, 3.0, 2.0], passFrac=[0.5, 0.7, 0.65, 0.7])
+    assert _earlyStop(history, stopWindow=2, stopPFracTol=0.01) == 'passFracStagnation'
+    history['passFrac'][-1] = 0.75
+    assert _earlyStop(history, stopWindow=2, stopPFracTol=0.01) is None
+
+
+@pytest.mark.parametrize('window', [1, 2, 3])
+def test_window_needs_history(window):
+    # the latest window iterations are compared with the iteration before them
+    flat = dict(stopWindow=window, stopRMSTol=1.0, stopPFracTol=1.0)
+    assert _earlyStop(_history([1.0] * window), **flat) is None
+    assert _earlyStop(_history([1.0] * (window + 1)), **flat) == 'rmsTolerance'
+
+
+def test_window_zero():
+    # a window of 0 compares each iteration with the one before
+    history = _history([2.0, 1.95])
+    assert _earlyStop(history, stopWindow=0, stopRMSTol=0.1) == 'rmsTolerance'
+    assert _earlyStop(_history([2.0]), stopWindow=0, stopRMSTol=0.1) is None
+    assert _earlyStop(history, stopWindow=0, stopRMSTol=0.01) is None
+
+
+def test_first_criterion_wins():
+    history = _history([2.0, 2.0, 2.0], passFrac=[0.5, 0.5, 0.5], paramDelta=[0.0, 0.0, 0.0])
+    assert _earlyStop(history, stopWindow=1, stopParamTol=0.1, stopRMSTol=0.1, stopPFracTol=0.1) == 'paramDelta'
+    assert _earlyStop(history, stopWindow=1, stopRMSTol=0.1, stopPFracTol=0.1) == 'rmsTolerance'
+
+
+def test_paramDelta_landmark_displacement(shape, scan, ppc, config):
+    # paramDelta is how far the fit moves the landmarks, in mm, whether it
+    # translates, rotates or reshapes the model
+    model, sphereParams, shapepcs = shape
+    model = copy.deepcopy(model)
+    asmConfigs = config['ASM']
+    asmParams = asmseg._makeASMParams(asmConfigs, '', config['image']['z_shift'], config['image']['neg_spacing'],
+                                      False)
+    shapeModes = np.arange(asmConfigs['shape_modes'])
+    asm, meshEval, paramsEval, meshFit = asmseg._initialiseASM(
+        asmParams, ppc, model, shapepcs, shapeModes, asmConfigs['fit_mweight'], asmConfigs['fit_size'])
+    asmOutput = asmseg._runGFASM(asm, scan, model, shapepcs, shapeModes, paramsEval, False, False)
+
+    history = asmOutput['segHistory']
+    assert len(history['paramDelta']) == 3
+    for previous, params, paramDelta in zip(history['meshParams'], history['meshParams'][1:],
+                                            history['paramDelta'][1:]):
+        moved = np.linalg.norm(meshEval(params) - meshEval(previous), axis=1).max()
+        assert paramDelta == pytest.approx(moved)
@@ -0,0 +1,143 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import featurestore
+
+
+def _volume(seed=0, shape=(16, 16, 16)):
+    return np.random.default_rng(seed).normal(size=shape)
+
+
+def test_put_get(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    V = _volume()
+    assert store.get('k') is None
+    store.put('k', V, 'splineFilter', {'order': 3})
+
+    W = store.get('k')
+    assert isinstance(W, np.memmap)
+    assert not W.flags.writeable
+    np.testing.assert_array_equal(W, V)
+    assert W.dtype == V.dtype
+
+    entry = store.entries()['k']
+    assert entry['feature'] == 'splineFilter'
+    assert entry['params'] == {'order': '3'}
+    assert entry['shape'] == [16, 16, 16]
+    assert store.stats()['hits'] == 1 and store.stats()['misses'] == 1
+    # written through a temporary file that is replaced into place
+    assert sorted(os.listdir(str(tmp_path))) == ['index.json', 'k.npy']
+
+
+def test_volume(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    I = _volume()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return I * 2.0
+
+    V, stored = store.volume(I, 'double', {'factor': 2}, compute)
+    assert not stored
+    W, stored = store.volume(I, 'double', {'factor': 2}, compute)
+    assert stored and len(calls) == 1
+    np.testing.assert_array_equal(W, V)
+
+    # other parameters, or another image, are other volumes
+    store.volume(I, 'double', {'factor': 3}, compute)
+    store.volume(I + 1.0, 'double', {'factor': 2}, compute)
+    assert len(calls) == 3
+    assert len(store.entries()) == 3
+
+
+def test_volume_other_process(tmp_path):
+    # a second store on the same directory, as in another process, reads the volume
+    I = _volume()
+    featurestore.FeatureStore(str(tmp_path)).volume(I, 'double', {}, lambda: I * 2.0)
+    V, stored = featurestore.FeatureStore(str(tmp_path)).volume(I.copy(), 'double', {}, lambda: None)
+    assert stored
+    np.testing.assert_array_equal(V, I * 2.0)
+
+
+def test_digest_remembered(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    I = _volume()
+    digest = store.digest(I)
+    assert store._digests[id(I)][1] == digest
+    assert store.digest(I.copy()) == digest
+    key = id(I)
+    del I
+    assert key not in store._digests
+
+
+def test_evict(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    V = _volume()
+    for key in ('a', 'b', 'c'):
+        store.put(key, V)
+        time.sleep(0.01)
+    nBytes = store.entries()['a']['nBytes']
+
+    # 'a' is the least recently used, but a hit makes it the most
+    store.get('a')
+    store.setMaxMB(2.5 * nBytes / featurestore.MB)
+    assert sorted(store.entries()) == ['a', 'c']
+    assert not os.path.exists(store._path('b'))
+
+    # the volume just stored is kept even when it alone exceeds the store
+    store.setMaxMB(0.5 * nBytes / featurestore.MB)
+    assert store.entries() == {}
+    store.put('d', V)
+    store.put('e', V)
+    assert sorted(store.entries()) == ['e']
+    assert store.stats()['evictions'] == 4
+
+
+def test_reconcile_lost_index_entry(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    store.put('a', _volume(0))
+    store.put('b', _volume(1))
+
+    # an index update lost to another process, and a volume deleted by one
+    with open(os.path.join(str(tmp_path), 'index.json'), 'w') as f:
+        f.write('{}')
+    entries = store.entries()
+    assert sorted(entries) == ['a', 'b']
+    assert entries['a']['nBytes'] == os.path.getsize(store._path('a'))
+
+    os.remove(store._path('b'))
+    assert sorted(store.entries()) == ['a']
+    np.testing.assert_array_equal(store.get('a'), _volume(0))
+
+
+def test_unreadable_volume(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    with open(store._path('bad'), 'wb') as f:
+        f.write(b'not an npy file')
+    assert store.get('bad') is None
+    assert not os.path.exists(store._path('bad'))
+
+
+def test_clear(tmp_path):
+    store = featurestore.FeatureStore(str(tmp_path))
+    store.put('a', _volume())
+    store.clear()
+    assert store.entries() == {}
+    assert os.listdir(str(tmp_path)) == ['index.json']
+
+
+def test_storeFor(tmp_path):
+    assert featurestore.storeFor({}) is None
+    assert featurestore.storeFor({'feature_store': {'directory': ''}}) is None
+    config = {'feature_store': {'directory': str(tmp_path / 'store'), 'max_mb': 10.0}}
+    store = featurestore.storeFor(config)
+    assert store is featurestore.storeFor(config)
+    config['feature_store']['max_mb'] = 5.0
+    assert featurestore.storeFor(config) is store
+    assert store.maxBytes == int(5.0 * featurestore.MB)
+    with pytest.raises(featurestore.FeatureStoreError):
+        featurestore.FeatureStore('')
@@ -0,0 +1,132 @@
+import copy
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import landmarkdensity
+
+
+def _grid(n=4, nElements=2):
+    # n x n landmarks on each of nElements unit square elements side by side
+    u = np.linspace(0.0, 1.0, n)
+    square = np.array([(x, y, 0.0) for x in u for y in u])
+    points = np.vstack([square + [1.5 * i, 0.0, 0.0] for i in range(nElements)])
+    elements = [np.arange(i * n * n, (i + 1) * n * n) for i in range(nElements)]
+    return elements, points
+
+
+def test_spreadOrder():
+    points = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0], [3.0, 0.0, 0.0], [4.0, 0.0, 0.0]])
+    order = landmarkdensity.spreadOrder(points)
+    assert sorted(order) == list(range(5))
+    # the centre first, then the ends
+    assert order[0] == 2
+    assert sorted(order[1:3]) == [0, 4]
+    assert len(landmarkdensity.spreadOrder(np.zeros((0, 3)))) == 0
+
+
+def test_spreadOrder_spread():
+    elements, points = _grid(5)
+    square = points[elements[0]]
+    order = landmarkdensity.spreadOrder(square)
+    # the first 5 points are the centre and the corners
+    assert sorted(map(tuple, square[order[:5]].tolist())) == [
+        (0.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.5, 0.5, 0.0), (1.0, 0.0, 0.0), (1.0, 1.0, 0.0)]
+
+
+def test_passMask():
+    # profiles of 40 samples pass within 40 * 0.1 of the centre sample 20
+    matchInd = np.array([15, 16, 20, 24, 25, 0, 39])
+    np.testing.assert_array_equal(landmarkdensity.passMask(matchInd, 40, 0.1),
+                                  [False, True, True, True, False, False, False])
+
+
+def test_start_counts():
+    elements, points = _grid()
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25)
+    np.testing.assert_array_equal(density.counts, [4, 4])
+    assert density.activeMask().sum() == 8
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.1, minLandmarks=5)
+    np.testing.assert_array_equal(density.counts, [5, 5])
+    with pytest.raises(landmarkdensity.LandmarkDensityError):
+        landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.0)
+
+
+def test_refine_failed():
+    elements, points = _grid()
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25, failFactor=0.0, mFactor=np.inf)
+    landmarks = np.where(density.activeMask())[0]
+    passed = np.ones(len(landmarks), dtype=bool)
+    passed[landmarks >= 16] = False
+    refined = density.refine(landmarks, passed, np.ones(len(landmarks)))
+    np.testing.assert_array_equal(refined, [1])
+    np.testing.assert_array_equal(density.counts, [4, 8])
+    assert density.activeMask()[16:].sum() == 8
+
+
+
+@pytest.mark.parametrize('failed, refined', [
+    ([1, 1, 1, 4], [3]),
+    # elements are refined relative to the median element
+    ([2, 2, 2, 4], []),
+    # and only above failFrac
+    ([0, 0, 0, 1], []),
+])
+def test_refine_relative(failed, refined):
+    elements, points = _grid(nElements=4)
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25, failFrac=0.3, failFactor=2.0,
+                                              mFactor=np.inf)
+    landmarks = np.where(density.activeMask())[0]
+    passed = np.ones(len(landmarks), dtype=bool)
+    for i, nFailed in enumerate(failed):
+        passed[4 * i:4 * i + nFailed] = False
+    np.testing.assert_array_equal(density.refine(landmarks, passed, np.ones(len(landmarks))), refined)
+
+
+def test_refine_m():
+    elements, points = _grid(nElements=3)
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25, failFrac=1.0, mFactor=2.0)
+    landmarks = np.where(density.activeMask())[0]
+    m = np.where(landmarks < 16, 10.0, 1.0)
+    refined = density.refine(landmarks, np.ones(len(landmarks), dtype=bool), m)
+    np.testing.assert_array_equal(refined, [0])
+
+
+def test_refine_stops_at_full_density():
+    elements, points = _grid()
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25, failFactor=0.0, mFactor=np.inf)
+    for counts in ([8, 8], [16, 16], [16, 16]):
+        landmarks = np.where(density.activeMask())[0]
+        density.refine(landmarks, np.zeros(len(landmarks), dtype=bool), np.ones(len(landmarks)))
+        np.testing.assert_array_equal(density.counts, counts)
+
+
+def test_refine_skipped_element():
+    # elementmedian matching skips elements with too few valid landmarks,
+    # so the matched landmarks are not all the landmarks in use
+    elements, points = _grid()
+    density = landmarkdensity.AdaptiveDensity(elements, points, startFrac=0.25, failFactor=0.0, mFactor=np.inf)
+    active = np.where(density.activeMask())[0]
+    landmarks = active[active >= 16][::-1]
+    passed = np.zeros(len(landmarks), dtype=bool)
+    refined = density.refine(landmarks, passed, np.ones(len(landmarks)))
+    np.testing.assert_array_equal(refined, [1])
+    np.testing.assert_array_equal(density.counts, [4, 8])
+
+    with pytest.raises(landmarkdensity.LandmarkDensityError):
+        density.refine(active, passed, np.ones(len(landmarks)))
+
+
+def test_adaptive_segmentation(shape, scan, config):
+    # far fewer profiles are sampled for the same pass fraction
+    model, sphereParams, shapepcs = shape
+    config['ASM']['max_it'] = 10
+    outputs = []
+    for adaptive in (False, True):
+        config['ASM']['adaptive_landmarks'] = adaptive
+        outputs.append(asmseg.segment(scan, copy.deepcopy(model), shapepcs, config)[3])
+    full, adaptive = outputs
+
+    assert sum(adaptive['segHistory']['nLandmarks']) < 0.7 * sum(full['segHistory']['nLandmarks'])
+    assert adaptive['segPFrac'] > full['segPFrac'] - 0.02
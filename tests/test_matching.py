@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+# ASMSegmentation searches with asm_search_c, asm_search fails on Python 3
+from gias3.image_analysis import asm_search_c as asm_search
+
+from mapclientplugins.asmsegmentationstep import matching
+
+
+@pytest.fixture(scope='module', params=[0.5, 0.99])
+def modes(request, ppc):
+    return ppc.getModesFracVariance(request.param)
+
+
+@pytest.fixture(scope='module')
+def dP(giasASM):
+    dP = giasASM.dP.copy()
+    # an all zero profile is normalised to zero rather than nan
+    dP[3] = 0.0
+    return dP
+
+
+def test_matchPoints(ppc, modes, dP):
+    # a small chunk cap so landmarks are scored over several chunks
+    matcher = matching.TextureMatcher(ppc.L, modes, chunkMB=0.05)
+    landmarks = np.arange(0, len(dP), 2)
+    x, m, M = matcher.matchPoints(dP, landmarks)
+    xRef, mRef, MRef = asm_search.profileSearchElementPoints(landmarks, ppc.L, modes, dP)
+    np.testing.assert_array_equal(x, xRef)
+    np.testing.assert_allclose(m, mRef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(M, MRef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(matcher.distances(dP, landmarks), MRef, rtol=1e-8, atol=1e-10)
+
+
+def test_matchOneSide(ppc, modes, dP, elements):
+    matcher = matching.TextureMatcher(ppc.L, modes)
+    x, m, M, landmarks = matcher.matchOneSide(dP, elements)
+    xRef, mRef, MRef = asm_search.profileSearchElementOneSide(elements, ppc.L, modes, dP)
+    np.testing.assert_array_equal(x, xRef)
+    np.testing.assert_allclose(m, mRef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_array_equal(landmarks, np.hstack(elements))
+
+
+def test_matchElementMedian(ppc, modes, dP, elements):
+    matcher = matching.TextureMatcher(ppc.L, modes)
+    landmarkMask = np.random.RandomState(1).rand(len(dP)) > 0.2
+    # elements with too few valid landmarks are skipped
+    for e in elements[:3]:
+        landmarkMask[e[matching.MIN_ELEMENT_LANDMARKS - 1:]] = False
+    x, m, M, landmarks = matcher.matchElementMedian(dP, elements, landmarkMask, 1.0)
+    xRef, mRef, MRef = asm_search.profileSearchElementMedian(elements, ppc.L, modes, dP, landmarkMask, 1.0)
+    np.testing.assert_array_equal(x, xRef)
+    np.testing.assert_allclose(m, mRef, rtol=1e-8, atol=1e-10)
+    np.testing.assert_array_equal(landmarks, np.hstack([e[landmarkMask[e]] for e in elements[3:]
+                                                        if landmarkMask[e].sum() >= matching.MIN_ELEMENT_LANDMARKS]))
+    assert len(landmarks) < landmarkMask.sum()
+
+
+def test_findTroughs():
+    M = np.array([[3.0, 1.0, 2.0, 0.5, 1.0],
+                  [1.0, 2.0, 3.0, 4.0, 5.0]])
+    troughs = matching.findTroughs(M)
+    np.testing.assert_array_equal(troughs, [[False, True, False, True, False],
+                                            [True, False, False, False, False]])
+
+
+def test_mismatched_modes(ppc):
+    with pytest.raises(matching.MatchingError):
+        matching.TextureMatcher(ppc.L, ppc.getModesFracVariance(0.9)[:-1])
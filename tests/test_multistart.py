@@ -0,0 +1,148 @@
+import time
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import multistart
+
+
+class Model(object):
+
+    def __init__(self, params):
+        self.params = np.array(params, dtype=float)
+
+    def get_field_parameters(self):
+        return self.params
+
+    def set_field_parameters(self, params):
+        self.params = np.array(params, dtype=float)
+
+
+def _params(nNodes=6, nDerivs=3, seed=1):
+    return np.random.default_rng(seed).normal(size=(3, nNodes, nDerivs))
+
+
+def _segment(scan, model, shapepcs, config, cancelToken=None):
+    # segPFrac is the distance moved in x, so better starts move further
+    x = model.get_field_parameters()[0, :, 0].mean()
+    return model, None, None, {
+        'segRMS': 1.0, 'segPFrac': float(x), 'segHistory': {'passFrac': [x]},
+        'cancelled': cancelToken is not None and cancelToken.isCancelled(),
+    }
+
+
+def _segmentUntilCancelled(scan, model, shapepcs, config, cancelToken=None):
+    t0 = time.time()
+    while not cancelToken.isCancelled() and time.time() - t0 < 30.0:
+        time.sleep(0.01)
+    return _segment(scan, model, shapepcs, config, cancelToken)
+
+
+def _config(processes):
+    return {
+        'ASM': {'max_it': 10},
+        'general': {'verbose': True},
+        'multistart': {'enabled': True, 'starts': 4, 'translation': 5.0, 'rotation': 10.0,
+                       'processes': processes, 'seed': 3},
+    }
+
+
+def test_rotationMatrix():
+    R = multistart.rotationMatrix(np.radians([10.0, -20.0, 30.0]))
+    assert np.allclose(R.dot(R.T), np.eye(3))
+    assert np.isclose(np.linalg.det(R), 1.0)
+    assert np.allclose(multistart.rotationMatrix(np.radians([0.0, 0.0, 90.0])).dot([1.0, 0.0, 0.0]), [0.0, 1.0, 0.0])
+
+
+def test_perturbations():
+    starts = multistart.perturbations(5, 2.0, 15.0, shapeModes=2, shapeSD=1.5, seed=4)
+    assert len(starts) == 5
+    assert starts[0] == {'translation': [0.0] * 3, 'rotation': [0.0] * 3, 'shapeSD': [0.0] * 2}
+    for start in starts[1:]:
+        assert np.all(np.abs(start['translation']) <= 2.0)
+        assert np.all(np.abs(start['rotation']) <= 15.0)
+        assert len(start['shapeSD']) == 2 and np.all(np.abs(start['shapeSD']) <= 1.5)
+    assert starts == multistart.perturbations(5, 2.0, 15.0, shapeModes=2, shapeSD=1.5, seed=4)
+    with pytest.raises(multistart.MultiStartError):
+        multistart.perturbations(0, 1.0, 1.0)
+
+
+def test_perturbedParameters_rigid():
+    params = _params()
+    perturbation = {'translation': [1.0, -2.0, 0.5], 'rotation': [20.0, -10.0, 35.0]}
+    moved = multistart.perturbedParameters(params, None, perturbation)
+    assert moved.shape == params.shape
+
+    centroid = params[:, :, 0].mean(1)
+    movedCentroid = moved[:, :, 0].mean(1)
+    assert np.allclose(movedCentroid, centroid + perturbation['translation'])
+    assert np.allclose(np.linalg.norm(moved[:, :, 0] - movedCentroid[:, np.newaxis], axis=0),
+                       np.linalg.norm(params[:, :, 0] - centroid[:, np.newaxis], axis=0))
+
+    # derivatives are rotated but not translated
+    R = multistart.rotationMatrix(np.radians(perturbation['rotation']))
+    for k in range(1, params.shape[2]):
+        assert np.allclose(moved[:, :, k], R.dot(params[:, :, k]))
+    # the input is not modified
+    assert not np.shares_memory(moved, params)
+
+
+def test_perturbedParameters_identity():
+    params = _params()
+    assert np.allclose(multistart.perturbedParameters(params, None, {'translation': [0.0] * 3}), params)
+
+
+def test_bestStart():
+    results = [
+        {'index': 0, 'status': 'done', 'segPFrac': 0.8, 'segRMS': 2.0},
+        {'index': 1, 'status': 'done', 'segPFrac': 0.9, 'segRMS': 3.0},
+        {'index': 2, 'status': 'done', 'segPFrac': 0.9, 'segRMS': 1.5},
+        {'index': 3, 'status': 'failed', 'error': 'x'},
+        {'index': 4, 'status': 'done', 'segPFrac': 1.0, 'segRMS': np.nan},
+        {'index': 5, 'status': 'done', 'segPFrac': 0.5, 'segRMS': 1.0},
+    ]
+    # equal segPFrac goes to the lower segRMS, non-finite segRMS never wins
+    assert multistart.bestStart(results)['index'] == 2
+    assert multistart.bestStart(results, 'segRMS')['index'] == 5
+    assert multistart.bestStart(results[3:4]) is None
+    with pytest.raises(multistart.MultiStartError):
+        multistart.bestStart(results, 'segSD')
+
+
+def test_bestStart_ties_keep_first():
+    results = [{'index': i, 'status': 'done', 'segPFrac': 0.9, 'segRMS': 1.0} for i in range(3)]
+    assert multistart.bestStart(results)['index'] == 0
+    assert multistart.bestStart(results, 'segRMS')['index'] == 0
+
+
+def test_shortConfig():
+    config = _config(1)
+    short = multistart.shortConfig(config, 2)
+    assert short['ASM']['max_it'] == 2
+    assert not short['general']['verbose']
+    assert not short['multistart']['enabled'] and not short['pyramid']['enabled']
+    assert config['ASM']['max_it'] == 10
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_runStarts(processes):
+    params = _params()
+    model = Model(params)
+    results = multistart.runStarts(None, model, None, _config(processes), _segment)
+    assert [r['index'] for r in results] == [0, 1, 2, 3]
+    assert all(r['status'] == 'done' and not r['cancelled'] for r in results)
+    assert np.allclose(results[0]['fieldParameters'], params)
+    assert np.array_equal(model.get_field_parameters(), params)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_runStarts_cancelled(processes):
+    cancelToken = asmseg.CancelToken()
+    cancelToken.cancel()
+    # passes already running when the cancellation reaches the workers stop
+    # early, the rest are not run
+    results = multistart.runStarts(None, Model(_params()), None, _config(processes), _segmentUntilCancelled,
+                                   cancelToken=cancelToken)
+    assert len(results) < 4
+    assert all(r['cancelled'] for r in results)
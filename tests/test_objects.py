@@ -0,0 +1,80 @@
+import copy
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+
+
+def _objects(shape, n=2):
+    model, sphereParams, shapepcs = shape
+    return [{'name': 'object_{}'.format(k), 'model': copy.deepcopy(model), 'shapepcs': shapepcs}
+            for k in range(n)]
+
+
+def test_objectConfig(config):
+    newConfig = asmseg.objectConfig(config, {'name': 'femur', 'ppc_filename': 'femur.ppc', 'ASM': {'max_it': 7}})
+    assert newConfig['data_files']['ppc_filename'] == 'femur.ppc'
+    assert newConfig['ASM']['max_it'] == 7
+    # config is not modified
+    assert config['ASM']['max_it'] == 3
+    assert asmseg.objectConfig(config, {})['data_files']['ppc_filename'] == config['data_files']['ppc_filename']
+
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.objectConfig(config, {'name': 'femur', 'ASM': {'max_iterations': 7}})
+
+
+def test_objectsFromConfig(config):
+    config['objects']['femur'] = {'ppc_filename': 'femur.ppc', 'n_pad': 30}
+    objects = asmseg.objectsFromConfig(config, ['m0', 'm1'], ['p0', 'p1'])
+    assert [obj['name'] for obj in objects] == ['femur', 'object_1']
+    assert objects[0]['ppc_filename'] == 'femur.ppc' and objects[0]['ASM'] == {'n_pad': 30}
+    assert 'ASM' not in objects[1]
+    assert [(obj['model'], obj['shapepcs']) for obj in objects] == [('m0', 'p0'), ('m1', 'p1')]
+
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.objectsFromConfig(config, ['m0', 'm1'], ['p0'])
+    # more [objects] subsections than models
+    config['objects']['tibia'] = {}
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.objectsFromConfig(config, ['m0'], ['p0'])
+
+
+@pytest.mark.parametrize('workers', ['thread', 'process'])
+def test_segmentObjects(shape, scan, config, workers):
+    config['objects']['workers'] = workers
+    progress = []
+    objects = _objects(shape)
+    objects[1]['ASM'] = {'max_it': 2}
+    outputs = asmseg.segmentObjects(scan, objects, config, callback=progress.append)
+
+    assert [output[3]['name'] for output in outputs] == ['object_0', 'object_1']
+    assert [len(output[3]['segHistory']['passFrac']) for output in outputs] == [3, 2]
+    for obj, (model, dataASM, meshParamsASM, asmOutput) in zip(objects, outputs):
+        assert np.isfinite(asmOutput['segRMS']) and asmOutput['segPFrac'] > 0.5
+        assert asmOutput['sharedTimings'] is outputs[0][3]['sharedTimings']
+        assert asmOutput['profileFilename'] is None
+        if workers == 'thread':
+            assert model is obj['model']
+    # the same object from the same start segments the same in either worker
+    assert outputs[0][3]['segHistory']['passFrac'][:2] == outputs[1][3]['segHistory']['passFrac']
+    assert sorted(set((p['object'], p['name']) for p in progress)) == [(0, 'object_0'), (1, 'object_1')]
+
+
+def test_segmentObjects_parameters(shape, scan, config):
+    objects = _objects(shape)
+    objects[1]['ASM'] = {'max_iterations': 2}
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.segmentObjects(scan, objects, config)
+
+    config['objects']['workers'] = 'fibre'
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.segmentObjects(scan, _objects(shape), config)
+
+    config['objects']['workers'] = 'thread'
+    config['multistart']['enabled'] = True
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.segmentObjects(scan, _objects(shape), config)
+
+    with pytest.raises(asmseg.ParameterError):
+        asmseg.segmentObjects(scan, [], config)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import pointclouds
+
+
+def _points(n=5000, seed=0):
+    return np.random.default_rng(seed).uniform(0.0, 50.0, size=(n, 3))
+
+
+def test_cellIndices():
+    points = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.5], [1.5, 0.0, 0.0], [0.0, 0.0, 2.5]])
+    inverse, nCells = pointclouds.cellIndices(points, 1.0)
+    assert nCells == 3
+    assert inverse[0] == inverse[1]
+    assert len(set(inverse[[0, 2, 3]])) == 3
+
+
+@pytest.mark.parametrize('budget', [1, 10, 500, 4999])
+def test_decimate_budget(budget):
+    points = _points()
+    decimated, values = pointclouds.decimate(points, budget)
+    assert 0 < len(decimated) <= budget and values is None
+    # cell means stay within the cloud's bounds
+    assert np.all(decimated.min(0) >= points.min(0)) and np.all(decimated.max(0) <= points.max(0))
+    # the cell size is the smallest within the budget, so the budget is nearly used
+    if budget > 1:
+        assert len(decimated) > 0.5 * budget
+
+
+def test_decimate_means():
+    # two clusters far apart are each replaced by their mean
+    rng = np.random.default_rng(1)
+    a = rng.normal(0.0, 0.01, size=(100, 3))
+    b = rng.normal(10.0, 0.01, size=(50, 3))
+    values = np.concatenate([np.ones(100), np.full(50, 3.0)])
+    decimated, meanValues = pointclouds.decimate(np.vstack([a, b]), 2, values)
+    order = np.argsort(decimated[:, 0])
+    np.testing.assert_allclose(decimated[order], [a.mean(0), b.mean(0)])
+    np.testing.assert_allclose(meanValues[order], [1.0, 3.0])
+
+
+def test_decimate_within_budget():
+    points = _points(100)
+    values = np.arange(100.0)
+    decimated, decimatedValues = pointclouds.decimate(points, 100, values)
+    assert np.array_equal(decimated, points)
+    assert np.array_equal(decimatedValues, values)
+    # a budget of 0 keeps every point
+    assert len(pointclouds.decimate(points, 0)[0]) == 100
+
+
+def test_decimate_coincident_points():
+    points = np.ones((10, 3))
+    decimated, values = pointclouds.decimate(points, 2)
+    np.testing.assert_array_equal(decimated, [[1.0, 1.0, 1.0]])
+
+
+def test_decimate_errors():
+    with pytest.raises(pointclouds.PointCloudError):
+        pointclouds.decimate(_points(10), 5, np.ones(9))
+    with pytest.raises(pointclouds.PointCloudError):
+        pointclouds.decimate(_points(10), 0.5)
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from mapclientplugins.asmsegmentationstep import ppccache
+from mapclientplugins.asmsegmentationstep import synthetic
+
+
+@pytest.fixture
+def ppcFiles(tmp_path, ppc):
+    return [synthetic.savePPC(ppc, str(tmp_path / '{}.ppc'.format(name))) for name in 'abc']
+
+
+def test_get(ppcFiles, ppc):
+    cache = ppccache.PPCCache()
+    loaded, hit = cache.get(ppcFiles[0])
+    assert not hit
+    assert len(loaded.L) == len(ppc.L)
+    assert cache.get(ppcFiles[0]) == (loaded, True)
+    # the same file by another path is the same entry
+    assert cache.get(os.path.relpath(ppcFiles[0])) == (loaded, True)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 1, 1)
+    assert stats['nBytes'] == ppccache._ppcNBytes(loaded) > 0
+
+
+def test_lru(ppcFiles):
+    a, b, c = ppcFiles
+    cache = ppccache.PPCCache()
+    nBytes = ppccache._ppcNBytes(cache.get(a)[0])
+    cache.setMaxMB(2.5 * nBytes / 2 ** 20)
+    cache.get(b)
+    # a hit makes a the most recently used, so b is evicted for c
+    cache.get(a)
+    cache.get(c)
+    assert cache.stats()['evictions'] == 1
+    assert cache.get(a)[1] and cache.get(c)[1]
+    assert not cache.get(b)[1]
+
+    # the entry just loaded is kept even when it alone exceeds the budget
+    cache.setMaxMB(0.5 * nBytes / 2 ** 20)
+    assert cache.stats()['entries'] == 0
+    cache.get(a)
+    assert not cache.get(b)[1]
+    assert cache.stats()['entries'] == 1
+    assert cache.get(b)[1]
+
+
+def test_modified_file_reloaded(ppcFiles):
+    a = ppcFiles[0]
+    cache = ppccache.PPCCache()
+    first = cache.get(a)[0]
+    stat = os.stat(a)
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    second, hit = cache.get(a)
+    assert not hit and second is not first
+    # the stale version is dropped
+    assert cache.stats()['entries'] == 1
+    assert cache.get(a) == (second, True)
+
+
+def test_clear(ppcFiles):
+    cache = ppccache.PPCCache()
+    cache.get(ppcFiles[0])
+    cache.clear()
+    assert cache.stats()['entries'] == 0 and cache.stats()['nBytes'] == 0
+    assert not cache.get(ppcFiles[0])[1]
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(OSError):
+        ppccache.PPCCache().get(str(tmp_path / 'missing.ppc'))
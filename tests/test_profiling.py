@@ -0,0 +1,78 @@
+import os
+import pstats
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import profiling
+
+
+def test_stages():
+    timer = profiling.StageTimer()
+    timer.start()
+    with timer.stage('pass', level=0) as record:
+        for i in range(2):
+            with timer.stage('sampling', level=0, iteration=i):
+                time.sleep(0.01)
+        record['stored'] = True
+    timer.stop()
+
+    # records are in the order stages finish, with their tags
+    assert [r['stage'] for r in timer.records] == ['sampling', 'sampling', 'pass']
+    assert timer.records[1]['iteration'] == 1
+    assert timer.records[2]['stored'] and timer.records[2]['level'] == 0
+    assert all('peakMB' not in r for r in timer.records)
+
+    summary = timer.output()['summary']
+    assert summary['sampling']['count'] == 2
+    assert summary['sampling']['total'] >= 0.02
+    assert summary['sampling']['mean'] == pytest.approx(summary['sampling']['total'] / 2)
+    assert summary['pass']['total'] >= summary['sampling']['total']
+
+
+def test_stage_error_recorded():
+    timer = profiling.StageTimer()
+    with pytest.raises(ValueError):
+        with timer.stage('fitting'):
+            raise ValueError()
+    assert [r['stage'] for r in timer.records] == ['fitting']
+
+
+def test_peak_memory():
+    assert not tracemalloc.is_tracing()
+    timer = profiling.StageTimer(trackMemory=True)
+    timer.start()
+    with timer.stage('outer'):
+        with timer.stage('inner'):
+            a = np.ones(2 ** 20)  # 8 MB
+            del a
+        with timer.stage('small'):
+            b = np.ones(10)
+            del b
+    timer.stop()
+    assert not tracemalloc.is_tracing()
+
+    peaks = dict((r['stage'], r['peakMB']) for r in timer.records)
+    assert peaks['inner'] >= 8.0
+    assert peaks['small'] < 1.0
+    # an enclosing stage's peak includes its inner stages'
+    assert peaks['outer'] >= peaks['inner']
+    assert timer.summary()['inner']['peakMB'] == peaks['inner']
+
+
+def test_profileRun(tmp_path):
+    with profiling.profileRun('', str(tmp_path)) as output:
+        pass
+    assert output['filename'] is None and os.listdir(str(tmp_path)) == []
+
+    with profiling.profileRun('cProfile', str(tmp_path / 'profiles')) as output:
+        sum(range(1000))
+    assert os.path.dirname(output['filename']) == str(tmp_path / 'profiles')
+    assert output['filename'].endswith('.prof')
+    pstats.Stats(output['filename'])
+
+    with pytest.raises(profiling.ProfilingError):
+        with profiling.profileRun('gprof', str(tmp_path)):
+            pass
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import pyramid
+
+
+def _config(config, levels, enabled=True):
+    config['pyramid'] = {'enabled': enabled}
+    for name, levelConfig in levels:
+        config['pyramid'][name] = levelConfig
+    return config
+
+
+def test_blockMean():
+    I = np.arange(5 * 4 * 6, dtype=np.int16).reshape((5, 4, 6))
+    J = pyramid.blockMean(I, 2)
+    # the trailing slab that does not fill a block is dropped
+    assert J.shape == (2, 2, 3) and J.dtype == np.float32
+    assert J[1, 0, 2] == I[2:4, 0:2, 4:6].mean()
+    with pytest.raises(pyramid.PyramidError):
+        pyramid.blockMean(I, 5)
+
+
+def test_pyramidLevels(config):
+    assert pyramid.pyramidLevels(_config(config, [('coarse', {'downsample': 4})], enabled=False)) == []
+
+    config = _config(config, [('coarse', {'downsample': 4, 'n_pad': 40, 'max_it': 5}),
+                              ('fine', {'downsample': 2})])
+    levels = pyramid.pyramidLevels(config)
+    assert [(factor, ppcFilename) for factor, asmConfig, ppcFilename in levels] == [
+        (4, config['data_files']['ppc_filename']), (2, config['data_files']['ppc_filename'])]
+    assert (levels[0][1]['n_pad'], levels[0][1]['max_it']) == (40, 5)
+    assert levels[1][1] == dict(config['ASM'])
+    # [ASM] is not modified
+    assert config['ASM']['max_it'] == 3
+
+
+@pytest.mark.parametrize('levelConfig', [
+    {'downsample': 0},
+    {'downsample': 2, 'max_iterations': 5},
+    # changing the profiles needs a texture model trained for them
+    {'downsample': 2, 'n_d': 10},
+])
+def test_pyramidLevels_invalid(config, levelConfig):
+    with pytest.raises(pyramid.PyramidError):
+        pyramid.pyramidLevels(_config(config, [('coarse', levelConfig)]))
+
+
+def test_pyramidLevels_ppc_filename(config):
+    config = _config(config, [('coarse', {'downsample': 2, 'n_d': 10, 'ppc_filename': 'coarse.ppc'})])
+    [(factor, asmConfig, ppcFilename)] = pyramid.pyramidLevels(config)
+    assert asmConfig['n_d'] == 10 and ppcFilename == 'coarse.ppc'
+
+
+@pytest.mark.parametrize('factor', [1, 2, 3])
+def test_DownsampledScan_coordinates(scan, factor):
+    view = pyramid.DownsampledScan(scan, factor)
+    assert view.I.shape == tuple(np.array(scan.I.shape) // factor)
+    ind = np.array([[0, 0, 0], [1, 2, 3], [4, 5, 6]])
+    X = view.index2Coord(ind)
+    # a downsampled voxel is at the centre of the voxels it averages
+    np.testing.assert_allclose(X, scan.index2Coord(ind * factor + 0.5 * (factor - 1)))
+    np.testing.assert_allclose(view.coord2Index(X, round_int=False), ind)
+    np.testing.assert_array_equal(view.coord2Index(X), ind)
+    assert view.checkIndexInBounds(ind)
+    assert not view.checkIndexInBounds(np.array(view.I.shape))
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import resultcache
+
+
+class Scan(object):
+
+    def __init__(self, I):
+        self.I = I
+        self.voxelSpacing = [1.0, 1.0, 2.0]
+        self.voxelOrigin = [0.0, 0.0, 0.0]
+
+
+class Model(object):
+
+    def __init__(self, params):
+        self.params = np.array(params, dtype=float)
+
+    def get_field_parameters(self):
+        return self.params
+
+    def set_field_parameters(self, params):
+        self.params = np.array(params, dtype=float)
+
+
+class PCs(object):
+
+    def __init__(self):
+        self.mean = np.arange(6.0)
+        self.weights = np.array([2.0, 1.0])
+        self.modes = np.eye(6)[:, :2]
+
+
+def _config(**general):
+    config = {
+        'general': {'verbose': False, 'worker': False},
+        'ASM': {'max_it': 5, 'ppc_filename': ''},
+        'viewer': {'colour': 'red'},
+        'profiling': {'profiler': ''},
+        'result_cache': {'directory': 'a'},
+        'feature_store': {'directory': 'b'},
+    }
+    config['general'].update(general)
+    return config
+
+
+def _key(scan=None, model=None, config=None):
+    return resultcache.resultKey(scan or Scan(np.arange(64.0).reshape((4, 4, 4))),
+                                 model or Model(np.ones((3, 4, 1))), PCs(), config or _config())
+
+
+def test_resultKey_stable():
+    assert _key() == _key()
+    # section and key order do not matter
+    config = _config()
+    reordered = dict(reversed(list(config.items())))
+    reordered['general'] = {'worker': False, 'verbose': False}
+    assert _key(config=reordered) == _key()
+
+
+def test_resultKey_changes():
+    base = _key()
+    assert _key(scan=Scan(np.arange(64.0).reshape((4, 4, 4)) + 1)) != base
+    assert _key(model=Model(np.zeros((3, 4, 1)))) != base
+    config = _config()
+    config['ASM']['max_it'] = 6
+    assert _key(config=config) != base
+
+
+def test_resultKey_ignored():
+    base = _key()
+    config = _config(verbose=True, worker=True)
+    for section in resultcache.IGNORED_SECTIONS:
+        config[section] = {'changed': 1}
+    assert _key(config=config) == base
+    del config['viewer']
+    assert _key(config=config) == base
+
+
+def test_resultKey_ppc_file_contents(tmp_path):
+    ppcFile = tmp_path / 'texture.ppc'
+    ppcFile.write_bytes(b'first')
+    config = _config()
+    config['ASM']['ppc_filename'] = str(ppcFile)
+    first = _key(config=config)
+    ppcFile.write_bytes(b'second')
+    assert _key(config=config) != first
+
+
+def test_slabs():
+    small = np.zeros((10, 4, 4))
+    assert list(resultcache._slabs(small, 1.0, 0.5)) == list(range(10))
+    # 100 slabs of 8 kB: 64 kB samples 8 slabs, including the first and last
+    large = np.zeros((100, 32, 32))
+    slabs = resultcache._slabs(large, 0.5, 64.0 / 1024)
+    assert len(slabs) == 8
+    assert slabs[0] == 0 and slabs[-1] == 99
+    assert list(resultcache._slabs(np.zeros(()), 0.0, 0.0)) == [0]
+
+
+def test_hashArray_sampled_slabs():
+    def digest(I):
+        return resultcache.hashArray(hashlib.sha1(), I, 0.5, 64.0 / 1024).hexdigest()
+
+    I = np.zeros((100, 32, 32))
+    slabs = resultcache._slabs(I, 0.5, 64.0 / 1024)
+    unsampled = [k for k in range(100) if k not in slabs][0]
+    J = I.copy()
+    J[unsampled] = 1.0
+    assert digest(J) == digest(I)
+    J[slabs[1]] = 1.0
+    assert digest(J) != digest(I)
+    assert digest(I.astype(np.float32)) != digest(I)
+
+
+def test_put_get(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    assert cache.get('missing') is None
+    cache.put('k', (Model([1.0]), 'data', 'params', {'segRMS': 1.0}))
+    result = cache.get('k')
+    assert result[1:] == ('data', 'params', {'segRMS': 1.0})
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    # written through a temporary file that is replaced into place
+    assert [name for name in os.listdir(str(tmp_path))] == ['k' + resultcache._SUFFIX]
+
+
+def test_get_unreadable(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    path = tmp_path / ('bad' + resultcache._SUFFIX)
+    path.write_bytes(b'not a pickle')
+    assert cache.get('bad') is None
+    assert not path.exists()
+
+
+def test_put_failure_leaves_nothing(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    with pytest.raises(Exception):
+        cache.put('k', lambda: None)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_evict_lru(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    payload = np.zeros(2 ** 14)
+    now = time.time()
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, payload)
+        os.utime(cache._path(key), (now - 100 + i, now - 100 + i))
+    size = cache.entries()[0][1]
+
+    # 'a' is the least recently used, but a hit makes it the most
+    cache.get('a')
+    cache.maxBytes = 2 * size
+    cache.evict()
+    assert sorted(os.path.basename(e[0]) for e in cache.entries()) == ['a' + resultcache._SUFFIX,
+                                                                       'c' + resultcache._SUFFIX]
+    # the kept entry survives even when it alone exceeds the cache
+    cache.maxBytes = 0
+    cache.evict(keep='c')
+    assert [os.path.basename(e[0]) for e in cache.entries()] == ['c' + resultcache._SUFFIX]
+    assert cache.stats()['evictions'] == 2
+
+
+def test_segment_hit_sets_callers_model(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+    scan = Scan(np.arange(64.0).reshape((4, 4, 4)))
+    calls = []
+
+    def segmentFunc(scan, model, shapepcs, config):
+        calls.append(1)
+        model.set_field_parameters(model.get_field_parameters() + 1.0)
+        return model, 'data', 'params', {}
+
+    initParams = np.ones((3, 4, 1))
+    first = Model(initParams)
+    result = resultcache.segment(cache, scan, first, PCs(), _config(), segmentFunc)
+    assert result[0] is first
+    assert not result[3]['resultCache']['hit']
+
+    second = Model(initParams)
+    result = resultcache.segment(cache, scan, second, PCs(), _config(), segmentFunc)
+    assert len(calls) == 1
+    assert result[0] is second
+    assert result[3]['resultCache']['hit']
+    assert np.array_equal(second.get_field_parameters(), initParams + 1.0)
+
+
+def test_segment_cancelled_not_stored(tmp_path):
+    cache = resultcache.ResultCache(str(tmp_path))
+
+    def segmentFunc(scan, model, shapepcs, config):
+        return model, None, None, {'cancelled': True}
+
+    resultcache.segment(cache, Scan(np.zeros((2, 2, 2))), Model([0.0]), PCs(), _config(), segmentFunc)
+    assert cache.entries() == []
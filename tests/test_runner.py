@@ -0,0 +1,75 @@
+import multiprocessing
+import time
+
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import runner
+
+_worker = {}
+
+
+def _initWorker(progressQueue, cancelEvent):
+    _worker['progress'] = progressQueue
+    _worker['cancelToken'] = asmseg.CancelToken(cancelEvent)
+
+
+def _count(n):
+    for i in range(n):
+        _worker['progress'].put({'i': i})
+    return n
+
+
+def _untilCancelled(timeout):
+    t0 = time.time()
+    while not _worker['cancelToken'].isCancelled():
+        if time.time() - t0 > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _fail(x):
+    raise ValueError('bad {}'.format(x))
+
+
+def _pool(processes=1):
+    progressQueue = multiprocessing.Queue()
+    cancelEvent = multiprocessing.Event()
+    pool = multiprocessing.Pool(processes, initializer=_initWorker, initargs=(progressQueue, cancelEvent))
+    return pool, progressQueue, cancelEvent
+
+
+def test_checkWorker():
+    assert runner.checkWorker('process') == 'process'
+    with pytest.raises(runner.RunnerError):
+        runner.checkWorker('fibre')
+
+
+def test_runInPool_progress():
+    pool, progressQueue, cancelEvent = _pool(2)
+    progress = []
+    result = runner.runInPool(pool, pool.map_async(_count, [3, 4]), progressQueue, cancelEvent, progress.append)
+    assert result == [3, 4]
+    assert sorted(p['i'] for p in progress) == [0, 0, 1, 1, 2, 2, 3]
+
+
+def test_runInPool_without_progress():
+    pool = multiprocessing.Pool(1)
+    assert runner.runInPool(pool, pool.apply_async(abs, (-2,))) == 2
+
+
+def test_runInPool_cancel():
+    pool, progressQueue, cancelEvent = _pool()
+    cancelToken = asmseg.CancelToken()
+    cancelToken.cancel()
+    # the worker only returns once the cancellation reached it
+    assert runner.runInPool(pool, pool.apply_async(_untilCancelled, (30.0,)), progressQueue, cancelEvent,
+                            cancelToken=cancelToken)
+    assert cancelEvent.is_set()
+
+
+def test_runInPool_worker_error():
+    pool, progressQueue, cancelEvent = _pool()
+    with pytest.raises(ValueError, match='bad 1'):
+        runner.runInPool(pool, pool.apply_async(_fail, (1,)), progressQueue, cancelEvent)
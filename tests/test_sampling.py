@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import asmsolver
+from mapclientplugins.asmsegmentationstep import sampling
+
+from conftest import N_D, N_LIM, N_PAD
+
+
+def _solver(scan, landmarks, order, chunkMB=sampling.DEFAULT_CHUNK_MB):
+    X, N = landmarks
+    asm = asmsolver.ASMSolver(
+        scan, params=ASM.ASMSegmentationParams(ND=N_D, NLim=N_LIM, NPad=N_PAD, sampleOrder=order,
+                                               sampleChunkMB=chunkMB),
+        getMeshCoords=lambda x: X, getMeshNormals=lambda x: N,
+    )
+    asm._evaluateLandmarks(None)
+    asm._sampleImage()
+    return asm
+
+
+def test_trilinear_matches_gias(scan, landmarks, giasASM):
+    # a small chunk cap so profiles are sampled over several chunks
+    asm = _solver(scan, landmarks, 1, chunkMB=0.05)
+    np.testing.assert_allclose(asm.P, giasASM.P, rtol=1e-10, atol=1e-8)
+    np.testing.assert_allclose(asm.dP, giasASM.dP, rtol=1e-10, atol=1e-8)
+
+
+@pytest.mark.parametrize('order', [0, 3])
+def test_order_matches_map_coordinates(scan, landmarks, giasASM, order):
+    # gias3 only samples trilinearly, so other orders are checked at its sample points
+    coords = np.vstack(giasASM.XSampleImg).T
+    if order == 0:
+        upper = np.array(scan.I.shape)[:, np.newaxis] - 1
+        ind = np.clip(np.rint(coords), 0, upper).astype(int)
+        reference = scan.I[tuple(ind)].astype(float)
+    else:
+        reference = ndimage.map_coordinates(scan.I, coords, output=float, order=order, mode='nearest')
+    asm = _solver(scan, landmarks, order)
+    np.testing.assert_allclose(asm.P, reference.reshape(asm.P.shape), rtol=1e-10, atol=1e-8)
+
+
+def test_profileOffsets():
+    offsets = sampling.profileOffsets(N_D, N_LIM, N_PAD)
+    assert len(offsets) == N_D + 2 * N_PAD
+    np.testing.assert_allclose(offsets[[0, -1]], [-25.0, 25.0])
+
+
+def test_bad_order():
+    with pytest.raises(sampling.SamplingError):
+        sampling.ProfileSampler(order=6)
+
+
+def test_spline_filter_shared():
+    # samplers of later passes reuse the spline filtered image while the image exists
+    I = np.random.default_rng(0).normal(size=(12, 12, 12))
+    origins, directions, offsets = np.full((1, 3), 5.0), np.array([[1.0, 0.0, 0.0]]), np.arange(3.0)
+    P = sampling.ProfileSampler(order=3).sample(I, origins, directions, offsets)
+    key = (id(I), 3)
+    filtered = sampling._filtered[key][1]
+    sampler = sampling.ProfileSampler(order=3)
+    assert sampler._image(I) is filtered
+    np.testing.assert_array_equal(sampler.sample(I, origins, directions, offsets), P)
+    # but not another image, or another order
+    assert sampler._image(I.copy()) is not filtered
+    assert sampling.ProfileSampler(order=2)._image(I) is not filtered
+
+    del I
+    assert key not in sampling._filtered
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from gias3.image_analysis import asm_segmentation as ASM
+
+from mapclientplugins.asmsegmentationstep import asmsolver
+from mapclientplugins.asmsegmentationstep import roi
+from mapclientplugins.asmsegmentationstep import scanviews
+
+from conftest import N_D, N_LIM, N_PAD
+
+
+def _profiles(scan, landmarks):
+    X, N = landmarks
+    asm = asmsolver.ASMSolver(scan, params=ASM.ASMSegmentationParams(ND=N_D, NLim=N_LIM, NPad=N_PAD),
+                              getMeshCoords=lambda x: X, getMeshNormals=lambda x: N)
+    asm._evaluateLandmarks(None)
+    asm._sampleImage()
+    return asm.P
+
+
+def test_flipView(scan):
+    assert scanviews.flipView(scan, False, False, False) is scan
+    flipped = scanviews.flipView(scan, True, False, True)
+    assert flipped.I is scan.I
+    ind = np.array([[0, 1, 2], [5, 6, 7]])
+    upper = np.array(scan.I.shape) - 1
+    np.testing.assert_array_equal(flipped._flipIndices(ind), [[upper[0], 1, upper[2] - 2],
+                                                              [upper[0] - 5, 6, upper[2] - 7]])
+
+
+@pytest.mark.parametrize('copy', [True, False])
+def test_crop_of_flipped_scan(scan, landmarks, copy):
+    flipped = scanviews.FlippedScan(scan, (True, False, True))
+    padding = roi.searchDistance({'n_lim': N_LIM, 'n_d': N_D, 'n_pad': N_PAD}) + 2.0
+    cropped, crop = roi.cropToModel(flipped, landmarks[0], padding, copyMaxMB=1e3 if copy else 0.0)
+    assert crop is not None and crop['fraction'] < 1.0
+    assert crop['copied'] == copy
+
+    # the crop indexes the unflipped array
+    np.testing.assert_array_equal(cropped.I, scan.I[tuple(slice(a, b) for a, b in zip(crop['start'], crop['stop']))])
+    np.testing.assert_allclose(_profiles(cropped, landmarks), _profiles(flipped, landmarks), rtol=1e-12, atol=1e-12)
+
+
+def test_cropped_index_round_trip(scan, landmarks):
+    flipped = scanviews.FlippedScan(scan, (False, True, False))
+    cropped, crop = roi.cropToModel(flipped, landmarks[0], 2.0, copyMaxMB=1e3)
+    ind = cropped.coord2Index(landmarks[0], round_int=False)
+    np.testing.assert_allclose(ind + crop['start'], flipped.coord2Index(landmarks[0], round_int=False))
+    np.testing.assert_allclose(cropped.index2Coord(ind), landmarks[0], atol=1e-9)
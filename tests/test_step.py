@@ -0,0 +1,49 @@
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PySide6')
+pytest.importorskip('mapclient')
+
+from mapclientplugins.asmsegmentationstep import step  # noqa: E402
+
+
+@pytest.fixture
+def asmStep(tmp_path):
+    return step.ASMSegmentationStep(str(tmp_path))
+
+
+def test_parameter_snapshots(asmStep, shape):
+    model = copy.deepcopy(shape[0])
+    params = model.get_field_parameters().copy()
+    asmStep.setPortData(1, model)
+    assert asmStep._model is model
+    # snapshots, not the model's own array
+    np.testing.assert_array_equal(asmStep._paramsInit, params)
+    assert not np.shares_memory(asmStep._paramsInit, model.get_field_parameters())
+
+    segmented = params + 1.0
+    asmStep._setResult(segmented, np.zeros((1, 3)), None, {})
+    np.testing.assert_array_equal(model.get_field_parameters(), segmented)
+    np.testing.assert_array_equal(asmStep._paramsInit, params)
+
+    # the viewer redraws the model at other parameters, the output is the segmented model
+    model.set_field_parameters(params.copy())
+    assert asmStep.getPortData(3) is model
+    np.testing.assert_array_equal(model.get_field_parameters(), segmented)
+
+
+def test_parameter_snapshots_multi_object(asmStep, shape):
+    models = [copy.deepcopy(shape[0]) for k in range(2)]
+    asmStep.setPortData(1, models)
+    assert asmStep.isMultiObject()
+    assert len(asmStep._paramsInit) == 2
+
+    asmStep._paramsFinal = [p + k for k, p in enumerate(asmStep._paramsInit)]
+    for model in models:
+        model.set_field_parameters(model.get_field_parameters() * 0.0)
+    outputs = asmStep.getPortData(3)
+    assert outputs == models
+    for model, params in zip(outputs, asmStep._paramsFinal):
+        np.testing.assert_array_equal(model.get_field_parameters(), params)
@@ -0,0 +1,114 @@
+import collections
+
+import pytest
+
+from mapclientplugins.asmsegmentationstep import asmseg
+from mapclientplugins.asmsegmentationstep import sweep
+
+RANGES = {'shape_modes': [1, 2, 3], 'fit_mweight': [0.05, 0.1, 0.2, 0.4], 'n_pad': [10, 15]}
+
+
+@pytest.mark.parametrize('text, values', [
+    ('2:6', [2, 3, 4, 5, 6]),
+    ('0:10:5', [0, 5, 10]),
+    ('-3:-1', [-3, -2, -1]),
+    ('4:4', [4]),
+    ('0.5:1.0:0.25', [0.5, 0.75, 1.0]),
+    ('0:1:0.3', [0.0, 0.3, 0.6, 0.9]),
+    ('0.05, 0.1, 0.2', [0.05, 0.1, 0.2]),
+    ("'default', 'elementmedian'", ['default', 'elementmedian']),
+    ('[-10, 10], [-15, 15]', [[-10, 10], [-15, 15]]),
+    ('7', [7]),
+])
+def test_parseValues(text, values):
+    parsed = sweep.parseValues(text)
+    assert parsed == pytest.approx(values) if isinstance(values[0], float) else parsed == values
+    assert [type(v) for v in parsed] == [type(v) for v in values]
+
+
+@pytest.mark.parametrize('text', ['6:2', '1:5:0', '1:5:-1', 'default', '[1, 2', '', '1:2:3:4'])
+def test_parseValues_bad(text):
+    with pytest.raises(sweep.SweepError):
+        sweep.parseValues(text)
+
+
+def test_parseRanges():
+    ranges = sweep.parseRanges('shape_modes = 2:4\n\n# comment\n  fit_mweight = 0.05, 0.1\nn_lim = [-10, 10]')
+    assert ranges == {'shape_modes': [2, 3, 4], 'fit_mweight': [0.05, 0.1], 'n_lim': [[-10, 10]]}
+    with pytest.raises(sweep.SweepError):
+        sweep.parseRanges('shape_modes 2:4')
+    with pytest.raises(sweep.SweepError):
+        sweep.parseRanges('shape_modes = 4:2')
+
+
+def test_checkRanges():
+    config = {'ASM': {'shape_modes': 2}}
+    sweep.checkRanges({'shape_modes': [1], sweep.PPC_KEY: ['a.ppc']}, config)
+    with pytest.raises(sweep.SweepError):
+        sweep.checkRanges({'bogus': [1]}, config)
+    with pytest.raises(sweep.SweepError):
+        sweep.checkRanges({}, config)
+
+
+def test_sweepConfigs_grid():
+    configs = sweep.sweepConfigs(RANGES)
+    assert len(configs) == 24
+    assert len(set(tuple(sorted(c.items())) for c in configs)) == 24
+    assert configs[0] == {'shape_modes': 1, 'fit_mweight': 0.05, 'n_pad': 10}
+
+
+def test_sweepConfigs_random():
+    configs = sweep.sweepConfigs(RANGES, 'random', 10, seed=2)
+    assert len(configs) == 10
+    assert len(set(tuple(sorted(c.items())) for c in configs)) == 10
+    assert all(c in sweep.sweepConfigs(RANGES) for c in configs)
+    assert configs == sweep.sweepConfigs(RANGES, 'random', 10, seed=2)
+    assert configs != sweep.sweepConfigs(RANGES, 'random', 10, seed=3)
+    # no more samples than combinations
+    assert len(sweep.sweepConfigs(RANGES, 'random', 100)) == 24
+
+
+def test_sweepConfigs_lhs():
+    configs = sweep.sweepConfigs(RANGES, 'lhs', 12, seed=5)
+    assert len(configs) == 12
+    assert configs == sweep.sweepConfigs(RANGES, 'lhs', 12, seed=5)
+    # each value is used equally often when it divides the samples
+    for key, values in RANGES.items():
+        counts = collections.Counter(c[key] for c in configs)
+        assert sorted(counts) == sorted(values)
+        assert set(counts.values()) == {12 // len(values)}
+
+
+@pytest.mark.parametrize('mode, nSamples', [('random', 0), ('lhs', None), ('sobol', 4)])
+def test_sweepConfigs_bad(mode, nSamples):
+    with pytest.raises(sweep.SweepError):
+        sweep.sweepConfigs(RANGES, mode, nSamples)
+
+
+def test_applyOverrides():
+    config = {'ASM': {'shape_modes': 2, 'n_pad': 15}, 'data_files': {sweep.PPC_KEY: 'a.ppc'}}
+    newConfig = sweep.applyOverrides(config, {'n_pad': 10, sweep.PPC_KEY: 'b.ppc'})
+    assert newConfig['ASM'] == {'shape_modes': 2, 'n_pad': 10}
+    assert newConfig['data_files'][sweep.PPC_KEY] == 'b.ppc'
+    assert config['ASM']['n_pad'] == 15 and config['data_files'][sweep.PPC_KEY] == 'a.ppc'
+
+
+def test_runSweep_cancelled():
+    cancelToken = asmseg.CancelToken()
+    cancelToken.cancel()
+    results = []
+    assert sweep.runSweep(None, None, None, {'ASM': {'n_pad': 15}}, [{'n_pad': 10}, {'n_pad': 20}], processes=1,
+                          callback=results.append, cancelToken=cancelToken, initParams=[0.0]) == []
+    assert results == []
+
+
+def test_bestResult():
+    results = [
+        {'status': 'done', 'segRMS': 2.0, 'segPFrac': 0.9},
+        {'status': 'done', 'segRMS': 1.0, 'segPFrac': 0.8},
+        {'status': 'cancelled', 'segRMS': 0.5, 'segPFrac': 0.95},
+        {'status': 'failed', 'error': 'x'},
+    ]
+    assert sweep.bestResult(results) is results[1]
+    assert sweep.bestResult(results, 'segPFrac') is results[0]
+    assert sweep.bestResult(results[3:]) is None
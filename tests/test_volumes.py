@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.asmsegmentationstep import volumes
+
+
+def _volume(shape=(6, 5, 4)):
+    return np.arange(np.prod(shape), dtype=np.int16).reshape(shape)
+
+
+def test_openVolume_npy(tmp_path):
+    V = _volume()
+    filename = str(tmp_path / 'volume.npy')
+    np.save(filename, V)
+    W = volumes.openVolume(filename)
+    assert isinstance(W, np.memmap) and not W.flags.writeable
+    np.testing.assert_array_equal(W, V)
+    assert volumes.isOnDisk(W[::2, 1:])
+    assert not volumes.isOnDisk(V)
+
+
+@pytest.mark.parametrize('order', ['C', 'F'])
+def test_openVolume_raw(tmp_path, order):
+    V = _volume()
+    filename = str(tmp_path / 'volume.raw')
+    with open(filename, 'wb') as f:
+        # a header the offset skips
+        f.write(b'header')
+        f.write(V.astype('>i2').tobytes(order=order))
+    W = volumes.openVolume(filename, shape=V.shape, dtype='>i2', offset=6, order=order)
+    np.testing.assert_array_equal(W, V)
+
+    with pytest.raises(volumes.VolumeError):
+        volumes.openVolume(filename, shape=V.shape)
+
+
+def test_loadVolumeScan(tmp_path):
+    V = _volume()
+    filename = str(tmp_path / 'volume.npy')
+    np.save(filename, V)
+    scan = volumes.loadVolumeScan(filename, [0.5, 0.5, 2.0], [1.0, 2.0, 3.0], name='case')
+    assert scan.name == 'case' and volumes.isOnDisk(scan.I)
+    np.testing.assert_array_equal(scan.voxelSpacing, [0.5, 0.5, 2.0])
+    np.testing.assert_array_equal(volumes.loadVolumeScan(filename).voxelOrigin, [0.0, 0.0, 0.0])
+
+
+@pytest.mark.parametrize('negSpacing, zShift', [(False, False), (True, False), (False, True), (True, True)])
+def test_indexAffine(negSpacing, zShift):
+    scan = volumes.lazyScan(_volume(), [0.5, 0.8, 2.0], [10.0, -4.0, 3.0])
+    A, b = volumes.indexAffine(scan, negSpacing=negSpacing, zShift=zShift)
+    p = np.random.default_rng(0).uniform(-5.0, 15.0, size=(10, 3))
+    np.testing.assert_allclose(p.dot(A.T) + b,
+                               scan.coord2Index(p, z_shift=zShift, neg_spacing=negSpacing, round_int=False))
+
+
+def test_proxyVolume():
+    V = _volume((40, 40, 40))
+    assert volumes.proxyVolume(V, 0)[0] is V
+    assert volumes.proxyVolume(V, 1.0)[0] is V
+    maxMB = V.nbytes / 8.0 / 2 ** 20
+    proxy, stride = volumes.proxyVolume(V, maxMB)
+    assert stride == 2 and proxy.nbytes <= maxMB * 2 ** 20
+    np.testing.assert_array_equal(proxy, V[::2, ::2, ::2])
+    assert volumes.strideFor(V.shape, V.dtype.itemsize, maxMB * 0.99) == 3
+
+
+def test_imageSlice():
+    V = np.flip(_volume(), 0)
+    S = volumes.imageSlice(V, 1, 2)
+    assert S.flags.c_contiguous
+    np.testing.assert_array_equal(S, V[:, 2, :])